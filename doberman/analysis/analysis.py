@@ -2,18 +2,20 @@
 
 import sys
 import os
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
 from jenkinsapi.custom_exceptions import *
 from doberman.common.base import DobermanBase
 from crude_jenkins import Jenkins, Build
-from doberman.analysis.crude_weebl import WeeblClass
+from doberman.analysis.crude_weebl import WeeblClass, shared_weebl_client
+from doberman.analysis.regex_bank import RegexBank
+from doberman.analysis.checkpoints import BuildCheckpoints
+from doberman.analysis.triage_writer import TriageWriter
+from doberman.analysis.bugoccurrence_submitter import BugOccurrenceSubmitter
+from doberman.analysis.weebl_uri_cache import shared_weebl_uri_cache
 from doberman.common.CLI import CLI
-# <ACTIONPOINT>
-try:
-    from weeblclient.weebl import Weebl
-except ImportError as e:
-    pass
-#
 
 
 class CrudeAnalysis(DobermanBase):
@@ -22,16 +24,13 @@ class CrudeAnalysis(DobermanBase):
         doberman_start_time = datetime.now()
         self.cli = CLI().populate_cli() if not cli else cli
         self.jenkins = Jenkins(self.cli)
+        self.weebl = None
         # <ACTIONPOINT>
         if self.cli.use_weebl:
             self.cli.LOG.info("Connecting to Weebl @ {}"
                               .format(self.cli.weebl_url))
-            self.weebl = Weebl(
-                self.cli.uuid,
-                self.cli.environment,
-                username=self.cli.weebl_username,
-                apikey=self.cli.weebl_apikey,
-                weebl_url=self.cli.weebl_url)
+            # One client, shared by everything in this process:
+            self.weebl = shared_weebl_client(self.cli)
             self.weebl.weeblify_environment(
                 self.cli.jenkins_host, self.jenkins)
             if self.cli.database != 'None':
@@ -45,16 +44,56 @@ class CrudeAnalysis(DobermanBase):
         else:
             self.cli.bugs = None
         #
+        # Bug occurrences are submitted to Weebl in the background, with the
+        # uris they need cached (and kept between runs if configured to):
+        if self.weebl is not None:
+            self.cli.weebl_uris = shared_weebl_uri_cache(self.cli)
+            self.cli.bugoccurrences = BugOccurrenceSubmitter(
+                self.cli, self.weebl)
+        else:
+            self.cli.weebl_uris = None
+            self.cli.bugoccurrences = None
         self.weebl_tools = WeeblClass(self.cli)
         if self.cli.bugs is None:
             self.cli.bugs = self.weebl_tools.bugs
-        self.build_numbers = self.build_pl_ids_and_check(
-            self.jenkins, self.weebl_tools)
-        jobs_to_process = self.determine_jobs_to_process()
-        yamldict, problem_pipelines = self.pipeline_processor(jobs_to_process)
-        self.generate_output_files(yamldict, problem_pipelines)
+            self.cli.regex_bank = self.weebl_tools.regex_bank
+        else:
+            self.cli.regex_bank = RegexBank(self.cli.bugs)
+        if self.cli.checkpoint_dir:
+            # A checkpoint is only reused under the same output settings,
+            # and (when submitting to Weebl) against the same Weebl:
+            settings = [self.cli.reduced_output_text,
+                        self.cli.external_jenkins_url,
+                        self.cli.weebl_url if self.cli.use_weebl else None]
+            self.cli.checkpoints = BuildCheckpoints(
+                self.cli.LOG, self.cli.checkpoint_dir, self.cli.jenkins_host,
+                self.cli.bugs, self.cli.xmls, settings)
+        else:
+            self.cli.checkpoints = None
+        self.start_prefetching()
+        try:
+            self.build_numbers = self.build_pl_ids_and_check(
+                self.jenkins, self.weebl_tools,
+                on_resolved=self.prefetch_resolved)
+            jobs_to_process = self.determine_jobs_to_process()
+            triage_writer, problem_pipelines = \
+                self.pipeline_processor(jobs_to_process)
+            self.generate_output_files(triage_writer, problem_pipelines)
+        finally:
+            if self.prefetcher is not None:
+                self.prefetcher.close()
+            # Submit whatever was queued, even if the run went wrong:
+            if self.cli.bugoccurrences is not None:
+                self.cli.bugoccurrences.close()
+                self.cli.LOG.info(self.cli.bugoccurrences.report())
+                self.cli.weebl_uris.save()
+                self.cli.LOG.info(self.cli.weebl_uris.report())
+        self.cli.LOG.info(self.cli.regex_bank.prefilter_report())
+        if self.cli.checkpoints is not None:
+            self.cli.LOG.info(self.cli.checkpoints.report())
         if not self.cli.offline_mode:
             self.remove_dirs(self.cli.job_names)
+        self.cli.LOG.info(self.jenkins.connection_report())
         doberman_finish_time = datetime.now()
         self.cli.LOG.info(
             self.report_time_taken(doberman_start_time, doberman_finish_time))
@@ -70,48 +109,30 @@ class CrudeAnalysis(DobermanBase):
 
     def pipeline_processor(self, jobs_to_process):
         self.message = 0
-        yamldict = {}  # Dict containing info to be written to each job's yaml
         problem_pipelines = []
 
+        # Each job's yaml is written a pipeline at a time, as they finish:
         if jobs_to_process:
-            for job_name in jobs_to_process:
-                yamldict[job_name] = {}
+            triage_writer = TriageWriter(self.cli.reportdir, jobs_to_process)
         else:
-            yamldict['yamldict'] = {}
+            triage_writer = TriageWriter(self.cli.reportdir, ['yamldict'])
 
         progmsg = "Scanning of files is {}% complete."
 
-        for pos, pipeline_id in enumerate(self.pipeline_ids):
-            job_dict = {}
-            self.pipeline = pipeline_id
-
-            if self.build_numbers == {}:
-                raise Exception("Empty build numbers dictionary")
-
-            # Get pipeline data then process each:
-            build_numbers = self.build_numbers[pipeline_id]
-
-            # Get pipeline data then process each:
-            prev_class = None
-
-            for job in jobs_to_process:
-                if build_numbers == '*':
-                    build_num = pipeline_id
-                else:
-                    build_num = build_numbers.get(job)
-                if build_num is None:
-                    continue
-
-                jdict = job_dict[job] if job in job_dict else {}
+        if not self.cli.offline_mode:
+            self.prefetch_builds(jobs_to_process)
+        if self.cli.use_weebl:
+            self.cli.build_uuids = self.weebl_tools.get_build_uuids(
+                self.builds_to_process(jobs_to_process))
 
-                # Pull console and artifacts from jenkins:
-                build_obj = Build(build_num, job, self.jenkins, jdict,
-                                  self.cli, pipeline_id, prev_class)
-                job_dict[job] = build_obj.yaml_dict
-                prev_class = build_obj
+        if self.build_numbers == {} and self.pipeline_ids:
+            raise Exception("Empty build numbers dictionary")
 
+        for pos, (pipeline_id, job_dict, messages) in enumerate(
+                self.analysed_pipelines(jobs_to_process)):
+            for message in messages:
                 if self.message != 1:
-                    self.message = getattr(build_obj, 'message', self.message)
+                    self.message = message
 
             # Notify user of progress:
             pgr = self.calculate_progress(pos, self.pipeline_ids)
@@ -122,24 +143,185 @@ class CrudeAnalysis(DobermanBase):
             pl_proc_msg += "{0} and is returning a value of {1}.\n\n"
             self.cli.LOG.info(pl_proc_msg.format(pipeline_id, self.message))
 
-            # Merge dictionaries (necessary for multiple pipelines):
-            for job_name in yamldict:
-                yd = yamldict[job_name].get('pipeline', {})
-                if job_name in job_dict:
-                    jd = job_dict[job_name].get('pipeline', {})
-                else:
-                    jd = {}
-                to_write_to_file = self.join_dicts(yd, jd)
-                yamldict[job_name]['pipeline'] = to_write_to_file
+            for job_name in job_dict:
+                if job_name in triage_writer.files:
+                    triage_writer.write(
+                        job_name, job_dict[job_name].get('pipeline', {}))
 
         self.cli.LOG.info(progmsg.format(100))
-        return (yamldict, problem_pipelines)
+        return (triage_writer, problem_pipelines)
+
+    def analyse_pipeline(self, pipeline_id, jobs_to_process):
+        """ Process each of a pipeline's builds in turn, returning
+            (pipeline_id, {job: yaml dict}, [each build's message]).
+        """
+        job_dict = {}
+        messages = []
+        self.pipeline = pipeline_id
+
+        # Get pipeline data then process each:
+        build_numbers = self.build_numbers[pipeline_id]
+
+        # Get pipeline data then process each:
+        prev_class = None
+
+        for job in jobs_to_process:
+            if build_numbers == '*':
+                build_num = pipeline_id
+            else:
+                build_num = build_numbers.get(job)
+            if build_num is None:
+                continue
+
+            jdict = job_dict[job] if job in job_dict else {}
+
+            # Pull console and artifacts from jenkins:
+            build_obj = Build(build_num, job, self.jenkins, jdict,
+                              self.cli, pipeline_id, prev_class, self.weebl)
+            job_dict[job] = build_obj.yaml_dict
+            prev_class = build_obj
+            messages.append(getattr(build_obj, 'message', None))
+        return (pipeline_id, job_dict,
+                [message for message in messages if message is not None])
 
-    def generate_output_files(self, yamldict, problem_pipelines):
-        # Export to yaml:
-        rdir = self.cli.reportdir
-        for job_name in yamldict:
-            self.export_to_yaml(yamldict[job_name], job_name, rdir)
+    def analysed_pipelines(self, jobs_to_process):
+        """ Yield the result of analyse_pipeline for each pipeline, in order.
+            With more than one worker, the pipelines are analysed on a pool of
+            processes, each of which is handed this CrudeAnalysis (and with it
+            the bugs database) just once, when it starts.
+        """
+        workers = min(self.cli.workers, len(self.pipeline_ids))
+        if workers <= 1:
+            for pipeline_id in self.pipeline_ids:
+                yield self.analyse_pipeline(pipeline_id, jobs_to_process)
+            return
+        self.cli.LOG.info("Analysing {0} pipelines with {1} workers".format(
+            len(self.pipeline_ids), workers))
+        pool = multiprocessing.Pool(workers, initializer=init_worker,
+                                    initargs=(self, jobs_to_process))
+        try:
+            for (result, counts, learned) in pool.imap(analyse_in_worker,
+                                                       self.pipeline_ids):
+                self.add_counts(counts)
+                if learned:
+                    self.cli.weebl_uris.merge(learned)
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    def counted(self):
+        """ [(object, [attribute, ...]), ...] for the running totals kept by
+            the checkpoints, bug occurrence submitter and Weebl uri cache (if
+            there are any).
+        """
+        counted = []
+        if self.cli.checkpoints is not None:
+            counted.append((self.cli.checkpoints, ['reused', 'saved']))
+        if getattr(self.cli, 'bugoccurrences', None) is not None:
+            counted.append((self.cli.bugoccurrences,
+                            BugOccurrenceSubmitter.COUNTS))
+        if getattr(self.cli, 'weebl_uris', None) is not None:
+            counted.append((self.cli.weebl_uris, ['hits', 'misses']))
+        return counted
+
+    def counts(self):
+        """ The running totals kept by the regex bank and everything in
+            counted().
+        """
+        counts = list(self.cli.regex_bank.prefilter_counts())
+        for (totals, names) in self.counted():
+            counts += [getattr(totals, name) for name in names]
+        return counts
+
+    def add_counts(self, counts):
+        """ Add the totals from a worker process to this one's. """
+        self.cli.regex_bank.evaluated += counts[0]
+        self.cli.regex_bank.avoided += counts[1]
+        counts = list(counts[2:])
+        for (totals, names) in self.counted():
+            for name in names:
+                setattr(totals, name, getattr(totals, name) + counts.pop(0))
+
+    def builds_to_process(self, jobs_to_process, build_numbers=None):
+        """ Return [(pipeline, job, build number), ...] for every build to
+            be processed (of the pipelines in build_numbers, if given), but
+            not already checkpointed.
+        """
+        if build_numbers is None:
+            (pipeline_ids, pl_build_numbers) = (self.pipeline_ids,
+                                                self.build_numbers)
+        else:
+            (pipeline_ids, pl_build_numbers) = (sorted(build_numbers),
+                                                build_numbers)
+        builds = []
+        for pipeline_id in pipeline_ids:
+            build_numbers = pl_build_numbers.get(pipeline_id, {})
+            for job in jobs_to_process:
+                if build_numbers == '*':
+                    build_num = pipeline_id
+                else:
+                    build_num = build_numbers.get(job)
+                if build_num is None:
+                    continue
+                build_dir = os.path.join(self.cli.reportdir, job, build_num)
+                if self.cli.checkpoints is not None and \
+                        self.cli.checkpoints.has(job, build_num, pipeline_id,
+                                                 build_dir):
+                    continue
+                builds.append((pipeline_id, job, build_num))
+        return builds
+
+    def start_prefetching(self):
+        """ Set up the background downloads of prefetch_resolved, before
+            any pipelines are found.
+        """
+        self.prefetch_lock = threading.Lock()
+        self.prefetches = []
+        self.prefetched = set()
+        self.prefetcher = None if self.cli.offline_mode else ThreadPool(1)
+
+    def prefetch_resolved(self, build_numbers):
+        """ Start downloading the builds of some pipelines in the
+            background, as soon as their build numbers are known (i.e. while
+            the rest of the pipelines are still being found). Called both
+            from the thread finding the pipelines and from the one looking up
+            their build numbers.
+        """
+        if self.prefetcher is None:
+            return
+        with self.prefetch_lock:
+            builds = [build for build in self.builds_to_process(
+                self.determine_jobs_to_process(), build_numbers)
+                if build not in self.prefetched]
+            self.prefetched.update(builds)
+            self.prefetches.append(self.prefetcher.apply_async(
+                self.jenkins.prefetch_triage_data, (builds,)))
+
+    def prefetch_builds(self, jobs_to_process):
+        """ Download the data for every build to be processed concurrently,
+            before any of them are analysed: first waiting for those started
+            by prefetch_resolved, then downloading the rest. (No need to
+            download builds that have already been scanned.)
+        """
+        if self.prefetcher is not None:
+            with self.prefetch_lock:
+                (prefetcher, self.prefetcher) = (self.prefetcher, None)
+            try:
+                for prefetch in self.prefetches:
+                    prefetch.get()
+            finally:
+                prefetcher.close()
+                prefetcher.join()
+        self.jenkins.prefetch_triage_data(
+            [build for build in self.builds_to_process(jobs_to_process)
+             if build not in self.prefetched])
+
+    def generate_output_files(self, triage_writer, problem_pipelines):
+        # Finish off the yamls:
+        for filename in triage_writer.close():
+            self.cli.LOG.info("{} written to {}.".format(
+                filename, os.path.abspath(self.cli.reportdir)))
 
         # Write to file any pipelines (+ deploy build) that failed processing:
         if not problem_pipelines == []:
@@ -162,13 +344,6 @@ class CrudeAnalysis(DobermanBase):
 
         self.log_pipelines()
 
-    def export_to_yaml(self, yaml_dict, job, reportdir):
-        """ Write output files. """
-        filename = 'triage_' + job + '.yml'
-        if not yaml_dict:
-            yaml_dict['pipeline'] = {}
-        self.write_output_yaml(reportdir, filename, yaml_dict)
-
     def log_pipelines(self):
         # Record which pipelines were processed in a yaml:
         if self.cli.logpipelines:
@@ -186,6 +361,47 @@ class CrudeAnalysis(DobermanBase):
                 self.cli.LOG.info(info_msg.format(file_path))
 
 
+# The CrudeAnalysis and jobs each worker process analyses pipelines with:
+_worker = {}
+
+
+def init_worker(analysis, jobs_to_process):
+    """ Runs in each worker process as it starts. """
+    # Don't share the parent's connections to jenkins or Weebl:
+    if analysis.jenkins.requester is not None:
+        analysis.jenkins.requester.reset()
+    if analysis.weebl is not None:
+        analysis.cli.weebl = None
+        analysis.weebl = shared_weebl_client(analysis.cli)
+        analysis.cli.bugoccurrences = BugOccurrenceSubmitter(
+            analysis.cli, analysis.weebl)
+        # Pass the Weebl uris this worker looks up back to the parent, which
+        # saves them:
+        analysis.cli.weebl_uris.learned = []
+    _worker['analysis'] = analysis
+    _worker['jobs_to_process'] = jobs_to_process
+
+
+def analyse_in_worker(pipeline_id):
+    """ Returns the result of analysing a pipeline, how much this added to
+        the running totals (see CrudeAnalysis.counts) and the Weebl uris it
+        looked up (see WeeblUriCache.take_learned).
+    """
+    analysis = _worker['analysis']
+    before = analysis.counts()
+    result = analysis.analyse_pipeline(pipeline_id,
+                                       _worker['jobs_to_process'])
+    # The pool may end this process once it has returned, so don't leave any
+    # bug occurrences unsubmitted:
+    if analysis.cli.bugoccurrences is not None:
+        analysis.cli.bugoccurrences.flush()
+    counts = [after - was for (after, was) in zip(analysis.counts(), before)]
+    learned = []
+    if analysis.cli.weebl_uris is not None:
+        learned = analysis.cli.weebl_uris.take_learned()
+    return (result, counts, learned)
+
+
 def main():
     crude = CrudeAnalysis()
     return crude.message
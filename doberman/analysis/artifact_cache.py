@@ -0,0 +1,201 @@
+import os
+import yaml
+import shutil
+import hashlib
+import tempfile
+import threading
+
+
+class ArtifactCache(object):
+    """
+    A persistent, on-disk cache of the consoles and artifacts downloaded from
+    jenkins, shared by every run (and tool) given the same cache_dir, so that
+    repeated runs over overlapping pipelines never download the same file
+    twice.
+
+    Files are stored once each, by the sha256 of their content, under
+    objects/, and each (jenkins host, job, build number, artifact path) key
+    is a small file under keys/ naming the content it maps to. Both are
+    written to a temporary file and renamed into place, so concurrent workers
+    (or runs) never see a half-written entry.
+
+    Each time a file is used its modification time is updated, and when the
+    cache grows beyond max_bytes the least recently used files are removed
+    until it is back under LOW_WATER of the cap, so that the cache is only
+    walked once in a while rather than for every file stored. Keys whose
+    content has been removed are misses, and are tidied up at the same time.
+
+    A manifest of what was downloaded for a whole build can also be kept, so
+    that a build can be restored without asking jenkins anything about it.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    LOW_WATER = 0.9
+
+    def __init__(self, LOG, cache_dir, max_bytes=None):
+        self.LOG = LOG
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.keys_dir = os.path.join(cache_dir, 'keys')
+        for directory in [self.objects_dir, self.keys_dir]:
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evicted = 0
+        self.size = sum([size for (path, size, used) in self.objects()])
+
+    def key(self, host, job, build_num, path):
+        return "{0} {1} {2} {3}".format(host.rstrip('/'), job, build_num, path)
+
+    def key_path(self, key):
+        return os.path.join(self.keys_dir, hashlib.sha1(key).hexdigest())
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def objects(self):
+        """ Return [(path, size, last used), ...] for every cached file. """
+        found = []
+        for (dirpath, dirnames, filenames) in os.walk(self.objects_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # Evicted by someone else
+                found.append((path, stat.st_size, stat.st_mtime))
+        return found
+
+    def lookup(self, key):
+        """ The path to the content cached for key, or None. """
+        try:
+            with open(self.key_path(key), 'r') as key_file:
+                digest = key_file.read().strip()
+        except IOError:
+            return
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            return path
+
+    def fetch(self, key, dest):
+        """ Copy the content cached for key to dest. Returns True if it was
+            in the cache.
+        """
+        path = self.lookup(key)
+        if path is not None:
+            try:
+                shutil.copyfile(path, dest)
+                os.utime(path, None)
+            except (IOError, OSError):
+                path = None  # Evicted by someone else
+        with self.lock:
+            if path is None:
+                self.misses += 1
+                return False
+            self.hits += 1
+            self.bytes_saved += os.path.getsize(dest)
+        return True
+
+    def store(self, key, src):
+        """ Add the file at src to the cache, under key. """
+        sha = hashlib.sha256()
+        with open(src, 'rb') as src_file:
+            for chunk in iter(lambda: src_file.read(self.CHUNK_SIZE), ''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            os.utime(path, None)  # Already have this content
+        else:
+            self.write_atomically(path, lambda tmp: shutil.copyfile(src, tmp))
+            with self.lock:
+                self.size += os.path.getsize(path)
+        self.write_atomically(self.key_path(key),
+                              lambda tmp: self.write_digest(tmp, digest))
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self.evict()
+
+    def store_manifest(self, key, entries):
+        """ Add a list of [artifact path, filename] entries, under key. """
+        (handle, tmp) = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as manifest_file:
+                manifest_file.write(yaml.safe_dump(entries))
+            self.store(key, tmp)
+        finally:
+            os.remove(tmp)
+
+    def load_manifest(self, key):
+        """ The entries stored by store_manifest under key, or None. """
+        path = self.lookup(key)
+        if path is None:
+            return
+        try:
+            with open(path, 'r') as manifest_file:
+                return yaml.safe_load(manifest_file)
+        except (IOError, yaml.YAMLError):
+            return
+
+    def write_digest(self, path, digest):
+        with open(path, 'w') as key_file:
+            key_file.write(digest)
+
+    def write_atomically(self, path, write):
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+        (handle, tmp) = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        os.close(handle)
+        try:
+            write(tmp)
+            os.rename(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def evict(self):
+        """ Remove the least recently used files until the cache is back
+            under LOW_WATER of max_bytes, then any keys left without content.
+        """
+        with self.lock:
+            cached = sorted(self.objects(), key=lambda obj: obj[2])
+            self.size = sum([size for (path, size, used) in cached])
+            for (path, size, used) in cached:
+                if self.size <= self.max_bytes * self.LOW_WATER:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass  # Evicted by someone else
+                self.size -= size
+                self.evicted += 1
+            for filename in os.listdir(self.keys_dir):
+                if filename.startswith('.tmp'):
+                    continue
+                key_path = os.path.join(self.keys_dir, filename)
+                try:
+                    with open(key_path, 'r') as key_file:
+                        digest = key_file.read().strip()
+                    if not os.path.exists(self.object_path(digest)):
+                        os.remove(key_path)
+                except (IOError, OSError):
+                    pass
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = (100.0 * self.hits / total) if total else 0
+        msg = "Artifact cache: {0} of {1} files cached ({2:.1f}% hit rate), "
+        msg += "{3:.1f} MB not downloaded, {4} evicted, {5:.1f} MB in cache"
+        return msg.format(self.hits, total, rate,
+                          self.bytes_saved / 1024.0 / 1024.0, self.evicted,
+                          self.size / 1024.0 / 1024.0)
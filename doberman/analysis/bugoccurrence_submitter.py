@@ -0,0 +1,244 @@
+import time
+import Queue
+import threading
+from collections import namedtuple
+from doberman.analysis.download_pool import DownloadPool
+from doberman.analysis.crude_weebl import shared_weebl_client
+from doberman.analysis.weebl_uri_cache import shared_weebl_uri_cache
+# <ACTIONPOINT>
+try:
+    from weeblclient.exception import UnrecognisedInstance
+    from weeblclient.exception import InstanceAlreadyExists
+except ImportError as e:
+    pass
+#
+
+BugOccurrence = namedtuple(
+    'BugOccurrence', 'build_number jobname pipeline testcase_name '
+    'testcaseclass_name testframework_name testframework_version test_result '
+    'regex_uuid')
+
+
+def shared_bugoccurrence_submitter(cli, weebl=None):
+    """ The BugOccurrenceSubmitter for this process (see
+        shared_weebl_client).
+    """
+    if getattr(cli, 'bugoccurrences', None) is None:
+        cli.bugoccurrences = BugOccurrenceSubmitter(
+            cli, weebl or shared_weebl_client(cli))
+    return cli.bugoccurrences
+
+
+class BugOccurrenceSubmitter(object):
+    """
+    Submits bug occurrences to Weebl from a background thread, so that
+    scanning builds never waits on Weebl.
+
+    Occurrences are added to a queue, skipping any already added. The thread
+    takes them off it in batches of up to batch_size (waiting no more than
+    batch_wait seconds for a batch to fill). For each batch it looks up the
+    uri of each distinct regex and test case instance just once (creating the
+    test case instance if Weebl does not have it yet), then creates the bug
+    occurrences. Both are done concurrently, on a DownloadPool (whose
+    threads are started with the background thread and shared by every
+    batch), which also retries any call that fails. Test case instance uris
+    that were found are remembered for later batches, and regex uris and
+    test case uuids are kept in the process's WeeblUriCache.
+
+    flush() waits for everything queued so far to be submitted, and close()
+    does the same and stops the thread.
+    """
+
+    # The running totals, as reported:
+    COUNTS = ['queued', 'duplicates', 'submitted', 'already_there', 'failed']
+
+    def __init__(self, cli, weebl, batch_size=50, batch_wait=0.5):
+        self.cli = cli
+        self.weebl = weebl
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.pool = DownloadPool(cli.LOG, cli.download_workers,
+                                 cli.downloads_per_host, cli.download_retries)
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.added = set()
+        self.uris = shared_weebl_uri_cache(cli)
+        self.regex_uris = {}
+        self.testcaseinstance_uris = {}
+        self.queued = 0
+        self.duplicates = 0
+        self.submitted = 0
+        self.already_there = 0
+        self.failed = 0
+
+    def add(self, occurrence):
+        """ Queue a BugOccurrence to be submitted (unless it already was). """
+        with self.lock:
+            if occurrence in self.added:
+                self.duplicates += 1
+                return
+            self.added.add(occurrence)
+            self.queued += 1
+            if self.thread is None:
+                self.pool.start()
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+        self.queue.put(occurrence)
+
+    def flush(self):
+        """ Wait until everything queued so far has been submitted. """
+        self.queue.join()
+
+    def close(self):
+        """ Submit everything still queued, then stop the thread. """
+        if self.thread is None:
+            return
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.pool.close()
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            first = self.queue.get()
+            if first is None:
+                stopping = True
+            else:
+                batch.append(first)
+            deadline = time.time() + self.batch_wait
+            while not stopping and len(batch) < self.batch_size:
+                try:
+                    occurrence = self.queue.get(
+                        timeout=max(deadline - time.time(), 0))
+                except Queue.Empty:
+                    break
+                if occurrence is None:
+                    stopping = True
+                else:
+                    batch.append(occurrence)
+            settled = self.settled()
+            try:
+                if batch:
+                    self.submit_batch(batch)
+            except Exception as e:
+                self.cli.LOG.error("Could not submit bug occurrences: {}"
+                                   .format(e))
+                # Only those not already counted one way or the other:
+                unsettled = len(batch) - (self.settled() - settled)
+                with self.lock:
+                    self.failed += unsettled
+            finally:
+                for _ in range(len(batch) + (1 if stopping else 0)):
+                    self.queue.task_done()
+
+    def submit_batch(self, batch):
+        regex_uuids = set([occurrence.regex_uuid for occurrence in batch])
+        self.pool.map(self.look_up_regex, list(regex_uuids))
+        testcases = {}
+        for occurrence in batch:
+            key = self.testcaseinstance_key(occurrence)
+            if key not in self.testcaseinstance_uris:
+                testcases[key] = occurrence
+        self.pool.map(self.look_up_testcaseinstance, testcases.values())
+        self.pool.map(self.create_bugoccurrence, batch)
+
+    def settled(self):
+        """ How many occurrences have been submitted, found to be there
+            already or failed.
+        """
+        with self.lock:
+            return self.submitted + self.already_there + self.failed
+
+    def testcaseinstance_key(self, occurrence):
+        return occurrence[:-2]
+
+    def look_up_regex(self, regex_uuid):
+        self.regex_uris[regex_uuid] = self.uris.get(
+            'knownbugregex', regex_uuid, lambda: self.pool.call(
+                self.cli.weebl_url,
+                lambda: self.weebl
+                .get_knownbugregex_resource_uri_from_regex_uuid(regex_uuid),
+                "uri of regex {}".format(regex_uuid)))
+
+    def look_up_testcaseinstance(self, occurrence):
+        uri = self.pool.call(self.cli.weebl_url,
+                             lambda: self.get_testcaseinstance_uri(occurrence),
+                             "test case instance of {} build {}".format(
+                                 occurrence.jobname, occurrence.build_number))
+        # (Not remembered if the lookup failed, so a later batch tries again)
+        if uri is not None:
+            self.testcaseinstance_uris[
+                self.testcaseinstance_key(occurrence)] = uri
+
+    def get_testcaseinstance_uri(self, occurrence):
+        try:
+            return self.weebl.get_testcaseinstance_resource_uri(
+                occurrence.build_number, occurrence.testcase_name,
+                occurrence.testcaseclass_name, occurrence.testframework_name,
+                occurrence.testframework_version)
+        except UnrecognisedInstance:
+            testcase = (occurrence.testframework_name,
+                        occurrence.testframework_version,
+                        occurrence.testcaseclass_name,
+                        occurrence.testcase_name)
+            testcase_uuid = self.uris.get(
+                'testcase', testcase, lambda: self.weebl
+                .set_up_test_framework_caseclass_and_case(*testcase))
+            testcaseinstance = self.weebl.create_testcaseinstance(
+                self.get_build_uuid(occurrence), testcase_uuid,
+                occurrence.pipeline, occurrence.test_result)
+            return self.weebl.get_testcaseinstance_uri_from_uuid(
+                testcaseinstance)
+
+    def get_build_uuid(self, occurrence):
+        build_uuids = getattr(self.cli, 'build_uuids', None) or {}
+        key = (str(occurrence.build_number), occurrence.jobname,
+               occurrence.pipeline)
+        if key in build_uuids:
+            return build_uuids[key]
+        return self.weebl.get_build_uuid_from_build_id_job_and_pipeline(
+            occurrence.build_number, occurrence.jobname, occurrence.pipeline)
+
+    def create_bugoccurrence(self, occurrence):
+        testcaseinstance_uri = self.testcaseinstance_uris.get(
+            self.testcaseinstance_key(occurrence))
+        knownbugregex_uri = self.regex_uris.get(occurrence.regex_uuid)
+        if testcaseinstance_uri is None or knownbugregex_uri is None:
+            with self.lock:
+                self.failed += 1
+            return
+
+        def create():
+            try:
+                self.weebl.create_bugoccurrence(
+                    testcaseinstance_uri, knownbugregex_uri)
+                return True
+            except InstanceAlreadyExists:
+                return False
+
+        created = self.pool.call(self.cli.weebl_url, create,
+                                 "bug occurrence of regex {}".format(
+                                     occurrence.regex_uuid))
+        with self.lock:
+            if created is None:
+                self.failed += 1
+            elif created:
+                self.submitted += 1
+            else:
+                self.already_there += 1
+        if created is False:
+            msg = "There is already a bug occurrence logged for regex: '{}' "
+            msg += "in testcaseinstance: '{}'"
+            self.cli.LOG.warn(
+                msg.format(knownbugregex_uri, testcaseinstance_uri))
+
+    def report(self):
+        msg = "{0} bug occurrences queued ({1} duplicates skipped): {2} "
+        msg += "submitted to Weebl, {3} already there, {4} failed"
+        return msg.format(self.queued, self.duplicates, self.submitted,
+                          self.already_there, self.failed)
@@ -0,0 +1,175 @@
+import os
+import mmap
+from glob import glob
+from lxml import etree
+from collections import namedtuple
+
+# One <failure> or <error> in an xunit file, and the test it belongs to:
+XunitFailure = namedtuple('XunitFailure', 'classname name tag message')
+
+
+class BuildFiles(object):
+    """
+    Per-build file-content layer. Each artifact in a build directory is read
+    from disk once and the same buffer is then shared between every bug (and
+    every and/or dict) that targets it, rather than being re-read for each
+    bug. Likewise, each distinct target file glob is only expanded once per
+    build directory. Keeps a tally of how much was read so the I/O can be
+    reported.
+
+    Files bigger than stream_above bytes (if given) are not meant to be read
+    whole, but a window at a time, so that memory use does not grow with the
+    size of the file. Each window holds roughly chunk_size bytes of new lines
+    plus the last overlap_lines lines of the window before it.
+
+    With use_mmap, files are memory-mapped (read only) rather than copied into
+    a str, so the OS page cache holds the one copy of each artifact, however
+    many workers are scanning it. A mmap can be searched with regexps and
+    find() just like a str can, but use text() where a real str is needed.
+
+    Xunit files are likewise only parsed once per build, into a list of the
+    failures and errors in them (see xunit_failures).
+    """
+
+    def __init__(self, path, stream_above=None, chunk_size=8 * 1024 * 1024,
+                 overlap_lines=100, use_mmap=False):
+        self.path = path
+        self.use_mmap = use_mmap
+        self.stream_above = stream_above
+        self.chunk_size = chunk_size
+        self.overlap_lines = overlap_lines
+        self.contents = {}
+        self.globs = {}
+        self.failures = {}
+        self.files_read = 0
+        self.bytes_read = 0
+
+    def glob(self, target_file):
+        """ Return the files in this build matching target_file, only
+            expanding each glob the first time it is asked for.
+        """
+        if target_file not in self.globs:
+            self.globs[target_file] = glob(os.path.join(self.path,
+                                                        target_file))
+        return self.globs[target_file]
+
+    def read(self, target_location):
+        """ Return the contents of target_location, only reading it from disk
+            the first time it is asked for.
+        """
+        if target_location not in self.contents:
+            with open(target_location, 'r') as grep_me:
+                if self.use_mmap:
+                    text = self.map(grep_me)
+                else:
+                    text = grep_me.read()
+            self.contents[target_location] = text
+            self.files_read += 1
+            self.bytes_read += len(text)
+        return self.contents[target_location]
+
+    def map(self, grep_me):
+        """ Map an open file, or return '' if it is empty (as a zero-length
+            file cannot be mapped).
+        """
+        if os.fstat(grep_me.fileno()).st_size == 0:
+            return ''
+        return mmap.mmap(grep_me.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def text(self, target_location):
+        """ As read, but always a str. """
+        return self.read(target_location)[:]
+
+    def xunit_failures(self, target_location):
+        """ Return an XunitFailure for every <failure> then every <error> in
+            the xunit file target_location (as xpath('.//failure') followed by
+            xpath('.//error') would find them), parsing the file the first
+            time it is asked for. Elements are discarded as soon as they have
+            been parsed, so the whole tree is never held in memory. Returns
+            None if the file cannot be parsed.
+        """
+        if target_location not in self.failures:
+            found = {'failure': [], 'error': []}
+            try:
+                for event, elem in etree.iterparse(target_location,
+                                                   huge_tree=True):
+                    if elem.tag in found:
+                        parent = elem.getparent()
+                        found[elem.tag].append(XunitFailure(
+                            parent.get('classname'), parent.get('name'),
+                            elem.tag, elem.get('message')))
+                    # Finished with this element and everything in it:
+                    elem.clear()
+                    # (The root has no parent, but may have comments or
+                    # processing instructions before it.)
+                    parent = elem.getparent()
+                    while parent is not None and \
+                            elem.getprevious() is not None:
+                        del parent[0]
+            except etree.XMLSyntaxError:
+                self.failures[target_location] = None
+            else:
+                self.failures[target_location] = \
+                    found['failure'] + found['error']
+        return self.failures[target_location]
+
+    def streams(self, target_location):
+        """ Whether target_location should be scanned a window at a time. """
+        if self.stream_above is None:
+            return False
+        try:
+            return os.path.getsize(target_location) > self.stream_above
+        except OSError:
+            return False
+
+    def windows(self, target_location):
+        """ Yield overlapping windows of target_location's text, each ending
+            at the end of a line (or of the file).
+        """
+        carry = ''
+        with open(target_location, 'r') as grep_me:
+            self.files_read += 1
+            while True:
+                chunk = grep_me.read(self.chunk_size)
+                if not chunk:
+                    break
+                if not chunk.endswith('\n'):
+                    # Finish the line, so the next window starts on a new one:
+                    chunk += grep_me.readline()
+                self.bytes_read += len(chunk)
+                window = carry + chunk
+                yield window
+                carry = last_lines(window, self.overlap_lines)
+
+    def tail(self, target_location):
+        """ The last window of target_location, for when all of it is too
+            much to hold on to.
+        """
+        with open(target_location, 'r') as grep_me:
+            start = max(0, os.path.getsize(target_location) - self.chunk_size)
+            grep_me.seek(start)
+            if start:
+                grep_me.readline()
+            return grep_me.read()
+
+    def report(self):
+        return ("{0} bytes {1} from {2} files in {3}"
+                .format(self.bytes_read, 'mapped' if self.use_mmap else 'read',
+                        self.files_read, os.path.abspath(self.path)))
+
+    def close(self):
+        """ Release the shared buffers once the build has been scanned. """
+        for text in self.contents.values():
+            if isinstance(text, mmap.mmap):
+                text.close()
+        self.contents = {}
+
+
+def last_lines(text, count):
+    """ The last count lines of text (which ends with a newline). """
+    end = len(text) - 1
+    for line in range(count):
+        end = text.rfind('\n', 0, end)
+        if end < 0:
+            return text
+    return text[end + 1:]
@@ -0,0 +1,222 @@
+import os
+import yaml
+import hashlib
+import tempfile
+import threading
+from doberman.__init__ import __version__
+from doberman.analysis.build_files import BuildFiles
+
+
+class BuildCheckpoints(object):
+    """
+    Saves the bugs found in each build as soon as it has been scanned, one
+    yaml file per build under checkpoint_dir/<job>/<build number>.yml, so
+    that a run that dies part way through can carry on from where it got to,
+    and a rerun over overlapping pipelines does not scan any build twice.
+
+    Each checkpoint records a fingerprint of the parts of the bugs database
+    that can affect its job's results (i.e. every bug's regexps for that
+    job) and of the settings that change what is written out for a hit, and
+    is only used while that fingerprint still matches. The fingerprint is per
+    job, not per bug: adding, removing or editing any one bug's regexps for a
+    job invalidates every checkpoint of that job (even builds the bug could
+    never have matched), while the checkpoints of other jobs are kept.
+
+    Only the bug hits are stored, not the text they were found in: the
+    'text' of each hit's additional info is replaced by its length and sha1,
+    and read back from the build's files (which are still in the report
+    directory) when the build is resumed. A checkpoint whose text cannot be
+    read back unchanged is treated as out of date, and the build is scanned
+    again.
+
+    The bug occurrences reported for a build are kept with its bugs, so that
+    they can be submitted to Weebl again when the build is resumed.
+    """
+
+    def __init__(self, LOG, checkpoint_dir, jenkins_host, bugs, xmls=(),
+                 settings=()):
+        self.LOG = LOG
+        self.checkpoint_dir = checkpoint_dir
+        self.jenkins_host = jenkins_host.rstrip('/')
+        self.fingerprints = self.fingerprint_jobs(bugs, xmls, settings)
+        self.loaded = {}
+        self.lock = threading.Lock()
+        self.reused = 0
+        self.saved = 0
+
+    def fingerprint_jobs(self, bugs, xmls, settings=()):
+        """ Return {job: a hash of every bug's regexps for that job and of
+            the given settings}.
+        """
+        by_job = {}
+        for bug_id, bug_info in (bugs or {}).items():
+            for job, or_list in bug_info.items():
+                if type(or_list) is not list:
+                    continue
+                by_job.setdefault(job, {})[bug_id] = \
+                    [self.without_uuids(and_dict) for and_dict in or_list]
+        fingerprints = {}
+        for job, job_bugs in by_job.items():
+            fingerprints[job] = hashlib.sha1(yaml.safe_dump(
+                [__version__, sorted(xmls), list(settings), job_bugs]
+            )).hexdigest()
+        return fingerprints
+
+    def without_uuids(self, and_dict):
+        """ A copy of and_dict without the regex uuids, which are not matched
+            on (and are removed from the database as builds are scanned).
+        """
+        copied = {}
+        for target_file, target_bugs in and_dict.items():
+            if type(target_bugs) is dict:
+                target_bugs = dict([(key, value) for key, value in
+                                    target_bugs.items() if key != 'uuids'])
+            copied[target_file] = target_bugs
+        return copied
+
+    def path(self, job, build_num):
+        return os.path.join(self.checkpoint_dir, job,
+                            "{}.yml".format(build_num))
+
+    def read(self, job, build_num, pipeline, build_dir):
+        """ Return the checkpoint for this build, or None if there is no
+            checkpoint, it is out of date or the files its text is read back
+            from are not in build_dir.
+        """
+        try:
+            with open(self.path(job, build_num), 'r') as checkpoint_file:
+                checkpoint = yaml.safe_load(checkpoint_file)
+        except (IOError, yaml.YAMLError):
+            return
+        if not isinstance(checkpoint, dict):
+            return
+        if checkpoint.get('jenkins') != self.jenkins_host:
+            return
+        if checkpoint.get('pipeline') != pipeline:
+            return
+        if checkpoint.get('fingerprint') != self.fingerprints.get(job):
+            return
+        if checkpoint.get('bugs') is None:
+            return
+        for bug_id in checkpoint.get('texts') or {}:
+            info = checkpoint['bugs'][bug_id]['additional info']
+            if not os.path.exists(os.path.join(build_dir,
+                                               info['target file'])):
+                return
+        return checkpoint
+
+    def has(self, job, build_num, pipeline, build_dir):
+        """ Whether this build has an up to date checkpoint (which is then
+            kept for load, rather than being read twice).
+        """
+        key = (job, str(build_num), pipeline)
+        if key not in self.loaded:
+            self.loaded[key] = self.read(job, build_num, pipeline, build_dir)
+        return self.loaded[key] is not None
+
+    def load(self, job, build_num, pipeline, build_dir):
+        """ Return (the checkpointed bugs for this build, with their text
+            read back from the files in build_dir, the bug occurrences
+            reported for it), or None.
+        """
+        key = (job, str(build_num), pipeline)
+        if key in self.loaded:
+            checkpoint = self.loaded.pop(key)
+        else:
+            checkpoint = self.read(job, build_num, pipeline, build_dir)
+        if checkpoint is None:
+            return
+        bugs = checkpoint['bugs']
+        build_files = BuildFiles(build_dir)
+        for bug_id, digest in (checkpoint.get('texts') or {}).items():
+            info = bugs[bug_id]['additional info']
+            text = self.read_back(build_files, info, digest)
+            if text is None:
+                return
+            info['text'] = text
+        with self.lock:
+            self.reused += 1
+        return (bugs, checkpoint.get('bugoccurrences') or [])
+
+    def digest(self, text):
+        return {'length': len(text), 'sha1': hashlib.sha1(text).hexdigest()}
+
+    def read_back(self, build_files, info, digest):
+        """ Find the text a hit's additional info had when it was saved in
+            the file it came from: the start or end of the file (the end if
+            it was too big to read whole), or an xunit failure's message (or
+            the start of it, as for unfiled xunit failures). Returns None if
+            it is not there any more.
+        """
+        length = digest['length']
+        location = os.path.join(build_files.path, info['target file'])
+        if 'xunit name' in info:
+            test = (info['xunit class'], info['xunit name'])
+            candidates = [failure.message[:length] for failure in
+                          build_files.xunit_failures(location) or []
+                          if (failure.classname, failure.name) == test
+                          if failure.message is not None]
+        else:
+            candidates = []
+            try:
+                with open(location, 'r') as target:
+                    candidates.append(target.read(length))
+                    target.seek(max(0, os.path.getsize(location) - length))
+                    candidates.append(target.read())
+            except (IOError, OSError):
+                pass
+        for candidate in candidates:
+            if self.digest(candidate) == digest:
+                return candidate
+
+    def without_text(self, matching_bugs):
+        """ Return (a copy of matching_bugs with the text taken out of each
+            hit's additional info, {bug_id: the length and sha1 of the text
+            taken out}).
+        """
+        bugs = {}
+        texts = {}
+        for bug_id, bug in matching_bugs.items():
+            info = bug.get('additional info')
+            if isinstance(info, dict) and info.get('text') is not None and \
+                    info.get('target file') is not None:
+                texts[bug_id] = self.digest(info['text'])
+                bug = dict(bug)
+                bug['additional info'] = dict([
+                    (key, value) for key, value in info.items()
+                    if key != 'text'])
+            bugs[bug_id] = bug
+        return (bugs, texts)
+
+    def save(self, job, build_num, pipeline, matching_bugs,
+             bugoccurrences=()):
+        (bugs, texts) = self.without_text(matching_bugs)
+        checkpoint = {'jenkins': self.jenkins_host,
+                      'pipeline': pipeline,
+                      'fingerprint': self.fingerprints.get(job),
+                      'bugs': bugs,
+                      'texts': texts,
+                      'bugoccurrences': [list(occurrence) for occurrence
+                                         in bugoccurrences]}
+        path = self.path(job, build_num)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+        (handle, tmp) = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as checkpoint_file:
+                checkpoint_file.write(yaml.safe_dump(
+                    checkpoint, default_flow_style=False))
+            os.rename(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self.lock:
+            self.saved += 1
+
+    def report(self):
+        msg = "{0} builds reused from checkpoints, {1} builds checkpointed"
+        return msg.format(self.reused, self.saved)
@@ -1,23 +1,46 @@
 import os
+import shutil
+import fnmatch
 import tarfile
 import bisect
 import time
 from doberman.analysis.file_parser import FileParser
-from jenkinsapi.jenkins import Requester
 from jenkinsapi.jenkins import Jenkins as JenkinsAPI
 from doberman.common import pycookiecheat
+from doberman.common.session_requester import SessionRequester
 from doberman.common.base import DobermanBase
 from doberman.analysis.oil_spill import OilSpill
-from jenkinsapi.custom_exceptions import *
+from doberman.analysis.download_pool import DownloadPool
+from doberman.analysis.artifact_cache import ArtifactCache
+from doberman.analysis.bugoccurrence_submitter import BugOccurrence
+from doberman.analysis.bugoccurrence_submitter import \
+    shared_bugoccurrence_submitter
+from jenkinsapi.custom_exceptions import JenkinsAPIException
 
 
 class Jenkins(DobermanBase):
 
+    # Just the build details needed from a job's build listing:
+    BUILD_TREE = 'builds[number,result,duration,timestamp]'
+    CONSOLE_CHUNK_SIZE = 64 * 1024
+    EXTRACT_CHUNK_SIZE = 1024 * 1024
+    # The artifact cache path of the list of each build's downloads:
+    MANIFEST = '.manifest'
+
     def __init__(self, cli):
         self._jenkins = []
         self.cli = cli
+        # job -> [build details, ...] and job -> {build number: details}:
+        self.job_build_lists = {}
+        self.job_build_index = {}
         self.netloc = self.cli.netloc
         self.cookie = None
+        self.requester = None
+        self.cache = None
+        if self.cli.artifact_cache_dir:
+            self.cache = ArtifactCache(self.cli.LOG,
+                                       self.cli.artifact_cache_dir,
+                                       self.cli.artifact_cache_size)
         if not self.cli.offline_mode:
             self.connect_to_jenkins()
             try:
@@ -44,16 +67,61 @@ class Jenkins(DobermanBase):
             self.cli.LOG.info("Fetching cookies for %s" % url)
             self.cookie = pycookiecheat.chrome_cookies(url)
         try:
-            try:
-                requester = Requester(baseurl=url, cookies=self.cookie,
-                                      ssl_verify=self.cli.verify,
-                                      netloc=self.netloc)
-            except TypeError:
-                requester = Requester(baseurl=url, ssl_verify=self.cli.verify)
-            self.jenkins_api = JenkinsAPI(baseurl=url, requester=requester)
+            # One keep-alive session for every request made to jenkins:
+            self.requester = SessionRequester(
+                baseurl=url, cookies=self.cookie, ssl_verify=self.cli.verify,
+                netloc=self.netloc, pool_size=self.cli.http_pool_size)
+            self.jenkins_api = JenkinsAPI(baseurl=url,
+                                          requester=self.requester)
         except JenkinsAPIException:
             self.cli.LOG.exception('Failed to connect to Jenkins')
 
+    def connection_report(self):
+        """ How many requests were made to jenkins over how many
+            connections.
+        """
+        if self.requester is None:
+            return "No requests made to jenkins"
+        report = self.requester.report()
+        if self.cache is not None:
+            report += "\n" + self.cache.report()
+        return report
+
+    def job_builds(self, job):
+        """ Return the number, result, duration and timestamp of each of a
+            job's builds, as listed by jenkins. Each job's listing is only
+            fetched once per run.
+        """
+        if job not in self.job_build_lists:
+            jenkins_job = self.jenkins_api[job]
+            url = jenkins_job.python_api_url(jenkins_job.baseurl)
+            builds = jenkins_job.get_data(
+                url, params={'tree': self.BUILD_TREE})['builds']
+            self.job_build_lists[job] = builds
+            self.job_build_index[job] = \
+                dict([(build['number'], build) for build in builds])
+            self.cli.LOG.debug("Cached details of {} {} builds"
+                               .format(len(builds), job))
+        return self.job_build_lists[job]
+
+    def build_details(self, job, build_num):
+        """ Return the cached details of one build (see job_builds), or None
+            if jenkins did not list it.
+        """
+        self.job_builds(job)
+        return self.job_build_index[job].get(int(build_num))
+
+    def still_running(self, job, build):
+        """ Whether a build, as just fetched, is still running. A build
+            that was running when its job's builds were listed may have
+            finished since, so its cached details are brought up to date.
+        """
+        details = self.job_build_index.get(job, {}).get(build.buildno)
+        if details is not None and details['duration'] == 0:
+            details.update([(key, build._data.get(key)) for key in
+                            ['result', 'duration', 'timestamp']])
+        return build._data['duration'] == 0
+
     def get_pipeline_from_deploy_build(self, id_number):
         deploy_bld_n = int(id_number)
         try:
@@ -81,15 +149,121 @@ class Jenkins(DobermanBase):
                 self.cli.LOG.error(msg)
                 raise Exception(msg)
 
+    def cached_download(self, job, build_num, path, dest, download):
+        """ Copy the file for this job's build's path to dest from the
+            artifact cache if it is there, otherwise download() it to dest
+            and add it to the cache. Returns its size.
+        """
+        if self.cache is None:
+            return download()
+        key = self.cache.key(self.cli.jenkins_host, job, build_num, path)
+        if self.cache.fetch(key, dest):
+            self.cli.LOG.debug('Copied {0} from the artifact cache'
+                               .format(dest))
+            return os.path.getsize(dest)
+        size = download()
+        self.cache.store(key, dest)
+        return size
+
+    def restore_from_cache(self, job, build_num, console_only=False):
+        """ Copy everything last downloaded for this build (its console and
+            artifacts, as listed in its manifest) from the artifact cache into
+            its directory, without asking jenkins about the build at all.
+            Returns False, leaving it to be downloaded, unless all of it was
+            in the cache.
+        """
+        if self.cache is None:
+            return False
+        manifest = self.cache.load_manifest(self.cache.key(
+            self.cli.jenkins_host, job, build_num, self.MANIFEST))
+        if not manifest:
+            return False
+        if console_only:
+            manifest = manifest[:1]
+        outdir = self.make_build_dir(job, build_num)
+        for (path, filename) in manifest:
+            key = self.cache.key(self.cli.jenkins_host, job, build_num, path)
+            if not self.cache.fetch(key, os.path.join(outdir, filename)):
+                return False
+        for (path, filename) in manifest[1:]:
+            self.extract_and_delete_archive(outdir, filename)
+        self.cli.LOG.debug("{0} build {1} restored from the artifact cache"
+                           .format(job, build_num))
+        return True
+
+    def save_manifest(self, job, build_num, artifacts):
+        """ Record everything downloaded for this build (see
+            restore_from_cache).
+        """
+        if self.cache is None:
+            return
+        manifest = [['console.txt', "{}_console.txt".format(job)]]
+        manifest += [[self.cache_path(artifact), artifact.filename]
+                     for artifact in artifacts]
+        self.cache.store_manifest(self.cache.key(
+            self.cli.jenkins_host, job, build_num, self.MANIFEST), manifest)
+
     def write_console_to_file(self, build, outdir, jobname):
+        """ Save the build's console to outdir, returning its size. """
         console_path = os.path.join(outdir, "{}_console.txt".format(jobname))
-        with open(console_path, "w") as cnsl:
-            self.cli.LOG.debug('Saving console @ {0} to {1}'.format(
-                               build.baseurl, outdir))
-            console = build.get_console()
-            cnsl.write(console)
+        return self.cached_download(
+            jobname, build.buildno, 'console.txt', console_path,
+            lambda: self.download_console(build, console_path))
+
+    def download_console(self, build, console_path):
+        self.cli.LOG.debug('Saving console @ {0} to {1}'.format(
+                           build.baseurl, console_path))
+        if self.requester is None:
+            with open(console_path, "w") as cnsl:
+                console = build.get_console()
+                cnsl.write(console)
+                cnsl.write('\n')
+            return len(console) + 1
+        return self.stream_console_to_file(build, console_path)
+
+    def stream_console_to_file(self, build, console_path):
+        """ Stream the build's console from jenkins' progressiveText log
+            straight into console_path, a chunk at a time, rather than holding
+            all of it in memory. Until it is complete the console is kept in a
+            .part file, alongside a .offset file recording how far through the
+            log (and the .part file) each completed request got, so that an
+            interrupted download carries on from there when retried.
+        """
+        partial_path = console_path + '.part'
+        offset_path = console_path + '.offset'
+        (offset, size) = (0, 0)
+        if os.path.exists(partial_path) and os.path.exists(offset_path):
+            with open(offset_path, 'r') as offset_file:
+                (offset, size) = [int(n) for n in offset_file.read().split()]
+        url = build.baseurl.rstrip('/') + '/logText/progressiveText'
+        with open(partial_path, 'ab') as cnsl:
+            cnsl.truncate(size)
+            while True:
+                response = self.requester.get_url(
+                    url, params={'start': offset}, stream=True)
+                try:
+                    if response.status_code != 200:
+                        raise JenkinsAPIException(
+                            "Console request failed ({0}): {1}"
+                            .format(response.status_code, url))
+                    for chunk in response.iter_content(
+                            self.CONSOLE_CHUNK_SIZE):
+                        cnsl.write(chunk)
+                        size += len(chunk)
+                finally:
+                    # Hand the connection back to the pool, however it went:
+                    response.close()
+                cnsl.flush()
+                offset = int(response.headers.get('X-Text-Size', offset))
+                with open(offset_path, 'w') as offset_file:
+                    offset_file.write("{0} {1}".format(offset, size))
+                if response.headers.get('X-More-Data') != 'true':
+                    break
+                time.sleep(1)  # Still being written to
             cnsl.write('\n')
-            cnsl.flush()
+        os.rename(partial_path, console_path)
+        os.remove(offset_path)
+        return size + 1
 
     def find_build_newer_than(self, builds, start):
         """
@@ -112,49 +286,194 @@ class Jenkins(DobermanBase):
 
     def get_triage_data(self, build_num, job, reportdir, console_only=False):
         """ Get the artifacts from jenkins via jenkinsapi object. """
+        if self.restore_from_cache(job, build_num, console_only):
+            return False  # Only complete builds are cached
         jenkins_job = self.jenkins_api[job]
         build = jenkins_job.get_build(int(build_num))
-        outdir = os.path.join(self.cli.reportdir, job, str(build_num))
-
         # Check to make sure it is not still running!:
-        if build._data['duration'] == 0:
-            return True  # Still running
+        if self.still_running(job, build):
+            return True
+        outdir = self.make_build_dir(job, build_num)
+        self.write_console_to_file(build, outdir, job)
+
+        if not console_only:
+            artifacts = self.artifacts_to_fetch(build)
+            for artifact in artifacts:
+                self.save_artifact(artifact, outdir)
+                self.extract_and_delete_archive(outdir, artifact.filename)
+            self.save_manifest(job, build_num, artifacts)
+        return False  # Not still running
+
+    def make_build_dir(self, job, build_num):
+        outdir = os.path.join(self.cli.reportdir, job, str(build_num))
         try:
             os.makedirs(outdir)
         except OSError:
             if not os.path.isdir(outdir):
                 raise
-        self.write_console_to_file(build, outdir, job)
+        return outdir
 
-        if not console_only:
-            for artifact in build.get_artifacts():
-                # No need to get console now:
-                if "/console.txt" not in str(artifact):
-                    artifact.save_to_dir(outdir)
-                    self.extract_and_delete_archive(outdir, artifact)
-        return False  # Not still running
+    def artifacts_to_fetch(self, build):
+        # No need to get console now:
+        return [artifact for artifact in build.get_artifacts()
+                if "/console.txt" not in str(artifact)]
+
+    def save_artifact(self, artifact, outdir):
+        """ Save artifact to outdir, returning its size. """
+        artifact_path = os.path.join(outdir, artifact.filename)
+        build = artifact.build
+        return self.cached_download(
+            build.job.name, build.buildno, self.cache_path(artifact),
+            artifact_path,
+            lambda: self.download_artifact(artifact, outdir, artifact_path))
+
+    def cache_path(self, artifact):
+        """ The artifact's path, as it is keyed in the artifact cache. """
+        return artifact.relative_path or artifact.filename
+
+    def download_artifact(self, artifact, outdir, artifact_path):
+        artifact.save_to_dir(outdir)
+        return os.path.getsize(artifact_path)
+
+    def prefetch_triage_data(self, builds):
+        """ Download the consoles and artifacts for a batch of (pipeline, job,
+            build number) triples concurrently, on a pool of threads, so they
+            are already there when each Build is analysed. As with
+            Build.fetch_data_if_appropriate, builds that are still running, or
+            that were already downloaded (unless replacing them), are skipped.
+        """
+        pool = DownloadPool(self.cli.LOG, self.cli.download_workers,
+                            self.cli.downloads_per_host,
+                            self.cli.download_retries)
+        # Look up each job (and its build listing) up front, not in threads:
+        jenkins_jobs = {}
+        for job in set([job for (pipeline, job, build_num) in builds]):
+            try:
+                jenkins_jobs[job] = self.jenkins_api[job]
+                self.job_builds(job)
+            except Exception as e:
+                self.cli.LOG.error("Cannot prefetch {} builds: {}"
+                                   .format(job, e))
+        to_fetch = []
+        for (pipeline, job, build_num) in builds:
+            outdir = os.path.join(self.cli.reportdir, job, str(build_num))
+            if job not in jenkins_jobs:
+                continue
+            if self.cli.dont_replace and os.path.exists(outdir):
+                continue
+            to_fetch.append((jenkins_jobs[job], job, build_num))
+        self.cli.LOG.info("Prefetching data for {} builds".format(
+            len(to_fetch)))
+
+        artifact_lists = pool.map(
+            lambda to_get: self.prefetch_build(pool, *to_get), to_fetch)
+        downloads = [download for artifact_list in artifact_lists
+                     for download in artifact_list or []]
+        fetched = pool.map(
+            lambda to_get: self.prefetch_artifact(pool, *to_get), downloads)
 
-    def extract_and_delete_archive(self, outdir, artifact):
+        # Record each build that was downloaded in full, and remove any that
+        # were not (so they are downloaded again when they are analysed,
+        # rather than analysed with artifacts missing):
+        failed = set([download[0] for (download, ok) in
+                      zip(downloads, fetched) if not ok])
+        for ((jenkins_job, job, build_num), artifact_list) in zip(
+                to_fetch, artifact_lists):
+            if artifact_list is None:
+                continue
+            if artifact_list and artifact_list[0][0] in failed:
+                shutil.rmtree(artifact_list[0][0], ignore_errors=True)
+                continue
+            self.save_manifest(job, build_num, [
+                download[1] for download in artifact_list])
+        self.cli.LOG.info(pool.report())
+        return pool
+
+    def prefetch_build(self, pool, jenkins_job, job, build_num):
+        """ Save a build's console, returning [(outdir, artifact), ...] for
+            the artifacts still to download, or None if there is nothing more
+            to do for it.
+        """
+        if self.restore_from_cache(job, build_num):
+            return
+        description = "{} build {}".format(job, build_num)
+        build = pool.call(jenkins_job.baseurl,
+                          lambda: jenkins_job.get_build(int(build_num)),
+                          description)
+        if build is None or self.still_running(job, build):
+            return
+        outdir = self.make_build_dir(job, build_num)
+        artifacts = None
+        if pool.fetch(build.baseurl,
+                      lambda: self.write_console_to_file(build, outdir, job),
+                      "{} console".format(description)):
+            artifacts = pool.call(build.baseurl,
+                                  lambda: self.artifacts_to_fetch(build),
+                                  "{} artifact list".format(description))
+        if artifacts is None:
+            # Leave it to be downloaded (or reported) when it is analysed:
+            shutil.rmtree(outdir, ignore_errors=True)
+            return
+        return [(outdir, artifact) for artifact in artifacts]
+
+    def prefetch_artifact(self, pool, outdir, artifact):
+        """ Returns whether the artifact was downloaded. """
+        if not pool.fetch(artifact.url,
+                          lambda: self.save_artifact(artifact, outdir),
+                          artifact.filename):
+            return False
+        self.extract_and_delete_archive(outdir, artifact.filename)
+        return True
+
+    def extract_and_delete_archive(self, outdir, filename):
         """ Extracts the contents of a tarball and places it into a new file
             of the samename without the .tar.gz suffix (N.B. this leaves
             .ring.gz intact as they seem to contain binary ring files that
             I'm not sure what to do with at this point).
 
+            Members are copied out a chunk at a time, as the tarball is read.
+            If extract_targeted_only is set, only the files that the bugs
+            database targets (or that are otherwise parsed) are extracted.
         """
         try:
-            if 'tar.gz' in artifact.filename:
-                path_to_artifact = os.path.join(outdir, artifact.filename)
+            if 'tar.gz' in filename:
+                path_to_artifact = os.path.join(outdir, filename)
+                wanted = self.targeted_files()
+                extracted = 0
+                skipped = 0
                 with tarfile.open(path_to_artifact, 'r:gz') as tar:
-                    tarlist = [member for member in tar.getmembers()
-                               if member.isfile()]
-                    for compressed_file in tarlist:
+                    for compressed_file in tar:
+                        if not compressed_file.isfile():
+                            continue
                         slug = compressed_file.name.replace('/', '_')
-                        with open(os.path.join(outdir, slug), 'w') as new_file:
-                            data = tar.extractfile(compressed_file).readlines()
-                            new_file.writelines(data)
-                os.remove(os.path.join(outdir, artifact.filename))
+                        if wanted is not None and True not in [
+                                fnmatch.fnmatch(slug, target)
+                                for target in wanted]:
+                            skipped += 1
+                            continue
+                        source = tar.extractfile(compressed_file)
+                        slug_path = os.path.join(outdir, slug)
+                        with open(slug_path, 'wb') as new_file:
+                            shutil.copyfileobj(source, new_file,
+                                               self.EXTRACT_CHUNK_SIZE)
+                        extracted += 1
+                os.remove(os.path.join(outdir, filename))
+                self.cli.LOG.debug("Extracted {0} files from {1} ({2} not "
+                                   "targeted)".format(extracted,
+                                                      filename,
+                                                      skipped))
         except:
-            self.cli.LOG.error("Could not extract %s" % artifact.filename)
+            self.cli.LOG.error("Could not extract %s" % filename)
+
+    def targeted_files(self):
+        """ Globs for the files worth extracting from tarballs, or None to
+            extract everything.
+        """
+        regex_bank = getattr(self.cli, 'regex_bank', None)
+        if not self.cli.extract_targeted_only or regex_bank is None:
+            return
+        return regex_bank.target_files().union(
+            FileParser.parsed_files, self.cli.xmls)
 
 
 class Build(OilSpill):
@@ -162,9 +481,9 @@ class Build(OilSpill):
     """
 
     def __init__(self, build_number, jobname, jenkins, yaml_dict, cli,
-                 pipeline, prev=None):
+                 pipeline, prev=None, weebl=None):
         super(Build, self).__init__(build_number, jobname, yaml_dict, cli,
-                                    pipeline)
+                                    pipeline, weebl)
         self.jenkins = jenkins
         self.build_number = build_number
         self.jobname = jobname
@@ -175,10 +494,38 @@ class Build(OilSpill):
         self.prev = prev
 
         self.still_running = False
+        if self.resume_from_checkpoint():
+            return
         if not self.cli.offline_mode:
             self.fetch_data_if_appropriate(jenkins, jobname, build_number)
         self.process_job_data()
 
+    def resume_from_checkpoint(self):
+        """ Use the bugs found when this build was last scanned, if it has
+            been scanned before against the same bugs, and submit the bug
+            occurrences reported then to Weebl again.
+        """
+        checkpoints = getattr(self.cli, 'checkpoints', None)
+        if checkpoints is None:
+            return False
+        path = os.path.join(self.cli.reportdir, self.jobname,
+                            self.build_number)
+        checkpoint = checkpoints.load(self.jobname, self.build_number,
+                                      self.pipeline, path)
+        if checkpoint is None:
+            return False
+        self.cli.LOG.info("{0} build {1} already scanned - using checkpoint"
+                          .format(self.jobname, self.build_number))
+        (matching_bugs, bugoccurrences) = checkpoint
+        if self.cli.use_weebl:
+            submitter = shared_bugoccurrence_submitter(self.cli, self.weebl)
+            for occurrence in bugoccurrences:
+                submitter.add(BugOccurrence(*occurrence))
+        self.matching_bugs = matching_bugs
+        self.yaml_dict = self.add_to_yaml(matching_bugs, self.yaml_dict)
+        self.message = 0
+        return True
+
     def fetch_data_if_appropriate(self, jenkins, jobname, build_number):
         """ Pull console and artifacts from jenkins """
         path = os.path.join(self.cli.reportdir, jobname, build_number)
@@ -214,6 +561,11 @@ class Build(OilSpill):
                 path, self.pipeline, file_parser.extracted_info)
             self.yaml_dict = self.add_to_yaml(matching_bugs, self.yaml_dict)
             self.message = 0
+            checkpoints = getattr(self.cli, 'checkpoints', None)
+            if checkpoints is not None:
+                checkpoints.save(self.jobname, self.build_number,
+                                 self.pipeline, matching_bugs,
+                                 self.bugoccurrences)
         else:
             msg = "{} does not exist - cannot search for bugs!".format(path)
             self.cli.LOG.error(msg)
@@ -1,22 +1,53 @@
 import os
 import yaml
+import Queue
+import threading
+from multiprocessing.pool import ThreadPool
 from weeblclient.weebl import Weebl
+from weeblclient.exception import UnrecognisedInstance
 from doberman.common import pycookiecheat
 from doberman.common.base import DobermanBase
+from doberman.analysis.regex_bank import RegexBank
+from doberman.analysis.download_pool import DownloadPool
 from jenkinsapi.custom_exceptions import *
 
 
+def shared_weebl_client(cli, weebl_api_ver=None):
+    """ The Weebl client for this process (using the given API version, if
+        not the default). It is created the first time it is asked for, then
+        kept on cli and shared by everything that talks to Weebl, rather than
+        each creating (and connecting) its own.
+    """
+    attr = 'weebl' if weebl_api_ver is None else 'weebl_' + weebl_api_ver
+    if getattr(cli, attr, None) is None:
+        api_ver = {} if weebl_api_ver is None else {
+            'weebl_api_ver': weebl_api_ver}
+        setattr(cli, attr, Weebl(
+            uuid=cli.uuid,
+            env_name=cli.environment,
+            username=cli.weebl_username,
+            apikey=cli.weebl_apikey,
+            weebl_url=cli.weebl_url,
+            **api_ver))
+    return getattr(cli, attr)
+
+
 class WeeblClass(DobermanBase):
 
+    # How many pipelines to look up per request (and results per page):
+    BULK_SIZE = 100
+
     def __init__(self, cli, bugs=None):
         self.cli = cli
         self.verify = self.cli.verify
         self.bugs = None
+        self.regex_bank = None
         self.weebl = None
         if not self.cli.offline_mode:
             self.weebl = self.get_weebl_client()
         if bugs is not None:
             self.bugs = bugs.get('bugs')
+            self.regex_bank = RegexBank(self.bugs)
         else:
             self.open_bug_database()
 
@@ -35,15 +66,48 @@ class WeeblClass(DobermanBase):
         else:
             self.cli.LOG.error('Unknown database: %s' % (self.cli.database))
             raise Exception('Invalid Database configuration')
+        self.regex_bank = RegexBank(self.bugs)
 
     def get_weebl_client(self):
-        return Weebl(
-            uuid=self.cli.uuid,
-            env_name=self.cli.environment,
-            username=self.cli.weebl_username,
-            apikey=self.cli.weebl_apikey,
-            weebl_url=self.cli.weebl_url,
-            weebl_api_ver="v1")
+        return shared_weebl_client(self.cli, "v1")
+
+    def get_build_uuids(self, builds):
+        """ Look up the Weebl uuids of a batch of (pipeline, job, build
+            number) triples concurrently, returning {(build number, job,
+            pipeline): uuid}, where the uuid is None for builds that Weebl
+            does not have. Builds that could not be looked up are left out.
+        """
+        pool = DownloadPool(self.cli.LOG, self.cli.download_workers,
+                            self.cli.downloads_per_host,
+                            self.cli.download_retries)
+
+        # (With the same client as OilSpill.get_build_uuid)
+        get_uuid = shared_weebl_client(
+            self.cli).get_build_uuid_from_build_id_job_and_pipeline
+
+        def get_found(build_num, job, pipeline):
+            # Wrapped, so that not found is an answer (not retried) and
+            # only a failed lookup gives None:
+            try:
+                return (get_uuid(build_num, job, pipeline),)
+            except UnrecognisedInstance:
+                return (None,)
+
+        def lookup(build):
+            (pipeline, job, build_num) = build
+            return pool.call(self.cli.weebl_url,
+                             lambda: get_found(build_num, job, pipeline),
+                             "uuid of {} build {}".format(job, build_num))
+
+        build_uuids = {}
+        for (pipeline, job, build_num), found in zip(
+                builds, pool.map(lookup, builds)):
+            if found is not None:
+                build_uuids[(str(build_num), job, pipeline)] = found[0]
+        self.cli.LOG.info("Looked up the uuids of {0} of {1} builds".format(
+            len([uuid for uuid in build_uuids.values() if uuid is not None]),
+            len(builds)))
+        return build_uuids
 
     def get_pipelines_from_paabn(self, filename=None):
         if not filename:
@@ -53,7 +117,17 @@ class WeeblClass(DobermanBase):
                 return yaml.load(f)
         return {}
 
-    def get_all_pipelines(self, pipeline_ids):
+    def get_all_pipelines(self, pipeline_ids, on_resolved=None):
+        """ Return {pipeline: {job: build number}} for pipeline_ids, which
+            may be a generator (e.g. of the pipelines in a date range, as they
+            are found). Pipelines not in the local yaml file are looked up in
+            Weebl BULK_SIZE at a time, on a background thread, as soon as that
+            many have arrived, rather than once all of them have.
+
+            If given, on_resolved is called with the {pipeline: {job: build
+            number}} of every BULK_SIZE pipelines as soon as they are known,
+            so that their builds can be used before the rest are found.
+        """
         build_numbers = {}
         self.mkdir(self.cli.reportdir)
 
@@ -61,24 +135,41 @@ class WeeblClass(DobermanBase):
         filename = 'pipelines_and_associated_build_numbers.yml'
         build_numbers = self.get_pipelines_from_paabn(filename)
 
-        # Check that all pipeline_ids were in the yaml file:
-        if build_numbers:
-            missing = [pl for pl in pipeline_ids if pl not in
-                       build_numbers.keys()]
-        else:
-            missing = pipeline_ids
-
-        if missing:
-            # The test catalog way:
-            checkin = 5 if len(missing) > 20 else None
-            for pos, pipeline_id in enumerate(missing):
-                pldata = self.get_pipelines(pipeline_id)
-                if pldata:
-                    build_numbers[pipeline_id] = pldata
-                pgr = self.calculate_progress(pos, missing, checkin)
-                if pgr:
-                    self.cli.LOG.info(
-                        "Build lookup {0}% complete.".format(pgr))
+        # The test catalog way, for any pipeline_ids not in the yaml file:
+        pipelines = []
+        missing = []
+        known = []
+        lookups = []
+        pool = ThreadPool(1)
+        try:
+            for pipeline in pipeline_ids:
+                pipelines.append(pipeline)
+                if pipeline not in build_numbers:
+                    missing.append(pipeline)
+                elif on_resolved is not None:
+                    known.append(pipeline)
+                if len(missing) == self.BULK_SIZE:
+                    lookups.append(pool.apply_async(
+                        self.resolve_pipelines, (missing, on_resolved)))
+                    missing = []
+                if len(known) == self.BULK_SIZE:
+                    on_resolved(dict([(pl, build_numbers[pl])
+                                      for pl in known]))
+                    known = []
+            if missing:
+                lookups.append(pool.apply_async(
+                    self.resolve_pipelines, (missing, on_resolved)))
+            if known:
+                on_resolved(dict([(pl, build_numbers[pl]) for pl in known]))
+            found = [lookup.get() for lookup in lookups]
+        finally:
+            pool.close()
+            pool.join()
+        pipeline_ids = pipelines
+
+        if lookups:
+            for pipelines_found in found:
+                build_numbers.update(pipelines_found)
 
             # Create local dictionary for next time:
             self.write_output_yaml(self.cli.reportdir, filename, build_numbers)
@@ -92,6 +183,15 @@ class WeeblClass(DobermanBase):
         self.cli.LOG.info("Returning {} pipelines".format(len(build_numbers)))
         return build_numbers
 
+    def resolve_pipelines(self, pipelines, on_resolved=None):
+        """ get_pipelines_in_bulk, passing the result to on_resolved (if
+            given) as well as returning it.
+        """
+        build_numbers = self.get_pipelines_in_bulk(pipelines)
+        if on_resolved is not None:
+            on_resolved(build_numbers)
+        return build_numbers
+
     def get_pipelines(self, pipeline):
         """ Using weebl, return the build numbers for the jobs that are
             part of the given pipeline.
@@ -118,13 +218,159 @@ class WeeblClass(DobermanBase):
         self.cli.LOG.debug(msg.format(pipeline, bstr))
         return build_numbers
 
-    def get_pipelines_from_date_range(self, start, end, limit=2000,
+    def get_pipelines_in_bulk(self, pipelines):
+        """ As get_pipelines, but for many pipelines at once, returning
+            {pipeline: {job: build number}}. The pipelines are looked up
+            BULK_SIZE at a time: one request finds which of them exist and one
+            per job finds their builds of that job, with all of the requests
+            made concurrently. Any pipelines whose requests failed are then
+            looked up one at a time, as get_pipelines does.
+        """
+        pool = DownloadPool(self.cli.LOG, self.cli.download_workers,
+                            self.cli.downloads_per_host,
+                            self.cli.download_retries)
+        chunks = [pipelines[pos:pos + self.BULK_SIZE]
+                  for pos in range(0, len(pipelines), self.BULK_SIZE)]
+        # (pipelines, job), where a job of None finds the pipelines:
+        queries = [(chunk, jname) for chunk in chunks
+                   for jname in [None] + list(self.cli.job_names)]
+        results = pool.map(
+            lambda query: pool.call(self.cli.weebl_url,
+                                    lambda: self.get_pipeline_objects(*query),
+                                    "{1} builds of {0} pipelines".format(
+                                        len(query[0]), query[1])),
+            queries)
+
+        build_numbers = {}
+        failed = set()
+        for (chunk, jname), objects in zip(queries, results):
+            if objects is None:
+                failed.update(chunk)
+            elif jname is None:
+                for weebl_pipeline in objects:
+                    build_numbers[weebl_pipeline['uuid']] = dict(
+                        [(job, None) for job in self.cli.job_names])
+        for (chunk, jname), objects in zip(queries, results):
+            if jname is None or objects is None:
+                continue
+            for weebl_build in objects:
+                pipeline = self.uuid_from(weebl_build['pipeline'])
+                if pipeline in build_numbers and \
+                        build_numbers[pipeline][jname] is None:
+                    build_numbers[pipeline][jname] = weebl_build['build_id']
+
+        for pipeline in failed:
+            build_numbers.pop(pipeline, None)
+            pldata = self.get_pipelines(pipeline)
+            if pldata:
+                build_numbers[pipeline] = pldata
+        msg = "Build numbers for {0} pipelines looked up in {1} requests"
+        self.cli.LOG.info(msg.format(len(build_numbers), len(queries)))
+        return build_numbers
+
+    def get_pipeline_objects(self, pipelines, jname=None):
+        """ Return the Weebl pipeline objects for pipelines or, given a job
+            name, the builds of that job in those pipelines, a page at a time.
+        """
+        uuids = ",".join(pipelines)
+        if jname is None:
+            return self.get_all_pages(self.weebl.resources.pipeline,
+                                      uuid__in=uuids)
+        return self.get_all_pages(self.weebl.resources.build,
+                                  pipeline__uuid__in=uuids,
+                                  jobtype__name=jname)
+
+    def get_all_pages(self, resource, order_by='uuid', **filters):
+        """ Return all of resource's objects matching filters, fetched
+            BULK_SIZE at a time in a stable order (so that none are skipped
+            or repeated between pages).
+        """
+        found = []
+        offset = 0
+        while True:
+            page = list(resource.objects(limit=self.BULK_SIZE, offset=offset,
+                                         order_by=order_by, **filters))
+            found.extend(page)
+            if len(page) < self.BULK_SIZE:
+                return found
+            offset += self.BULK_SIZE
+
+    def uuid_from(self, pipeline):
+        """ A build's pipeline, as either a resource uri or an object. """
+        if isinstance(pipeline, dict):
+            return pipeline['uuid']
+        return pipeline.rstrip('/').split('/')[-1]
+
+    def get_pipelines_from_date_range(self, start, end,
                                       ts_format='%Y-%m-%dT%H:%M:%S.%sZ'):
-        pipeline_objects = self.weebl.resources.pipeline.objects(
-            completed_at__gte=start.strftime(ts_format),
-            completed_at__lte=end.strftime(ts_format),
-            limit=limit)
-        return [obj['uuid'] for obj in pipeline_objects]
+        return list(self.iter_pipelines_from_date_range(
+            start, end, ts_format=ts_format))
+
+    def iter_pipelines_from_date_range(self, start, end, page_size=None,
+                                       ts_format='%Y-%m-%dT%H:%M:%S.%sZ'):
+        """ Yield the uuid of every pipeline completed between start and end,
+            as they are found. They are fetched from Weebl page_size (or
+            date_range_page_size) at a time on a background thread, which
+            keeps fetching up to a few pages ahead of the pipelines used so
+            far. Raises an exception if any page cannot be fetched, rather
+            than yielding only some of the pipelines.
+        """
+        page_size = page_size or self.cli.date_range_page_size
+        # (Ordered by uuid so that no pipeline can move between pages)
+        filters = {'completed_at__gte': start.strftime(ts_format),
+                   'completed_at__lte': end.strftime(ts_format),
+                   'order_by': 'uuid'}
+        pages = Queue.Queue(maxsize=2 * self.cli.download_workers)
+        fetcher = threading.Thread(target=self.fetch_pages, args=(
+            pages, self.weebl.resources.pipeline, page_size, filters))
+        fetcher.daemon = True
+        fetcher.start()
+        found = set()
+        while True:
+            page = pages.get()
+            if page is None:
+                return
+            if isinstance(page, Exception):
+                raise page
+            for weebl_pipeline in page:
+                if weebl_pipeline['uuid'] not in found:
+                    found.add(weebl_pipeline['uuid'])
+                    yield weebl_pipeline['uuid']
+
+    def fetch_pages(self, pages, resource, page_size, filters):
+        """ Put each page of resource's objects matching filters on the pages
+            queue, in order, followed by None (or by an Exception if a page
+            could not be fetched). After the first page, download_workers
+            pages are fetched at a time, concurrently.
+        """
+        pool = DownloadPool(self.cli.LOG, self.cli.download_workers,
+                            self.cli.downloads_per_host,
+                            self.cli.download_retries)
+
+        def fetch(offset):
+            return pool.call(
+                self.cli.weebl_url,
+                lambda: list(resource.objects(limit=page_size, offset=offset,
+                                              **filters)),
+                "pipelines {0} to {1}".format(offset, offset + page_size))
+
+        try:
+            offsets = [0]
+            while True:
+                for (offset, page) in zip(offsets, pool.map(fetch, offsets)):
+                    if page is None:
+                        pages.put(Exception("Could not get pipelines {0} to "
+                                            "{1} of the date range".format(
+                                                offset, offset + page_size)))
+                        return
+                    pages.put(page)
+                    if len(page) < page_size:
+                        pages.put(None)
+                        return
+                offsets = [offsets[-1] + page_size * num for num in
+                           range(1, self.cli.download_workers + 1)]
+        except Exception as e:
+            pages.put(e)
 
     def get_pipeline_from_deploy_build(self, id_number,
                                        job='jenkins-pipeline_deploy'):
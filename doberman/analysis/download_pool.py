@@ -0,0 +1,105 @@
+import time
+import threading
+from urlparse import urlparse
+from multiprocessing.pool import ThreadPool
+
+
+class DownloadPool(object):
+    """
+    Runs downloads on a bounded pool of threads, with no more than per_host of
+    them talking to any one host at a time. A download that raises is retried,
+    after a pause that grows with each attempt, up to retries more times.
+    Keeps a tally of the files and bytes downloaded so that the throughput can
+    be reported.
+
+    Each map starts (and stops) its own threads, unless start() has been
+    called, in which case every map shares the same threads until close().
+    """
+
+    def __init__(self, LOG, workers=8, per_host=4, retries=3, backoff=1.0):
+        self.LOG = LOG
+        self.workers = workers
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.host_limits = {}
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.retried = 0
+        self.failed = 0
+        self.threads = None
+        self.start_time = time.time()
+
+    def start(self):
+        """ Keep one pool of threads for every map from now until close(). """
+        if self.threads is None:
+            self.threads = ThreadPool(self.workers)
+
+    def close(self):
+        if self.threads is not None:
+            self.threads.close()
+            self.threads.join()
+            self.threads = None
+
+    def host_limit(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = \
+                    threading.BoundedSemaphore(self.per_host)
+            return self.host_limits[host]
+
+    def call(self, url, func, description):
+        """ Return func(), which talks to url's host, retrying it if it
+            raises. Returns None if every attempt failed.
+        """
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with self.lock:
+                    self.retried += 1
+                time.sleep(self.backoff * attempt)
+            try:
+                with self.host_limit(url):
+                    return func()
+            except Exception as e:
+                msg = "Attempt {0} of {1} to get {2} failed: {3}"
+                self.LOG.warn(msg.format(attempt + 1, self.retries + 1,
+                                         description, e))
+        with self.lock:
+            self.failed += 1
+        self.LOG.error("Could not get {0}".format(description))
+
+    def fetch(self, url, download, description):
+        """ As call, but download() returns the number of bytes it saved, which
+            are added to the tally. Returns True if it succeeded.
+        """
+        num_bytes = self.call(url, download, description)
+        if num_bytes is None:
+            return False
+        with self.lock:
+            self.files += 1
+            self.bytes += num_bytes
+        return True
+
+    def map(self, func, items):
+        """ Return [func(item) for item in items], run on the pool's threads.
+        """
+        if not items:
+            return []
+        if self.threads is not None:
+            return self.threads.map(func, items)
+        pool = ThreadPool(min(self.workers, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def report(self):
+        elapsed = max(time.time() - self.start_time, 0.001)
+        megabytes = self.bytes / 1024.0 / 1024.0
+        msg = "Downloaded {0} files ({1:.1f} MB) in {2:.1f}s: {3:.2f} MB/s, "
+        msg += "{4:.1f} files/s ({5} retries, {6} failed)"
+        return msg.format(self.files, megabytes, elapsed, megabytes / elapsed,
+                          self.files / elapsed, self.retried, self.failed)
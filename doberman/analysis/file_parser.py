@@ -12,11 +12,12 @@ class FileParser(DobermanBase):
        - juju_status.yaml
     """
 
+    # Files parsed other than the console (which is never in a tarball):
+    parsed_files = ['oil_nodes', 'juju_status.yaml']
+
     def __init__(self, path, job):
         self.status = []
-        self.filenames = ['{}_console.txt'.format(job),
-                          'oil_nodes',
-                          'juju_status.yaml']
+        self.filenames = ['{}_console.txt'.format(job)] + self.parsed_files
         self.path = path
         self.extracted_info = {}
         self._process_data()
@@ -31,11 +32,14 @@ class FileParser(DobermanBase):
                 else:
                     return f.read()
         except IOError as e:
-            msg = "Problem reading {} from {} ({})"
-            filename = os.path.basename(self.path_to_file)
-            self.status.append(msg.format(filename, self.path, e[1]))
+            self._report_read_error(e)
             return
 
+    def _report_read_error(self, e):
+        msg = "Problem reading {} from {} ({})"
+        filename = os.path.basename(self.path_to_file)
+        self.status.append(msg.format(filename, self.path, e[1]))
+
     def _process_data(self):
         for filename in self.filenames:
             self.path_to_file = os.path.join(self.path, filename)
@@ -47,7 +51,29 @@ class FileParser(DobermanBase):
                 self._process_juju_status_data()
 
     def _process_console_data(self):
-        self.data = self._extract_information('txt')
+        """ Consoles can be hundreds of MB, so rather than reading the whole
+            thing, lines are read one at a time until the release and the
+            build executor have both been found.
+        """
+        self.data = None
+        release = None
+        second_line = None
+        in_workspace = False
+        try:
+            with open(self.path_to_file, "r") as f:
+                for line_number, line in enumerate(f):
+                    if line_number == 1:
+                        second_line = line.split('\n')[0]
+                    if release is None and 'OPENSTACK_RELEASE=' in line:
+                        release = line.split('OPENSTACK_RELEASE=')[1]\
+                            .split('\n')[0]
+                    if ' in workspace /var/lib/' in line:
+                        in_workspace = True
+                    if release is not None and in_workspace and \
+                            second_line is not None:
+                        break
+        except IOError as e:
+            self._report_read_error(e)
 
         # Set up defaults in case missing console.txt:
         if 'openstack release' not in self.extracted_info:
@@ -56,16 +82,14 @@ class FileParser(DobermanBase):
             self.extracted_info["build_executor"] = "Unknown"
         msg = "Unable to extract {} from {}."
 
-        if self.data and 'OPENSTACK_RELEASE=' in self.data:
-            self.extracted_info['openstack release'] = \
-                self.data.split('OPENSTACK_RELEASE=')[1].split('\n')[0]
+        if release is not None:
+            self.extracted_info['openstack release'] = release
         else:
             self.status.append(msg.format('openstack release', 'console'))
 
-        if self.data and ' in workspace /var/lib/' in self.data:
+        if in_workspace and second_line is not None:
             self.extracted_info['build_executor'] = (
-                self.data.split('\n')[1]
-                .split(' in workspace /var/lib/')[0]
+                second_line.split(' in workspace /var/lib/')[0]
                 .split(' ')[-1])
         else:
             self.status.append(msg.format('jenkins', 'console'))
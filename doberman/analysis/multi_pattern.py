@@ -0,0 +1,170 @@
+import re
+from collections import OrderedDict
+from doberman.analysis.regex_literals import (
+    all_literals_in, literal_prefix, newlines_spanned, required_literals)
+
+
+class MultiPattern(object):
+    """
+    Matches every regexp that targets the same file against that file's text
+    in one go, reporting which pattern ids matched rather than running each
+    regexp as a separate full-text scan.
+
+    Each regexp's leading literal (e.g. 'oil_ci.deploy.oil_deployer' in
+    'oil_ci.deploy.oil_deployer. Deployment failed.*') is extracted when it is
+    added. A single screening pass over the text (with one compiled
+    alternation of them all) then finds the first occurrence of every one of
+    those literals, and only regexps whose literal was seen are verified,
+    starting from where that literal first occurs.
+    Regexps without a usable leading literal are always verified. A regexp can
+    only match where its leading literal does, so the result is exactly the
+    same as searching for every regexp individually.
+
+    Before a regexp is verified, the other literals it requires are checked
+    for with a plain 'in', and the regexp is skipped if any are missing. The
+    number of regexp evaluations avoided this way is counted.
+
+    Text too big to hold in memory can be scanned as a series of overlapping
+    windows instead (see scan_windows).
+    """
+
+    MAX_SCREENS = 256
+
+    def __init__(self):
+        self.patterns = {}
+        self.pattern_ids = set()
+        self.screens = OrderedDict()
+        self.evaluated = 0
+        self.avoided = 0
+
+    def add(self, pattern_id, pattern, literals=None):
+        """ Add a compiled regexp (and the literals it requires, if they are
+            already known). Ids that share an identical regexp are only
+            searched for once.
+        """
+        if literals is None:
+            literals = required_literals(pattern)
+        if pattern.pattern not in self.patterns:
+            self.patterns[pattern.pattern] = \
+                (pattern, literal_prefix(pattern), literals, [],
+                 newlines_spanned(pattern))
+        self.patterns[pattern.pattern][3].append(pattern_id)
+        self.pattern_ids.add(pattern_id)
+
+    def __contains__(self, pattern_id):
+        return pattern_id in self.pattern_ids
+
+    def screen(self, literals):
+        """ Compile (or reuse) an alternation of the given literals, longest
+            first, inside a lookahead: it matches at every position where any
+            of them occurs (even overlapping another), and where several
+            occur at the same position the one found is the longest and the
+            others are all prefixes of it. The MAX_SCREENS most recently used
+            are kept.
+        """
+        key = frozenset(literals)
+        screen = self.screens.pop(key, None)
+        if screen is None:
+            ordered = sorted(literals, key=lambda lit: (-len(lit), lit))
+            screen = re.compile(
+                '(?=(' + '|'.join([re.escape(lit) for lit in ordered]) + '))')
+            if len(self.screens) >= self.MAX_SCREENS:
+                self.screens.popitem(last=False)
+        self.screens[key] = screen
+        return screen
+
+    def find_literals(self, text, entries):
+        """ Return {literal: position of first occurrence} for every literal
+            prefix of entries that occurs in text, in one pass of the screen
+            (which stops once every literal has been seen).
+        """
+        first_seen = {}
+        remaining = set([entry[1] for entry in entries
+                         if entry[1] is not None])
+        if not remaining:
+            return first_seen
+        lengths = sorted(set([len(literal) for literal in remaining]))
+        # Longest literals found, whose prefixes have all been recorded:
+        done = set()
+        for match in self.screen(remaining).finditer(text):
+            found = match.group(1)
+            if found in done:
+                continue
+            done.add(found)
+            for length in lengths:
+                if length > len(found):
+                    break
+                if found[:length] in remaining:
+                    first_seen[found[:length]] = match.start()
+                    remaining.discard(found[:length])
+            if not remaining:
+                break
+        return first_seen
+
+    def scan(self, text, entries=None):
+        """ Return the set of pattern ids with at least one match in text. """
+        hits = set()
+        if not text:
+            text = ''
+        if entries is None:
+            entries = self.patterns.values()
+        first_seen = self.find_literals(text, entries)
+        for pattern, prefix, literals, pattern_ids, spanned in entries:
+            if prefix is None:
+                pos = 0
+            elif prefix in first_seen:
+                pos = first_seen[prefix]
+            else:
+                self.avoided += 1
+                continue
+            if not all_literals_in(literals, text):
+                self.avoided += 1
+                continue
+            self.evaluated += 1
+            if pattern.search(text, pos):
+                hits.update(pattern_ids)
+        return hits
+
+    def scan_windows(self, windows, overlap_lines, read_whole):
+        """ As scan, but for text given as an iterable of overlapping windows
+            in which any overlap_lines + 1 consecutive lines appear together
+            (see BuildFiles.windows), so only one window is held at a time.
+
+            Regexps that cannot match across more than overlap_lines newlines
+            are answered from the windows alone. Any other regexp that matches
+            within a window has matched, but if none of the windows matched it
+            and every literal it requires was seen, it falls back to being
+            searched for in the whole text, as returned by read_whole().
+        """
+        hits = set()
+        windowed = []
+        whole = []
+        for entry in self.patterns.values():
+            if entry[4] is None:
+                whole.append(entry)
+            else:
+                windowed.append(entry)
+        # Literals that could be split between two windows prove nothing:
+        provable = set()
+        for entry in windowed:
+            if entry[4] > overlap_lines:
+                provable.update([literal for literal in entry[2]
+                                 if literal.count('\n') <= overlap_lines])
+        seen = set()
+        for window in windows:
+            hits.update(self.scan(window, windowed))
+            windowed = [entry for entry in windowed if entry[3][0] not in hits]
+            seen.update([literal for literal in provable - seen
+                         if literal in window])
+            if not windowed:
+                break
+        for entry in windowed:
+            if entry[4] <= overlap_lines:
+                continue
+            if provable.intersection(entry[2]) - seen:
+                self.avoided += 1
+                continue
+            whole.append(entry)
+        if whole:
+            hits.update(self.scan(read_whole(), whole))
+        return hits
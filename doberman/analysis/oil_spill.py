@@ -1,46 +1,56 @@
 
-import re
 import os
 import uuid
 import fnmatch
-from glob import glob
-from lxml import etree
 from doberman.common import const
 from doberman.common.base import DobermanBase
-# <ACTIONPOINT>
-try:
-    from weeblclient.weebl import Weebl
-    from weeblclient.exception import UnrecognisedInstance
-    from weeblclient.exception import InstanceAlreadyExists
-except ImportError as e:
-    pass
-#
+from doberman.analysis.regex_bank import RegexBank
+from doberman.analysis.build_files import BuildFiles
+from doberman.analysis.multi_pattern import MultiPattern
+from doberman.analysis.crude_weebl import shared_weebl_client
+from doberman.analysis.bugoccurrence_submitter import BugOccurrence
+from doberman.analysis.bugoccurrence_submitter import \
+    shared_bugoccurrence_submitter
 
 
 class OilSpill(DobermanBase):
     """Failure detection class"""
 
-    def __init__(self, build_number, jobname, yaml_dict, cli, pipeline):
+    def __init__(self, build_number, jobname, yaml_dict, cli, pipeline,
+                 weebl=None):
         self.cli = cli
         self.build_number = build_number
         self.jobname = jobname
         self.yaml_dict = yaml_dict
         self.pipeline = pipeline
-        self.build_uuid = None
+        self._build_uuid = None
+        # What report_bugoccurrence has queued for this build:
+        self.bugoccurrences = []
         # <ACTIONPOINT>
         if self.cli.use_weebl:
-            self.weebl = Weebl(
-                self.cli.uuid,
-                self.cli.environment,
-                username=self.cli.weebl_username,
-                apikey=self.cli.weebl_apikey,
-                weebl_url=self.cli.weebl_url)
-            # Build should have been created by oil-ci already
-            self.build_uuid =\
-                self.weebl.get_build_uuid_from_build_id_job_and_pipeline(
-                    self.build_number, self.jobname, self.pipeline)
+            self.weebl = weebl if weebl else shared_weebl_client(self.cli)
         #
 
+    @property
+    def build_uuid(self):
+        """ This build's uuid in Weebl (the build should have been created
+            by oil-ci already), only looked up when it is needed.
+        """
+        if self._build_uuid is None and self.cli.use_weebl:
+            self._build_uuid = self.get_build_uuid()
+        return self._build_uuid
+
+    def get_build_uuid(self):
+        """ As looked up for every build before any were analysed if
+            possible (None if Weebl did not have it), otherwise looked up now.
+        """
+        build_uuids = getattr(self.cli, 'build_uuids', None) or {}
+        key = (str(self.build_number), self.jobname, self.pipeline)
+        if key in build_uuids:
+            return build_uuids[key]
+        return self.weebl.get_build_uuid_from_build_id_job_and_pipeline(
+            self.build_number, self.jobname, self.pipeline)
+
     def bug_hunt(self, path, announce=True):
         """ Using information from the bugs database, opens target file and
             searches the text for each associated regexp. """
@@ -52,15 +62,19 @@ class OilSpill(DobermanBase):
         info = {}
         parse_as_xml = self.cli.xmls
         xml_files_parsed = []
+        # Each artifact is only read once, however many bugs target it (or,
+        # if it is too big for that, a window at a time):
+        self.build_files = BuildFiles(
+            path, self.cli.stream_files_above, self.cli.stream_chunk_size,
+            self.cli.stream_overlap_lines,
+            use_mmap=self.cli.artifact_access == 'mmap')
+        # ...and only scanned once for all of the regexps that target it:
+        self.scanned = {}
 
         if not self.cli.offline_mode:
-            build_details_list =\
-                [build_info for build_info in self.jenkins.jenkins_api
-                 [self.jobname]._poll()['builds']
-                 if build_info['number'] == int(self.build_number)]
-            if build_details_list != []:
-                build_details = build_details_list[0]
-            else:
+            build_details = self.jenkins.build_details(
+                self.jobname, self.build_number)
+            if build_details is None:
                 build_details = {}
 
             build_status = (build_details['result'] if 'result' in
@@ -73,9 +87,11 @@ class OilSpill(DobermanBase):
             raise Exception("No bugs in database!")
 
         unfiled_xml_fails = {}
+        # (xunit class, xunit name) -> [bug ids in unfiled_xml_fails]:
+        uxfs_by_test = {}
         failed_to_hit_any_flag = True
 
-        for bug_id, bug_info in self.cli.bugs.items():
+        for bug_id, bug_info in self.bugs_for_job():
             if self.jobname in self.cli.bugs[bug_id]:
                 # <ACTIONPOINT>
                 self.regex_uuid = None
@@ -89,7 +105,7 @@ class OilSpill(DobermanBase):
                 [files_to_scan.extend(and_dict.keys()) for and_dict in or_dict]
                 xmls_to_scan = set([xml for xml in files_to_scan if xml in
                                     self.cli.xmls])
-                for and_dict in or_dict:
+                for branch, and_dict in enumerate(or_dict):
                     # Within the dictionary all have to match (and):
                     hit_dict = {}
                     glob_hits = []
@@ -106,7 +122,7 @@ class OilSpill(DobermanBase):
                                     self.bsnode[bssub]
                         except:
                             pass
-                        globs = glob(os.path.join(path, target_file))
+                        globs = self.build_files.glob(target_file)
                         if len(globs) == 0:
                             info['error'] = target_file + " not present"
                             break
@@ -118,12 +134,17 @@ class OilSpill(DobermanBase):
                             present = True in [fnmatch.fnmatch(target, pax)
                                                for pax in parse_as_xml]
                             if not present:
-                                with open(target_location, 'r') as grep_me:
-                                    text = grep_me.read()
+                                if self.build_files.streams(target_location):
+                                    text = None
+                                else:
+                                    text = self.build_files.read(
+                                        target_location)
                                 hit = self.rematch(
                                     and_dict, target, target_file, text,
                                     self.jobname, self.jobname, self.jobname,
-                                    const.DEFAULT_VERSION_FOR_BUILD)
+                                    const.DEFAULT_VERSION_FOR_BUILD,
+                                    bug_id=bug_id, branch=branch,
+                                    target_location=target_location)
                                 if hit:
                                     failed_to_hit_any_flag = False
                                     glob_hits.append(
@@ -141,17 +162,14 @@ class OilSpill(DobermanBase):
                                 else:
                                     xml_unparsed = True
                                     xml_files_parsed.append(target)
-                                # Get tempest results:
-                                p = etree.XMLParser(huge_tree=True)
-                                try:
-                                    et = etree.parse(target_location, parser=p)
-                                    doc = et.getroot()
-                                except etree.XMLSyntaxError as e:
+                                # Get tempest results (only parsed once):
+                                errors_and_fails = \
+                                    self.build_files.xunit_failures(
+                                        target_location)
+                                if errors_and_fails is None:
                                     msg = "Cannot read from XML file"
                                     self.cli.LOG.error(msg)
                                     continue
-                                errors_and_fails = doc.xpath('.//failure')
-                                errors_and_fails += doc.xpath('.//error')
                                 # TODO: There is not currently a way to do
                                 # multiple 'and' regexps within a single
                                 # tempest file - you can do console AND tempest
@@ -162,46 +180,36 @@ class OilSpill(DobermanBase):
                                         errors_and_fails, info, target,
                                         bug_unmatched, build_status,
                                         unfiled_xml_fails)
+                                    uxfs_by_test = \
+                                        self.index_uxfs(unfiled_xml_fails)
                                 testframework = "_".join([
                                     self.jobname.split('test_')[1],
                                     target.split('.')[0].split('_')[0]])
                                 for num, fail in enumerate(errors_and_fails):
-                                    pre_log = fail.get('message')
+                                    pre_log = fail.message
                                     if not self.cli.reduced_output_text:
                                             info['text'] = pre_log
                                     info['target file'] = target
-                                    info['xunit class'] =\
-                                        fail.getparent().get('classname')
-                                    info['xunit name'] =\
-                                        fail.getparent().get('name')
+                                    info['xunit class'] = fail.classname
+                                    info['xunit name'] = fail.name
                                     hit = self.rematch(
                                         and_dict, target, target_file, pre_log,
                                         info['xunit name'],
                                         info['xunit class'],
                                         testframework,
                                         self.cli.testframework_version,
-                                        fail.tag)
+                                        fail.tag, bug_id=bug_id,
+                                        branch=branch)
                                     if hit:
                                         failed_to_hit_any_flag = False
                                         # Add to hit_dict:
                                         hit_dict = self.join_dicts(hit_dict,
                                                                    hit)
                                         # Remove hit from unfiled_xml_fails:
-                                        edited_uxfs = unfiled_xml_fails.copy()
-
-                                        for uxf in unfiled_xml_fails:
-                                            removeme = edited_uxfs[uxf]
-                                            addinfo = removeme.get(
-                                                'additional info')
-                                            xname = addinfo['xunit name']
-                                            namecheck = \
-                                                (xname == info['xunit name'])
-                                            xclass = addinfo['xunit class']
-                                            classcheck = \
-                                                (xclass == info['xunit class'])
-                                            if (namecheck and classcheck):
-                                                del edited_uxfs[uxf]
-                                        unfiled_xml_fails = edited_uxfs.copy()
+                                        test = (info['xunit class'],
+                                                info['xunit name'])
+                                        for uxf in uxfs_by_test.pop(test, []):
+                                            del unfiled_xml_fails[uxf]
                                 # TODO: But if there are multiple globs, it'll
                                 # overwrite these in the xml - FIXME!!!
 
@@ -210,16 +218,13 @@ class OilSpill(DobermanBase):
                         default_target = '{}_console.txt'.format(self.jobname)
                         info['target file'] = default_target
                         target_location = os.path.join(path, default_target)
-
-                        current_target = target if 'target' in locals() else \
-                            None
-                        text = text if 'text' in locals() else None
                         try:
-                            if not text or current_target != default_target:
-                                # reload the text:
-                                with open(target_location, 'r') as grep_me:
-                                    text = grep_me.read()
-                            info['text'] = text
+                            if self.build_files.streams(target_location):
+                                info['text'] = \
+                                    self.build_files.tail(target_location)
+                            else:
+                                info['text'] = \
+                                    self.build_files.text(target_location)
                         except IOError as e:
                             info['text'] = None
                             self.cli.LOG.error(e)
@@ -272,6 +277,9 @@ class OilSpill(DobermanBase):
                         if len(xmls_to_scan) < 1:
                             break
         matching_bugs = self.join_dicts(matching_bugs, unfiled_xml_fails)
+        self.cli.LOG.info("{0} build {1}: {2}".format(
+            self.jobname, self.build_number, self.build_files.report()))
+        self.build_files.close()
 
         if bug_unmatched and (build_status == 'FAILURE' or
                               build_status == 'Unknown'):
@@ -299,18 +307,41 @@ class OilSpill(DobermanBase):
                 self.message = 0
         return (matching_bugs, build_status)
 
+    def bugs_for_job(self):
+        """ Returns (bug_id, bug_info) for only the bugs in the database that
+            have regexps for this job, using the regex bank's index rather
+            than walking every bug.
+        """
+        regex_bank = getattr(self.cli, 'regex_bank', None)
+        if regex_bank is None:
+            return self.cli.bugs.items()
+        return [(bug_id, self.cli.bugs[bug_id]) for bug_id in
+                regex_bank.bug_ids_for_job(self.jobname)]
+
+    def index_uxfs(self, unfiled_xml_fails):
+        """ Returns {(xunit class, xunit name): [bug_id, ...]} for the
+            unfiled xml fails, so those for a test can be removed directly
+            once a bug has been found for it.
+        """
+        uxfs_by_test = {}
+        for bug_id, uxf in unfiled_xml_fails.items():
+            addinfo = uxf['additional info']
+            test = (addinfo['xunit class'], addinfo['xunit name'])
+            uxfs_by_test.setdefault(test, []).append(bug_id)
+        return uxfs_by_test
+
     def populate_uxfs(self, errors_and_fails, info, target, bug_unmatched,
                       build_status, unfiled_xml_fails):
-        """ Populates unfiled_xml_fails dictionary. """
+        """ Populates unfiled_xml_fails dictionary from XunitFailures. """
         uxf_dict = {}
         for fail in errors_and_fails:
             specific_info = info.copy()
-            pre_log = fail.get('message').split("begin captured logging")[0]
+            pre_log = fail.message.split("begin captured logging")[0]
             if not self.cli.reduced_output_text:
                 specific_info['text'] = pre_log
             specific_info['target file'] = target
-            specific_info['xunit class'] = fail.getparent().get('classname')
-            specific_info['xunit name'] = fail.getparent().get('name')
+            specific_info['xunit class'] = fail.classname
+            specific_info['xunit name'] = fail.name
 
             bug_id = 'unfiled-' + str(uuid.uuid4())
             jlink = ('{0}/job/{1}/{2}/console'
@@ -332,73 +363,108 @@ class OilSpill(DobermanBase):
 
     def rematch(self, bugs, target_file, orig_filename_in_db, text,
                 testcase_name, testcaseclass_name, testframework_name,
-                testframework_version, test_result="unknown"):
+                testframework_version, test_result="unknown", bug_id=None,
+                branch=None, target_location=None):
         """ Search files in bugs for multiple matching regexps. """
         if target_file == "{}_console.txt".format(self.jobname):
             orig_filename_in_db = "console.txt"
-        target_bugs = bugs.get(orig_filename_in_db, bugs.get('*'))
+        db_filename = orig_filename_in_db if orig_filename_in_db in bugs \
+            else '*'
+        target_bugs = bugs.get(db_filename)
         if not target_bugs:
             return
-        regexps = target_bugs.get('regexp')
+        banked = self.get_banked_regexp(bug_id, db_filename, branch,
+                                        target_bugs.get('regexp'))
+        if banked is None:
+            return
+        regexps = banked.regexps
 
-        if type(regexps) == list:
-            if len(regexps) > 1:
-                regexp = '|'.join(regexps)
-                set_re = set([regexp])
+        if self.is_match(banked, bug_id, db_filename, branch, text,
+                         target_location):
+            self.report_bugoccurrence(
+                testcase_name, testcaseclass_name, testframework_name,
+                testframework_version, test_result)
+            if '*' in orig_filename_in_db:
+                return {orig_filename_in_db: {'regexp': regexps}}
             else:
-                regexp = regexps[0]
-                set_re = set(regexps)
-        else:
-            regexp = regexps
-            set_re = set([regexps])
-
-        if regexp not in ['None', None, '']:
-            matches = re.compile(regexp, re.DOTALL).findall(text)
-            if matches:
-                if len(set(matches)) >= len(set_re):
-                    self.report_bugoccurrence(
-                        testcase_name, testcaseclass_name, testframework_name,
-                        testframework_version, test_result)
-                    if '*' in orig_filename_in_db:
-                        return {orig_filename_in_db: {'regexp': regexps}}
-                    else:
-                        return {target_file: {'regexp': regexps}}
+                return {target_file: {'regexp': regexps}}
+
+    def is_match(self, banked, bug_id, db_filename, branch, text,
+                 target_location=None):
+        """ When text is the contents of a file (target_location), every
+            regexp in the bank that targets that file is checked in one
+            MultiPattern scan the first time any of them is asked for, and the
+            result is reused for the rest. Otherwise (e.g. xunit failure
+            messages) the regexp is run on its own.
+
+            If text is None, the file is too big to be read whole, so it is
+            scanned a window at a time instead.
+        """
+        regex_bank = getattr(self.cli, 'regex_bank', None)
+        scanner = None
+        if regex_bank is not None and target_location is not None:
+            scanner = regex_bank.scanner(self.jobname, db_filename)
+        streaming = text is None and target_location is not None
+        if scanner is None or (bug_id, branch) not in scanner:
+            if streaming:
+                scanner = MultiPattern()
+                scanner.add((bug_id, branch), banked.pattern, banked.literals)
+                return (bug_id, branch) in self.scan_windows(
+                    scanner, target_location)
+            if regex_bank is not None and text is not None:
+                if not regex_bank.prefilter(banked, text):
+                    return False
+            return banked.found_in(text)
+        scan_key = (target_location, db_filename)
+        if scan_key not in self.scanned:
+            if streaming:
+                self.scanned[scan_key] = self.scan_windows(
+                    scanner, target_location)
+            else:
+                self.scanned[scan_key] = scanner.scan(text)
+        return (bug_id, branch) in self.scanned[scan_key]
+
+    def scan_windows(self, scanner, target_location):
+        """ Scan target_location with scanner a window at a time, only
+            reading all of it if a regexp could match across more lines than
+            the windows overlap by.
+        """
+        self.cli.LOG.info("Scanning {0} in windows of {1} lines overlap"
+                          .format(target_location,
+                                  self.build_files.overlap_lines))
+        return scanner.scan_windows(
+            self.build_files.windows(target_location),
+            self.build_files.overlap_lines,
+            lambda: self.build_files.read(target_location))
+
+    def get_banked_regexp(self, bug_id, db_filename, branch, regexps):
+        """ Return the precompiled regexp from the regex bank built when the
+            bugs database was loaded, only compiling it here if there is no
+            bank (or no entry in it) for this bug.
+        """
+        regex_bank = getattr(self.cli, 'regex_bank', None)
+        key = (bug_id, self.jobname, db_filename, branch)
+        if regex_bank is not None and key in regex_bank:
+            return regex_bank.get(*key)
+        return RegexBank().compile_regexps(regexps)
 
     def report_bugoccurrence(self, testcase_name, testcaseclass_name,
                              testframework_name, testframework_version,
                              test_result):
-        """ Create bug occurrence. """
+        """ Queue a bug occurrence to be submitted to Weebl (in the
+            background, see BugOccurrenceSubmitter).
+        """
         if not self.cli.use_weebl:
             msg = "use_weebl set to False: "
             msg += "This bug occurrence has not been submitted to Weebl"
             self.cli.LOG.warn(msg)
             return
-        try:
-            testcaseinstance_uri =\
-                self.weebl.get_testcaseinstance_resource_uri(
-                    self.build_number, testcase_name, testcaseclass_name,
-                    testframework_name, testframework_version)
-        except UnrecognisedInstance:
-            testcase_uuid =\
-                self.weebl.set_up_test_framework_caseclass_and_case(
-                    testframework_name, testframework_version,
-                    testcaseclass_name, testcase_name)
-            testcaseinstance = self.weebl.create_testcaseinstance(
-                self.build_uuid, testcase_uuid, self.pipeline,
-                test_result)
-            testcaseinstance_uri =\
-                self.weebl.get_testcaseinstance_uri_from_uuid(testcaseinstance)
-        knownbugregex_uri =\
-            self.weebl.get_knownbugregex_resource_uri_from_regex_uuid(
-                self.regex_uuid)
-        try:
-            self.weebl.create_bugoccurrence(
-                testcaseinstance_uri, knownbugregex_uri)
-        except InstanceAlreadyExists:
-            msg = "There is already a bug occurrence logged for regex: '{}' "
-            msg += "in testcaseinstance: '{}'"
-            self.cli.LOG.warn(
-                msg.format(knownbugregex_uri, testcaseinstance_uri))
+        occurrence = BugOccurrence(
+            self.build_number, self.jobname, self.pipeline, testcase_name,
+            testcaseclass_name, testframework_name, testframework_version,
+            test_result, self.regex_uuid)
+        self.bugoccurrences.append(occurrence)
+        shared_bugoccurrence_submitter(self.cli, self.weebl).add(occurrence)
 
     def oil_survey(self, path, pipeline, extracted_info):
         self.oil_df = extracted_info['oil_df']
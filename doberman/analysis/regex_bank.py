@@ -0,0 +1,148 @@
+import re
+from doberman.analysis.multi_pattern import MultiPattern
+from doberman.analysis.regex_literals import all_literals_in, required_literals
+
+
+class BankedRegexp(object):
+    """A single compiled entry in the RegexBank."""
+
+    def __init__(self, regexps, pattern):
+        self.regexps = regexps
+        self.pattern = pattern
+        # Literal text that must be present for the pattern to match:
+        self.literals = required_literals(pattern)
+
+    def found_in(self, text, pos=0):
+        """ Existence check: stops at the first match rather than collecting
+            every match (and backtracking through the whole text for each
+            one) as findall does.
+        """
+        return self.pattern.search(text, pos) is not None
+
+
+class RegexBank(object):
+    """
+    Compiles every regexp in the bugs database once, when the database is
+    loaded, rather than once per bug per target file per build. Entries are
+    keyed by (bug_id, job, target file, or-branch), where target file is the
+    name as it appears in the database (e.g. 'console.txt', not
+    'pipeline_deploy_console.txt') and or-branch is the position of the
+    and-dict in that job's list.
+
+    It also holds an inverted index of the database, mapping job name ->
+    target file (glob) -> [(bug_id, or-branch), ...], so that a build only
+    needs to look at the bugs that could possibly apply to its job. For each
+    (job, target file) the regexps are also gathered into a MultiPattern, so
+    a file's text can be checked against all of them at once.
+    """
+
+    def __init__(self, bugs=None, flags=re.DOTALL):
+        self.flags = flags
+        self.entries = {}
+        self.index = {}
+        self.job_bug_ids = {}
+        self.scanners = {}
+        self.evaluated = 0
+        self.avoided = 0
+        if bugs:
+            self.populate(bugs)
+
+    def populate(self, bugs):
+        for bug_id, bug_info in bugs.items():
+            for job, or_list in bug_info.items():
+                # Skip 'category', 'description', 'regex_uuid', etc:
+                if type(or_list) is not list:
+                    continue
+                for branch, and_dict in enumerate(or_list):
+                    for target_file, target_bugs in and_dict.items():
+                        if type(target_bugs) is not dict:
+                            continue
+                        key = (bug_id, job, target_file, branch)
+                        banked = self.compile_regexps(
+                            target_bugs.get('regexp'))
+                        self.entries[key] = banked
+                        self.add_to_index(bug_id, job, target_file, branch)
+                        if banked is not None:
+                            scanner = self.scanners.setdefault(
+                                (job, target_file), MultiPattern())
+                            scanner.add((bug_id, branch), banked.pattern,
+                                        banked.literals)
+
+    def add_to_index(self, bug_id, job, target_file, branch):
+        targets = self.index.setdefault(job, {})
+        targets.setdefault(target_file, []).append((bug_id, branch))
+        # Keep the bugs in database order, so builds are scanned as before:
+        job_bug_ids = self.job_bug_ids.setdefault(job, [])
+        if bug_id not in job_bug_ids:
+            job_bug_ids.append(bug_id)
+
+    def compile_regexps(self, regexps):
+        """ Multiple regexps are joined into a single alternation, exactly as
+            OilSpill.rematch used to do inline. Returns None for empty
+            regexps so that they never match.
+        """
+        regexp = self.join_regexps(regexps)
+        if regexp in ['None', None, '']:
+            return
+        return BankedRegexp(regexps, re.compile(regexp, self.flags))
+
+    def join_regexps(self, regexps):
+        if type(regexps) == list:
+            if len(regexps) > 1:
+                return '|'.join(regexps)
+            return regexps[0]
+        return regexps
+
+    def bug_ids_for_job(self, job):
+        """ The ids of the bugs with at least one regexp for this job. """
+        return self.job_bug_ids.get(job, [])
+
+    def targets_for_job(self, job):
+        """ Target file (glob) -> [(bug_id, or-branch), ...] for this job. """
+        return self.index.get(job, {})
+
+    def target_files(self):
+        """ Every target file (glob) in the database, for any job. """
+        return set([target_file for targets in self.index.values()
+                    for target_file in targets])
+
+    def prefilter(self, banked, text):
+        """ Returns False, without running the regexp, if text is missing any
+            of the literals that banked needs in order to match.
+        """
+        if all_literals_in(banked.literals, text):
+            self.evaluated += 1
+            return True
+        self.avoided += 1
+        return False
+
+    def prefilter_counts(self):
+        """ Returns (regexp evaluations run, regexp evaluations avoided) by
+            the literal prefilters, both here and in every MultiPattern.
+        """
+        evaluated = self.evaluated + sum(
+            [scanner.evaluated for scanner in self.scanners.values()])
+        avoided = self.avoided + sum(
+            [scanner.avoided for scanner in self.scanners.values()])
+        return (evaluated, avoided)
+
+    def prefilter_report(self):
+        (evaluated, avoided) = self.prefilter_counts()
+        total = evaluated + avoided
+        rate = (100.0 * avoided / total) if total else 0
+        msg = "Literal prefilter avoided {0} of {1} regexp evaluations "
+        msg += "({2:.1f}% miss rate, {3} evaluated)"
+        return msg.format(avoided, total, rate, evaluated)
+
+    def scanner(self, job, target_file):
+        """ The MultiPattern for every regexp targeting this job's file. """
+        return self.scanners.get((job, target_file))
+
+    def get(self, bug_id, job, target_file, branch):
+        return self.entries.get((bug_id, job, target_file, branch))
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,162 @@
+import re
+import sre_parse
+from sre_constants import (
+    ANY, ASSERT, AT, AT_BOUNDARY, BRANCH, CATEGORY, CATEGORY_DIGIT,
+    CATEGORY_NOT_SPACE, CATEGORY_WORD, IN, LITERAL, MAX_REPEAT, MAXREPEAT,
+    MIN_REPEAT, NEGATE, NOT_LITERAL, RANGE, SUBPATTERN)
+
+MIN_LITERAL_LENGTH = 3
+UNBOUNDED = float('inf')
+NEWLINE = ord('\n')
+# \d, \w and \S never match a newline:
+NO_NEWLINE_CATEGORIES = (CATEGORY_DIGIT, CATEGORY_WORD, CATEGORY_NOT_SPACE)
+
+
+def parse_regexp(pattern):
+    """ Parse a compiled regexp, or return None if it is case insensitive
+        (so its literals cannot be found with a plain 'in').
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return
+    if parsed.pattern.flags & re.IGNORECASE:
+        return
+    return parsed
+
+
+def literal_prefix(pattern):
+    """ Return the literal text that every match of pattern must start with,
+        or None if there isn't one worth screening for.
+    """
+    parsed = parse_regexp(pattern)
+    if parsed is None:
+        return
+    prefix = []
+    for op, av in parsed:
+        if op != LITERAL or av > 127:
+            break
+        prefix.append(chr(av))
+    prefix = "".join(prefix)
+    if len(prefix) < MIN_LITERAL_LENGTH:
+        return
+    return prefix
+
+
+def required_literals(pattern, max_literals=3):
+    """ Return the longest literal fragments (longest first) that must all
+        appear in any text that pattern matches, e.g. ['No route to host',
+        'Deployment failed', 'ERROR'] for 'ERROR.*Deployment failed..*No
+        route to host'. Fragments inside alternations, optional groups and
+        lookarounds are not required, so are never returned.
+    """
+    parsed = parse_regexp(pattern)
+    if parsed is None:
+        return []
+    fragments = []
+    collect_required_literals(parsed, fragments)
+    literals = set([frag for frag in fragments
+                    if len(frag) >= MIN_LITERAL_LENGTH])
+    return sorted(literals, key=lambda lit: (-len(lit), lit))[:max_literals]
+
+
+def collect_required_literals(subpattern, fragments):
+    run = []
+    for op, av in subpattern:
+        if op == LITERAL and av <= 127:
+            run.append(chr(av))
+            continue
+        fragments.append("".join(run))
+        run = []
+        if op == SUBPATTERN:
+            # (group, pattern), or (group, add_flags, del_flags, pattern) in
+            # newer pythons where the group may switch on IGNORECASE:
+            if len(av) == 4 and av[1] & re.IGNORECASE:
+                continue
+            collect_required_literals(av[-1], fragments)
+        elif op in (MAX_REPEAT, MIN_REPEAT) and av[0] >= 1:
+            collect_required_literals(av[2], fragments)
+    fragments.append("".join(run))
+
+
+def all_literals_in(literals, text):
+    """ Cheap check for the literals a regexp requires, longest first. Uses
+        find rather than 'in' so that text can also be a mmap.
+    """
+    for literal in literals:
+        if text.find(literal) < 0:
+            return False
+    return True
+
+
+def newlines_spanned(pattern):
+    """ Return the most newlines that any match of pattern (including its
+        lookbehinds and lookaheads) can contain, UNBOUNDED if there is no
+        limit (e.g. '.*' with DOTALL), or None if pattern can only be
+        searched for in the whole of a text. That is the case for anchors
+        ('^', '$', '\\B', ...), negative lookarounds and backreferences, as
+        they can match at the edges of a part of the text where they would
+        not match in the whole.
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return
+    return count_newlines(parsed, parsed.pattern.flags & re.DOTALL)
+
+
+def count_newlines(subpattern, dotall):
+    total = 0
+    for op, av in subpattern:
+        if op == LITERAL:
+            spanned = 1 if av == NEWLINE else 0
+        elif op == NOT_LITERAL:
+            spanned = 0 if av == NEWLINE else 1
+        elif op == ANY:
+            spanned = 1 if dotall else 0
+        elif op == IN:
+            spanned = 1 if set_matches_newline(av) else 0
+        elif op == AT:
+            if av != AT_BOUNDARY:
+                return
+            spanned = 0
+        elif op == SUBPATTERN:
+            spanned = count_newlines(av[-1], dotall)
+        elif op == ASSERT:
+            spanned = count_newlines(av[1], dotall)
+        elif op == BRANCH:
+            branches = [count_newlines(branch, dotall) for branch in av[1]]
+            if None in branches:
+                return
+            spanned = max(branches)
+        elif op in (MAX_REPEAT, MIN_REPEAT):
+            spanned = count_newlines(av[2], dotall)
+            if spanned and av[1] == MAXREPEAT:
+                spanned = UNBOUNDED
+            elif spanned:
+                spanned *= av[1]
+        else:
+            # ASSERT_NOT, GROUPREF, GROUPREF_EXISTS, etc:
+            return
+        if spanned is None:
+            return
+        total += spanned
+    return total
+
+
+def set_matches_newline(items):
+    """ Whether a character set, e.g. '[^a-z]' or '[\\s,]', includes '\\n'. """
+    negated = False
+    matches = False
+    for op, av in items:
+        if op == NEGATE:
+            negated = True
+        elif op == LITERAL:
+            matches = matches or av == NEWLINE
+        elif op == RANGE:
+            matches = matches or av[0] <= NEWLINE <= av[1]
+        elif op == CATEGORY:
+            matches = matches or av not in NO_NEWLINE_CATEGORIES
+        else:
+            matches = True
+    return matches != negated
@@ -0,0 +1,82 @@
+import os
+import yaml
+import tempfile
+
+
+class TriageWriter(object):
+    """
+    Writes each job's triage_<job>.yml a pipeline at a time, as soon as each
+    pipeline has been analysed, rather than holding every pipeline's results
+    in memory to dump them all at the end.
+
+    Each pipeline's entry is dumped on its own to a temporary spool file as
+    it arrives, and only where it is in the spool is kept in memory. close()
+    then writes the files with the same layout and content as when the whole
+    yaml dict was dumped in one go ({'pipeline': {pipeline_id: {...}, ...}}):
+    the 'pipeline' key first, then each pipeline's entry in order of pipeline
+    id, indented beneath it. A pipeline written more than once has its entries
+    merged, later keys replacing earlier ones (as join_dicts does).
+    """
+
+    def __init__(self, reportdir, jobs):
+        self.reportdir = reportdir
+        if not os.path.isdir(reportdir):
+            os.makedirs(reportdir)
+        self.files = {}
+        # job -> {pipeline_id: [(offset, length) in the spool, ...]}:
+        self.written = {}
+        for job in jobs:
+            self.files[job] = tempfile.TemporaryFile()
+            self.written[job] = {}
+
+    def path(self, job):
+        return os.path.join(self.reportdir, 'triage_' + job + '.yml')
+
+    def write(self, job, pipeline_dict):
+        """ Add the entries in pipeline_dict ({pipeline_id: {...}}) to job's
+            triage file.
+        """
+        spool = self.files[job]
+        written = self.written[job]
+        for pipeline_id, entry in sorted(pipeline_dict.items()):
+            text = yaml.safe_dump({pipeline_id: entry},
+                                  default_flow_style=False)
+            written.setdefault(pipeline_id, []).append(
+                (spool.tell(), len(text)))
+            spool.write(text)
+
+    def read(self, job, chunk):
+        spool = self.files[job]
+        spool.seek(chunk[0])
+        text = spool.read(chunk[1])
+        spool.seek(0, os.SEEK_END)
+        return text
+
+    def merged(self, job, pipeline_id, chunks):
+        """ The yaml of a pipeline's entries, merged. """
+        entry = {}
+        for chunk in chunks:
+            entry = dict(entry.items() + yaml.safe_load(
+                self.read(job, chunk))[pipeline_id].items())
+        return yaml.safe_dump({pipeline_id: entry}, default_flow_style=False)
+
+    def close(self):
+        """ Write out each file, returning the names of those written. """
+        for job, spool in self.files.items():
+            written = self.written[job]
+            with open(self.path(job), 'w') as triage_file:
+                if not written:
+                    triage_file.write(yaml.safe_dump(
+                        {'pipeline': {}}, default_flow_style=False))
+                else:
+                    triage_file.write('pipeline:\n')
+                for pipeline_id in sorted(written):
+                    chunks = written[pipeline_id]
+                    if len(chunks) == 1:
+                        text = self.read(job, chunks[0])
+                    else:
+                        text = self.merged(job, pipeline_id, chunks)
+                    triage_file.write(''.join(
+                        ['  ' + line for line in text.splitlines(True)]))
+            spool.close()
+        return [os.path.basename(self.path(job)) for job in self.files]
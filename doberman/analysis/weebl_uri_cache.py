@@ -0,0 +1,127 @@
+import os
+import yaml
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def shared_weebl_uri_cache(cli):
+    """ The WeeblUriCache for this process (see shared_weebl_client). """
+    if getattr(cli, 'weebl_uris', None) is None:
+        cli.weebl_uris = WeeblUriCache(
+            cli.LOG, cli.weebl_url, cli.weebl_uri_cache_size,
+            cli.weebl_uri_cache_file)
+    return cli.weebl_uris
+
+
+class WeeblUriCache(object):
+    """
+    A process-wide, least recently used cache of what Weebl looks up the same
+    way for every build: the resource uri of each known bug regex (by regex
+    uuid) and the uuid of each test case (by test framework, framework
+    version, test case class and test case name). Once full, the entry used
+    longest ago is dropped to make room.
+
+    If given a path, the cache is loaded from it when created and saved back
+    to it by save(), so that lookups are also shared between runs. Entries
+    saved against a different Weebl are ignored.
+
+    A worker process's cache is a copy of its parent's, so once learned is
+    set to a list, each lookup a worker makes is also added to it, to be
+    passed back (see take_learned) and merged into the parent's cache.
+    """
+
+    def __init__(self, LOG, weebl_url, max_entries=10000, path=None):
+        self.LOG = LOG
+        self.weebl_url = weebl_url.rstrip('/')
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.learned = None
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self.load()
+
+    def get(self, kind, key, lookup):
+        """ Return the cached value for (kind, key), or else lookup() (which
+            is cached unless it is None).
+        """
+        cache_key = (kind, tuple(key) if type(key) is list else key)
+        with self.lock:
+            if cache_key in self.entries:
+                # Move to the most recently used end:
+                value = self.entries.pop(cache_key)
+                self.entries[cache_key] = value
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = lookup()
+        if value is not None:
+            self.add(cache_key, value)
+            with self.lock:
+                if self.learned is not None:
+                    self.learned.append((kind, cache_key[1], value))
+        return value
+
+    def add(self, cache_key, value):
+        with self.lock:
+            self.entries.pop(cache_key, None)
+            self.entries[cache_key] = value
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def take_learned(self):
+        """ Return [(kind, key, value), ...] for what has been looked up
+            since this was last called.
+        """
+        with self.lock:
+            (learned, self.learned) = (self.learned or [], [])
+        return learned
+
+    def merge(self, learned):
+        """ Add what another process's cache learned (see take_learned). """
+        for (kind, key, value) in learned:
+            self.add((kind, key), value)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as cache_file:
+                saved = yaml.safe_load(cache_file)
+        except (IOError, yaml.YAMLError):
+            return
+        if not isinstance(saved, dict) or saved.get('weebl') != self.weebl_url:
+            return
+        for (kind, key, value) in saved.get('entries') or []:
+            self.add((kind, tuple(key) if type(key) is list else key), value)
+        self.LOG.info("Loaded {0} Weebl uris from {1}".format(
+            len(self.entries), self.path))
+
+    def save(self):
+        """ Write the cache to path (if there is one), oldest entry first. """
+        if self.path is None:
+            return
+        with self.lock:
+            entries = [[kind, list(key) if type(key) is tuple else key, value]
+                       for ((kind, key), value) in self.entries.items()]
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        (handle, tmp) = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as cache_file:
+                cache_file.write(yaml.safe_dump(
+                    {'weebl': self.weebl_url, 'entries': entries},
+                    default_flow_style=False))
+            os.rename(tmp, self.path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = (100.0 * self.hits / total) if total else 0
+        msg = "Weebl uri cache: {0} of {1} lookups cached "
+        msg += "({2:.1f}% hit rate), {3} entries"
+        return msg.format(self.hits, total, rate, len(self.entries))
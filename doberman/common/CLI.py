@@ -92,6 +92,10 @@ class CLI(DobermanBase):
                         dest='weebl_username', default=None,
                         help='Name of user for Weebl REST API authentication')
         #
+        prsr.add_option('--workers', action='store', dest='workers',
+                        default=None, type='int',
+                        help='Number of processes to analyse pipelines with')
+        #
         prsr.add_option('-U', '--uuid', action='store',
                         dest='uuid', default=None,
                         help='Unique identifier of environment.')
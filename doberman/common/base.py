@@ -72,6 +72,22 @@ class DobermanBase(object):
                     old_dict[new_pipeline].items() + new_pl_dict.items())
         return combined_dict
 
+    def merge_dicts(self, combined_dict, new_dict):
+        """ As join_dicts, but merges new_dict into combined_dict in place
+            (and returns it), rather than copying everything already in
+            combined_dict each time. Use it to accumulate results, where
+            join_dicts would make merging N of them O(N^2).
+        """
+        if new_dict in [None, {}, '']:
+            return combined_dict
+        for new_pipeline, new_pl_dict in new_dict.items():
+            if new_pipeline not in combined_dict:
+                combined_dict[new_pipeline] = new_pl_dict
+            else:
+                combined_dict[new_pipeline] = dict(
+                    combined_dict[new_pipeline].items() + new_pl_dict.items())
+        return combined_dict
+
     def calculate_progress(self, current_position, prog_list,
                            percentage_to_report_at=None):
         """
@@ -104,7 +120,8 @@ class DobermanBase(object):
             return str(report_at[progress.index(current_position)])
 
     def build_pl_ids_and_check(self, ci_server, buildtracker,
-                               ts_format='%a %d %b %Y %H:%M:%S'):
+                               ts_format='%a %d %b %Y %H:%M:%S',
+                               on_resolved=None):
         self.pipeline_ids = []
         self.ids = self.cli.ids
 
@@ -136,9 +153,21 @@ class DobermanBase(object):
             msg = "Getting pipeline ids for between {0} and {1} (UTC)"
             self.cli.LOG.info(msg.format(self.cli.start.strftime(ts_format),
                                          self.cli.end.strftime(ts_format)))
-            self.ids = buildtracker.get_pipelines_from_date_range(
+            # Streamed in, so they can be checked (and their build numbers
+            # looked up) while the rest are still being found:
+            self.ids = buildtracker.iter_pipelines_from_date_range(
                 self.cli.start, self.cli.end)
 
+        return buildtracker.get_all_pipelines(
+            self.check_pipeline_ids(ci_server, buildtracker), on_resolved)
+
+    def check_pipeline_ids(self, ci_server, buildtracker):
+        """ Yield each of self.ids that is a real pipeline id (looking up the
+            pipeline of each deploy build number first, if using those), also
+            adding it to self.pipeline_ids. If self.ids is a generator, how
+            many have been found so far is reported instead of a percentage.
+        """
+        sized = type(self.ids) in [list, set, dict]
         for pos, idn in enumerate(self.ids):
             if self.cli.use_deploy:
                 try:
@@ -154,16 +183,21 @@ class DobermanBase(object):
                 self.cli.LOG.error(msg)
             else:
                 self.pipeline_ids.append(pipeline)
+                yield pipeline
 
             # Notify user of progress:
-            checkin = 5 if len(self.pipeline_ids) > 20 else None
-            pgr = self.calculate_progress(pos, self.ids, checkin)
-            if pgr:
-                self.cli.LOG.info("Pipeline lookup {0}% complete.".format(pgr))
+            if sized:
+                checkin = 5 if len(self.pipeline_ids) > 20 else None
+                pgr = self.calculate_progress(pos, self.ids, checkin)
+                if pgr:
+                    self.cli.LOG.info(
+                        "Pipeline lookup {0}% complete.".format(pgr))
+            elif (pos + 1) % self.cli.date_range_page_size == 0:
+                self.cli.LOG.info("Pipeline lookup: {0} pipelines found so "
+                                  "far.".format(pos + 1))
         msg = "Pipeline lookup 100% complete: All pipelines checked. "
         msg += "Now downloading and processing data."
         self.cli.LOG.info(msg)
-        return buildtracker.get_all_pipelines(self.pipeline_ids)
 
     def write_output_yaml(self, output_dir, filename, yaml_dict, verbose=True):
         """
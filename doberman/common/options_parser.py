@@ -152,6 +152,125 @@ class OptionsParser(object):
             dont_scan = []
         self.dont_scan = tuple(dont_scan)
 
+        # Files bigger than this (MB) are scanned a window at a time:
+        try:
+            stream_above = cfg.get('DEFAULT', 'stream_files_above')
+        except NoOptionError:
+            stream_above = None
+        if stream_above in ['None', 'none', None, '']:
+            self.stream_files_above = None
+        else:
+            self.stream_files_above = int(float(stream_above) * 1024 * 1024)
+        try:
+            self.stream_chunk_size = int(float(cfg.get(
+                'DEFAULT', 'stream_chunk_size')) * 1024 * 1024)
+        except NoOptionError:
+            self.stream_chunk_size = 8 * 1024 * 1024
+        try:
+            self.stream_overlap_lines = int(cfg.get('DEFAULT',
+                                                    'stream_overlap_lines'))
+        except NoOptionError:
+            self.stream_overlap_lines = 100
+
+        # Read artifacts into memory, or memory-map them:
+        try:
+            self.artifact_access = cfg.get('DEFAULT', 'artifact_access')
+        except NoOptionError:
+            self.artifact_access = 'read'
+        if self.artifact_access not in ['read', 'mmap']:
+            err_msg = "artifact_access must be 'read' or 'mmap', not '{}'"
+            err_msg = err_msg.format(self.artifact_access)
+            self.LOG.error(err_msg)
+            raise Exception(err_msg)
+
+        # How many threads download build data, how many of them may talk to
+        # the same host at once and how many times a download is retried:
+        try:
+            self.download_workers = int(cfg.get('DEFAULT',
+                                                'download_workers'))
+        except NoOptionError:
+            self.download_workers = 8
+        try:
+            self.downloads_per_host = int(cfg.get('DEFAULT',
+                                                  'downloads_per_host'))
+        except NoOptionError:
+            self.downloads_per_host = 4
+        try:
+            self.download_retries = int(cfg.get('DEFAULT',
+                                                'download_retries'))
+        except NoOptionError:
+            self.download_retries = 3
+
+        # Connections kept open to each host by the jenkins session:
+        try:
+            self.http_pool_size = int(cfg.get('DEFAULT', 'http_pool_size'))
+        except NoOptionError:
+            self.http_pool_size = 10
+
+        # Only extract the files from tarballs that the bugs database targets:
+        try:
+            self.extract_targeted_only = cfg.get(
+                'DEFAULT', 'extract_targeted_only').lower() in ['true', 'yes']
+        except NoOptionError:
+            self.extract_targeted_only = False
+
+        # Where to keep downloads between runs (if anywhere), and how many MB
+        # the cache may grow to before the least recently used are removed:
+        try:
+            self.artifact_cache_dir = cfg.get('DEFAULT', 'artifact_cache_dir')
+        except NoOptionError:
+            self.artifact_cache_dir = None
+        if self.artifact_cache_dir in ['None', 'none', '']:
+            self.artifact_cache_dir = None
+        try:
+            cache_size = cfg.get('DEFAULT', 'artifact_cache_size')
+        except NoOptionError:
+            cache_size = None
+        if cache_size in ['None', 'none', None, '']:
+            self.artifact_cache_size = None
+        else:
+            self.artifact_cache_size = int(float(cache_size) * 1024 * 1024)
+
+        # Where to save the bugs found in each build as soon as it is scanned,
+        # so that reruns skip builds already scanned (or None not to):
+        try:
+            self.checkpoint_dir = cfg.get('DEFAULT', 'checkpoint_dir')
+        except NoOptionError:
+            self.checkpoint_dir = None
+        if self.checkpoint_dir in ['None', 'none', '']:
+            self.checkpoint_dir = None
+
+        # How many Weebl lookups to cache, and where to keep them between runs
+        # (if anywhere):
+        try:
+            self.weebl_uri_cache_size = int(
+                cfg.get('DEFAULT', 'weebl_uri_cache_size'))
+        except NoOptionError:
+            self.weebl_uri_cache_size = 10000
+        try:
+            self.weebl_uri_cache_file = cfg.get('DEFAULT',
+                                                'weebl_uri_cache_file')
+        except NoOptionError:
+            self.weebl_uri_cache_file = None
+        if self.weebl_uri_cache_file in ['None', 'none', '']:
+            self.weebl_uri_cache_file = None
+
+        # How many pipelines to get from Weebl per request for a date range:
+        try:
+            self.date_range_page_size = int(
+                cfg.get('DEFAULT', 'date_range_page_size'))
+        except NoOptionError:
+            self.date_range_page_size = 500
+
+        # cli wins, then config, otherwise analyse pipelines in this process:
+        if opts.workers:
+            self.workers = opts.workers
+        else:
+            try:
+                self.workers = int(cfg.get('DEFAULT', 'workers'))
+            except NoOptionError:
+                self.workers = 1
+
         # cli wins, then config, otherwise default to True
         if opts.unverified:
             self.verify = False
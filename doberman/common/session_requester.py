@@ -0,0 +1,93 @@
+import threading
+import requests
+from urlparse import urlsplit, urlunsplit
+from requests.adapters import HTTPAdapter
+from jenkinsapi.jenkins import Requester
+
+
+class SessionRequester(Requester):
+    """
+    A jenkinsapi Requester that sends every request through one shared
+    requests.Session, so connections to jenkins are kept alive and reused
+    (from a pool of up to pool_size per host) rather than a new one being
+    opened for each console, artifact or API call. Any cookies are set on the
+    session, and if netloc is given every url is rewritten to use it. Each
+    request is otherwise made just as jenkinsapi's own Requester would make
+    it, with the same credentials, ssl_verify, cert and timeout.
+
+    Counts the requests made and the connections opened for them.
+    """
+
+    def __init__(self, baseurl, cookies=None, ssl_verify=True, netloc=None,
+                 pool_size=10, timeout=10, username=None, password=None,
+                 cert=None):
+        super(SessionRequester, self).__init__(
+            username=username, password=password, ssl_verify=ssl_verify,
+            cert=cert, baseurl=baseurl, timeout=timeout)
+        self.netloc = netloc
+        self.cookies = cookies
+        self.pool_size = pool_size
+        self.session = self.new_session()
+        self.lock = threading.Lock()
+        self.requests_made = 0
+
+    def new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if self.cookies:
+            session.cookies.update(self.cookies)
+        return session
+
+    def reset(self):
+        """ Start again with a new session, leaving the connections of the
+            current one alone (e.g. in a forked process, where they are
+            shared with the parent).
+        """
+        self.session = self.new_session()
+        self.lock = threading.Lock()
+
+    def rewrite_url(self, url):
+        if not self.netloc:
+            return url
+        parts = urlsplit(url)
+        return urlunsplit((parts.scheme, self.netloc, parts.path, parts.query,
+                           parts.fragment))
+
+    def request(self, method, url, params=None, data=None, files=None,
+                headers=None, **kwargs):
+        request_kwargs = self.get_request_dict(
+            params=params, data=data, files=files, headers=headers, **kwargs)
+        with self.lock:
+            self.requests_made += 1
+        return self.session.request(method, self.rewrite_url(url),
+                                    **request_kwargs)
+
+    def get_url(self, url, params=None, headers=None, allow_redirects=True,
+                stream=False):
+        return self.request('get', url, params=params, headers=headers,
+                            allow_redirects=allow_redirects, stream=stream)
+
+    def post_url(self, url, params=None, data=None, files=None, headers=None,
+                 allow_redirects=True, **kwargs):
+        return self.request('post', url, params=params, data=data,
+                            files=files, headers=headers,
+                            allow_redirects=allow_redirects, **kwargs)
+
+    def connections_opened(self):
+        """ The number of connections opened by the session's pools. """
+        opened = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                opened += pools[key].num_connections
+        return opened
+
+    def close(self):
+        self.session.close()
+
+    def report(self):
+        return ("{0} requests made to jenkins over {1} connections"
+                .format(self.requests_made, self.connections_opened()))
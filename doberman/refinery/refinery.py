@@ -11,6 +11,7 @@ from doberman.analysis.crude_jenkins import Jenkins
 from doberman.analysis.crude_weebl import WeeblClass
 from plotting import Plotting
 from difflib import SequenceMatcher
+from StringIO import StringIO
 from refinery_cli import CLI
 from datetime import datetime
 
@@ -43,6 +44,8 @@ class Refinery(DobermanBase):
             self.remove_dirs(self.cli.crude_job)
             [os.remove(os.path.join(self.cli.reportdir, bdict)) for bdict in
              os.listdir(self.cli.reportdir) if 'bugs_dict_' in bdict]
+        if hasattr(self, 'jenkins'):
+            self.cli.LOG.info(self.jenkins.connection_report())
         doberman_finish_time = datetime.now()
         self.cli.LOG.info(self.report_time_taken(doberman_start_time,
                                                  doberman_finish_time))
@@ -155,7 +158,7 @@ class Refinery(DobermanBase):
                 artifact_found = False
                 if marker in str(artifact):
                     artifact_found = True
-                    artifact.save_to_dir(outdir)
+                    self.jenkins.save_artifact(artifact, outdir)
                     # TODO: Would these ever need renaming?
 
         if not artifact_found and job != self.cli.crude_job:
@@ -232,7 +235,7 @@ class Refinery(DobermanBase):
                         new_bugs = self.unify(crude_job, marker, job, filename,
                                               crude_folder)
 
-                        bug_dict = self.join_dicts(bug_dict, new_bugs)
+                        self.merge_dicts(bug_dict, new_bugs)
 
                         job_specific_bugs_dict[job] = new_bugs
                     else:
@@ -242,7 +245,7 @@ class Refinery(DobermanBase):
                     new_bugs = self.unify(crude_job, marker, job, filename,
                                           self.cli.reportdir)
 
-                    bug_dict = self.join_dicts(bug_dict, new_bugs)
+                    self.merge_dicts(bug_dict, new_bugs)
 
                     job_specific_bugs_dict[job] = new_bugs
                 else:
@@ -271,9 +274,8 @@ class Refinery(DobermanBase):
                             new_bugs = self.unify(crude_job, marker, job,
                                                   filename, crude_dir,
                                                   build_num)
-                            bug_dict = self.join_dicts(bug_dict, new_bugs)
-                            job_specific_bugs = \
-                                self.join_dicts(job_specific_bugs, new_bugs)
+                            self.merge_dicts(bug_dict, new_bugs)
+                            self.merge_dicts(job_specific_bugs, new_bugs)
 
                     if 'new_bugs' in locals():
                         job_specific_bugs_dict[job] = new_bugs
@@ -491,39 +493,20 @@ class Refinery(DobermanBase):
             if info_file in self.info_file_cache:
                 return self.info_file_cache[info_file]
 
-            # Temporarily load up the whole output file into memory:
+            # Consoles can be huge, so go through them a line at a time:
             try:
                 with open(info_file, 'r') as f:
-                    info = f.read()
+                    (traceback, errs, fails) = \
+                        self.find_tracebacks_errors_and_fails(f, pipelines)
             except IOError as e:
-                info = None
+                (traceback, errs, fails) = ('', [], [])
                 self.cli.LOG.error(e)
-
-        # replace pipeline id(s) with placeholder:
-        pl_placeholder = 'AAAAAAAA-BBBB-CCCC-DDDD-EEEEEEEEEEEE'
-        for pl in pipelines:
-            info = info.replace(pl, pl_placeholder) if info else ''
-
-        # replace numbers with 'X'
-        info = re.sub(r'\d', 'X', info) if info else ''
-
-        # Search for traceback:
-        traceback_list = []
-        tb_split = info.split('Traceback')
-        for tb in tb_split[1:]:
-            dt_split = (tb.split('XXXX-XX-XX XX:XX:XX') if tb_split[0] != ''
-                        else '')
-            this_tb = 'Traceback' + dt_split[0] if dt_split != '' else ''
-            traceback_list.append(this_tb)
-        traceback = " ".join([str(n) for n in set(traceback_list)])
-        errs = ''
-        fails = ''
-        if not traceback:
-            # Search for errors:
-            errs = sorted(re.findall('ERROR.*', info))
-
-            # Search for failure:
-            fails = sorted(re.findall('fail.*', info, re.IGNORECASE))
+        else:
+            (traceback, errs, fails) = self.find_tracebacks_errors_and_fails(
+                StringIO(info), pipelines)
+        if traceback:
+            errs = ''
+            fails = ''
 
         bug_feedback = " ".join([str(n) for n in (traceback, errs, fails)])
         if (bug_feedback == ' [] []') or not bug_feedback.strip(' '):
@@ -533,6 +516,52 @@ class Refinery(DobermanBase):
             self.info_file_cache[info_file] = bug_feedback
             return bug_feedback
 
+    def find_tracebacks_errors_and_fails(self, lines, pipelines):
+        """
+        Replace pipeline ids with a placeholder and numbers with 'X' in each
+        line, then return the (space separated) set of tracebacks, i.e. the
+        text from each 'Traceback' up to the next timestamp, and sorted lists
+        of everything from 'ERROR' or 'fail' to the end of each line.
+        """
+        pl_placeholder = 'AAAAAAAA-BBBB-CCCC-DDDD-EEEEEEEEEEEE'
+        timestamp = 'XXXX-XX-XX XX:XX:XX'
+        tracebacks = set()
+        errs = []
+        fails = []
+        this_tb = None
+        tb_ended = False
+        # If the text starts with a traceback, no tracebacks are used:
+        skip_tbs = None
+        for line in lines:
+            for pl in pipelines:
+                line = line.replace(pl, pl_placeholder)
+            line = re.sub(r'\d', 'X', line)
+            if skip_tbs is None:
+                skip_tbs = line.startswith('Traceback')
+            errs.extend(re.findall('ERROR.*', line))
+            fails.extend(re.findall('fail.*', line, re.IGNORECASE))
+            pos = 0
+            while True:
+                tb_pos = line.find('Traceback', pos)
+                end = tb_pos if tb_pos >= 0 else len(line)
+                if this_tb is not None and not tb_ended:
+                    ts_pos = line.find(timestamp, pos, end)
+                    if ts_pos >= 0:
+                        end = ts_pos
+                        tb_ended = True
+                    this_tb.append(line[pos:end])
+                if tb_pos < 0:
+                    break
+                if this_tb is not None:
+                    tracebacks.add('' if skip_tbs else "".join(this_tb))
+                this_tb = ['Traceback']
+                tb_ended = False
+                pos = tb_pos + len('Traceback')
+        if this_tb is not None:
+            tracebacks.add('' if skip_tbs else "".join(this_tb))
+        traceback = " ".join([str(n) for n in tracebacks])
+        return (traceback, sorted(errs), sorted(fails))
+
     def group_similar_unfiled_bugs(self, unified_bugdict):
         self.cli.LOG.info("Grouping unfiled bugs by error similarity.")
         unfiled_bugs = {}
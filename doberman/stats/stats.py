@@ -29,6 +29,7 @@ class Stats(DobermanBase):
         self.jenkins_api = self.jenkins.jenkins_api
         self.op_dirs = []
         self.run_stats()
+        self.cli.LOG.info(self.jenkins.connection_report())
         stats_finish_time = datetime.now()
         self.cli.LOG.info(self.report_time_taken(
             stats_start_time, stats_finish_time))
@@ -103,15 +104,13 @@ class Stats(DobermanBase):
         if self.build_numbers in [None, {}]:
             return {}, {}, None
         for job in self.non_crude_job_names:
+            self.cli.LOG.info("Polling Jenkins for {} data".format(job))
             try:
                 jenkins_job = self.jenkins_api[job]
+                all_builds[job] = self.jenkins.job_builds(job)
             except UnknownJob:
                 self.cli.LOG.error("{} job is not recognised.".format(job))
                 continue
-            self.cli.LOG.info("Polling Jenkins for {} data".format(job))
-            url = jenkins_job.python_api_url(jenkins_job.baseurl)
-            all_builds[job] = jenkins_job.get_data(
-                url, params={'depth': 1})['builds']
             actives[job] = []
             for pipeline, build_dict in self.build_numbers.items():
                 build_number = build_dict.get(job)
@@ -122,10 +121,8 @@ class Stats(DobermanBase):
                     op_dir = self.create_output_directory(job)
                     self.jenkins.get_triage_data(build_number, job, op_dir)
 
-                try:
-                    this_build = [b for b in all_builds[job] if b['number'] ==
-                                  int(build_number)][0]
-                except IndexError:
+                this_build = self.jenkins.build_details(job, build_number)
+                if this_build is None:
                     continue
 
                 if self.is_running(this_build):
@@ -3,6 +3,9 @@ import yaml
 import json
 import tempfile
 import shutil
+import threading
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
 from doberman.tests.test_utils import DobermanTestBase
 from doberman.tests.regex import generate_from_regex
 from doberman.common import utils
@@ -28,6 +31,18 @@ class CommonTestMethods(DobermanTestBase):
                   'test_cloud_image': '00004',
                   'test_bundletests': '00005'}
 
+    def serve(self, handler):
+        """ Start a local HTTP server with handler on a background thread,
+            returning its url. It is shut down once the test has finished.
+        """
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return 'http://127.0.0.1:{}'.format(server.server_port)
+
     def tidy_up(self):
         files_to_ditch = ["pipelines_processed.yaml",
                           "triage_pipeline_deploy.yml",
@@ -88,6 +103,22 @@ class CommonTestMethods(DobermanTestBase):
         cli.verify = True
         cli.xmls = ['tempest_xunit.xml']
         cli.dont_scan = ".pyc .tar .gz wtmp"
+        cli.stream_files_above = None
+        cli.stream_chunk_size = 8 * 1024 * 1024
+        cli.stream_overlap_lines = 100
+        cli.artifact_access = 'read'
+        cli.download_workers = 8
+        cli.downloads_per_host = 4
+        cli.download_retries = 3
+        cli.http_pool_size = 10
+        cli.extract_targeted_only = False
+        cli.artifact_cache_dir = None
+        cli.artifact_cache_size = None
+        cli.checkpoint_dir = None
+        cli.weebl_uri_cache_size = 10000
+        cli.weebl_uri_cache_file = None
+        cli.date_range_page_size = 500
+        cli.workers = 1
         cli.multi_bugs_in_pl = "test_tempest_smoke"
         self.max_sequence_size = '10000'
         cli.bug_tracker_bugs_url = "https://bugs.launchpad.net/oil/+bug/{}"
@@ -145,3 +176,50 @@ class CommonTestMethods(DobermanTestBase):
         database = os.path.join(self.DB_files, bugs_database)
         with open(database, "r") as mock_db_file:
             return yaml.load(mock_db_file)['bugs']
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = 1
+
+    def do_GET(self):
+        if self.path.startswith('/auth'):
+            body = self.headers.get('Authorization', '')
+        else:
+            body = self.headers.get('Cookie', '')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class ProgressiveTextHandler(BaseHTTPRequestHandler):
+    """ Serves a build log the way jenkins' logText/progressiveText does. """
+    protocol_version = 'HTTP/1.1'
+    timeout = 1
+    log = "".join(["Line {} of the console\n".format(n) for n in range(500)])
+    queries = []
+
+    def do_GET(self):
+        query = self.path.split('?')[1]
+        self.queries.append(query)
+        body = self.log[int(query.split('start=')[1]):]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Text-Size', str(len(self.log)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
@@ -1,5 +1,6 @@
-from common_test_methods import CommonTestMethods
+from common_test_methods import CommonTestMethods, KeepAliveHandler
 from doberman.common.base import DobermanBase
+from doberman.common.session_requester import SessionRequester
 
 
 class CommonMethodsTests(CommonTestMethods):
@@ -57,3 +58,44 @@ class CommonMethodsTests(CommonTestMethods):
         self.assertEqual(gooddict, testdict2)
         testdict2 = DobermanBase().join_dicts(None, None)
         self.assertEqual({}, testdict2)
+
+    def test_merge_dicts_matches_join_dicts(self):
+        base = DobermanBase()
+        new_dicts = [{'pipeline1': {'bug1': {'a': 'a'}}},
+                     None,
+                     {'pipeline2': {'bug2': {'b': 'b'}}},
+                     {},
+                     {'pipeline1': {'bug3': {'c': 'c'}, 'bug1': {'d': 'd'}}}]
+        joined = {}
+        merged = {}
+        for new_dict in new_dicts:
+            joined = base.join_dicts(joined, new_dict)
+            self.assertIs(merged, base.merge_dicts(merged, new_dict))
+        self.assertEqual(joined, merged)
+        self.assertEqual({'a': 'a'}, new_dicts[0]['pipeline1']['bug1'])
+
+    def test_session_requester_reuses_connections(self):
+        url = self.serve(KeepAliveHandler) + '/'
+        requester = SessionRequester(baseurl=url, cookies={'pysid': 'x'})
+        try:
+            for n in range(5):
+                response = requester.get_url(url + str(n))
+                self.assertEqual('pysid=x', response.text)
+            self.assertEqual(5, requester.requests_made)
+            self.assertEqual(1, requester.connections_opened())
+        finally:
+            requester.close()
+
+    def test_session_requester_sends_credentials(self):
+        url = self.serve(KeepAliveHandler) + '/'
+        requester = SessionRequester(baseurl=url, username='user',
+                                     password='secret', ssl_verify=False)
+        try:
+            response = requester.get_url(url + 'auth')
+            self.assertEqual('Basic dXNlcjpzZWNyZXQ=', response.text)
+            response = requester.post_url(url + 'auth', data='x')
+            self.assertEqual('Basic dXNlcjpzZWNyZXQ=', response.text)
+            self.assertEqual(False, requester.get_request_dict()['verify'])
+        finally:
+            requester.close()
+
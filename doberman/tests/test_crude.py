@@ -1,10 +1,36 @@
 import os
+import re
+import shutil
 import yaml
 import pytz
-from common_test_methods import CommonTestMethods
+import tarfile
+import tempfile
+import time
+import threading
+from StringIO import StringIO
+from common_test_methods import CommonTestMethods, ProgressiveTextHandler
 from doberman.analysis.analysis import CrudeAnalysis
+from doberman.analysis.regex_bank import RegexBank
+from doberman.analysis.build_files import BuildFiles
+from doberman.analysis.triage_writer import TriageWriter
+from doberman.analysis.crude_weebl import WeeblClass, shared_weebl_client
+from doberman.analysis.oil_spill import OilSpill
+from doberman.analysis.bugoccurrence_submitter import BugOccurrence
+from doberman.analysis.bugoccurrence_submitter import BugOccurrenceSubmitter
+from doberman.analysis.weebl_uri_cache import shared_weebl_uri_cache
+from doberman.analysis.weebl_uri_cache import WeeblUriCache
+from weeblclient.exception import UnrecognisedInstance, InstanceAlreadyExists
+from doberman.analysis.crude_jenkins import Jenkins, Build
+from doberman.analysis.checkpoints import BuildCheckpoints
+from doberman.analysis.download_pool import DownloadPool
+from doberman.common.session_requester import SessionRequester
+from doberman.analysis.multi_pattern import MultiPattern
+from doberman.analysis.regex_literals import required_literals
 from doberman.common.options_parser import OptionsParser
 from datetime import datetime
+from lxml import etree
+from multiprocessing.pool import ThreadPool
+from mock import MagicMock, patch
 
 
 class CrudeAnalysisTests(CommonTestMethods):
@@ -29,6 +55,169 @@ class CrudeAnalysisTests(CommonTestMethods):
         data = self.get_crude_output_data()
         self.assertIn("fake_bug_01", data['bugs'])
 
+    def test_find_console_bug_when_streaming_console(self):
+        cli = self.populate_cli_var("fake_bug_01_database.yml")
+        cli.stream_files_above = 0
+        cli.stream_chunk_size = 64
+        analysis = CrudeAnalysis(cli)
+        data = self.get_crude_output_data()
+        self.assertIn("fake_bug_01", data['bugs'])
+
+    def test_find_console_bug_in_memory_mapped_console(self):
+        cli = self.populate_cli_var("fake_bug_01_database.yml")
+        cli.artifact_access = 'mmap'
+        analysis = CrudeAnalysis(cli)
+        data = self.get_crude_output_data()
+        self.assertIn("fake_bug_01", data['bugs'])
+
+    def test_rerun_resumes_from_checkpoints(self):
+        self.tmpdir = tempfile.mkdtemp()
+        cli = self.populate_cli_var("fake_bug_01_database.yml")
+        cli.checkpoint_dir = self.tmpdir
+        analysis = CrudeAnalysis(cli)
+        self.assertEqual(1, cli.checkpoints.saved)
+        first = self.get_crude_output_data()['bugs']
+        # Same bugs, so nothing is scanned again:
+        cli = self.populate_cli_var("fake_bug_01_database.yml")
+        cli.checkpoint_dir = self.tmpdir
+        with patch('doberman.analysis.oil_spill.OilSpill.bug_hunt',
+                   side_effect=AssertionError("Scanned again")):
+            analysis = CrudeAnalysis(cli)
+        self.assertEqual((1, 0), (cli.checkpoints.reused,
+                                  cli.checkpoints.saved))
+        self.assertEqual(first, self.get_crude_output_data()['bugs'])
+        # Different bugs for the job, so it is scanned again:
+        cli = self.populate_cli_var("blank_database.yml")
+        cli.checkpoint_dir = self.tmpdir
+        analysis = CrudeAnalysis(cli)
+        self.assertEqual((0, 1), (cli.checkpoints.reused,
+                                  cli.checkpoints.saved))
+        self.assertNotIn("fake_bug_01", self.get_crude_output_data()['bugs'])
+        # Different output settings, so it is scanned again:
+        cli = self.populate_cli_var("blank_database.yml")
+        cli.checkpoint_dir = self.tmpdir
+        cli.reduced_output_text = True
+        analysis = CrudeAnalysis(cli)
+        self.assertEqual((0, 1), (cli.checkpoints.reused,
+                                  cli.checkpoints.saved))
+
+    def test_checkpoint_text_read_back_from_build_files(self):
+        self.tmpdir = tempfile.mkdtemp()
+        build_dir = os.path.join(self.tmpdir, 'pipeline_deploy', '1')
+        os.makedirs(build_dir)
+        console = os.path.join(build_dir, 'pipeline_deploy_console.txt')
+        with open(console, 'w') as console_file:
+            console_file.write("start\n" + "x" * 1000 + "\nend\n")
+        with open(os.path.join(build_dir, 'tempest_xunit.xml'), 'w') as xml:
+            xml.write('<testsuite><testcase classname="c" name="n">'
+                      '<failure message="boom begin captured logging ..."/>'
+                      '</testcase></testsuite>')
+        matching_bugs = {
+            'console': {'additional info': {
+                'target file': 'pipeline_deploy_console.txt',
+                'text': "x" * 1000 + "\nend\n"}},
+            'xunit': {'additional info': {
+                'target file': 'tempest_xunit.xml', 'xunit class': 'c',
+                'xunit name': 'n', 'text': 'boom '}},
+            'no text': {'additional info': {'error': 'console not present'}}}
+        checkpoints = BuildCheckpoints(
+            MagicMock(), self.tmpdir, 'http://jenkins', {})
+        checkpoints.save('pipeline_deploy', '1', 'pl1', matching_bugs)
+        with open(checkpoints.path('pipeline_deploy', '1')) as saved:
+            self.assertNotIn("x" * 1000, saved.read())
+        (bugs, occurrences) = checkpoints.load('pipeline_deploy', '1', 'pl1',
+                                               build_dir)
+        self.assertEqual(matching_bugs, bugs)
+        # Once the text is not in the files any more, the build is rescanned:
+        with open(console, 'w') as console_file:
+            console_file.write("start\nend\n")
+        self.assertIsNone(checkpoints.load('pipeline_deploy', '1', 'pl1',
+                                           build_dir))
+
+    def test_resumed_build_resubmits_its_bug_occurrences(self):
+        self.tmpdir = tempfile.mkdtemp()
+        cli = self.populate_cli_var("fake_bug_01_database.yml")
+        cli.use_weebl = True
+        cli.checkpoints = BuildCheckpoints(
+            cli.LOG, self.tmpdir, cli.jenkins_host, {}, cli.xmls)
+        occurrence = BugOccurrence(
+            '1', 'pipeline_deploy', 'pl1', 'test_name', 'test_class',
+            'tempest', '1.0', 'failure', 'regex-uuid')
+        cli.checkpoints.save('pipeline_deploy', '1', 'pl1', {}, [occurrence])
+        cli.bugoccurrences = MagicMock()
+        build = Build('1', 'pipeline_deploy', MagicMock(), {}, cli, 'pl1',
+                      weebl=MagicMock())
+        self.assertEqual(1, cli.checkpoints.reused)
+        cli.bugoccurrences.add.assert_called_once_with(occurrence)
+
+    def test_pipelines_analysed_by_worker_processes(self):
+        self.tmpdir = tempfile.mkdtemp()
+        paabn = {}
+        for num in range(4):
+            pipeline = "aaaaaaaa-bbbb-cccc-dddd-{0:012d}".format(num)
+            build_num = "0000{}".format(num)
+            paabn[pipeline] = {'pipeline_deploy': build_num}
+            shutil.copytree(
+                os.path.join(self.mock_output_data, 'pipeline_deploy',
+                             '00000'),
+                os.path.join(self.tmpdir, 'pipeline_deploy', build_num))
+        with open(os.path.join(self.tmpdir, 'pipelines_and_associated_'
+                               'build_numbers.yml'), 'w') as paabn_file:
+            paabn_file.write(yaml.safe_dump(paabn))
+        outputs = []
+        for workers in [1, 3]:
+            cli = self.populate_cli_var("fake_bug_01_database.yml",
+                                        reportdir=self.tmpdir)
+            cli.workers = workers
+            analysis = CrudeAnalysis(cli)
+            self.assertEqual(0, analysis.message)
+            self.assertEqual(4, cli.regex_bank.prefilter_counts()[0])
+            output = self.get_output_data('triage_pipeline_deploy.yml',
+                                          self.tmpdir)['pipeline']
+            for pipeline in output.values():
+                pipeline.pop('Crude-Analysis timestamp')
+            outputs.append(output)
+        self.assertEqual(sorted(paabn.keys()), sorted(outputs[0].keys()))
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_hit_removes_only_its_own_tests_unfiled_xml_fails(self):
+        self.tmpdir = tempfile.mkdtemp()
+        job = 'test_tempest_smoke'
+        pipeline = "aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee"
+        build_dir = os.path.join(self.tmpdir, job, '00001')
+        shutil.copytree(os.path.join(self.mock_output_data, 'pipeline_deploy',
+                                     '00000'), build_dir)
+        os.rename(os.path.join(build_dir, 'pipeline_deploy_console.txt'),
+                  os.path.join(build_dir, job + '_console.txt'))
+        with open(os.path.join(build_dir, 'tempest_xunit.xml'), 'w') as xunit:
+            xunit.write(
+                '<testsuite>'
+                '<testcase classname="hit_class" name="hit_test">'
+                '<failure message="the needle is here"/>'
+                '<error message="something else"/></testcase>'
+                '<testcase classname="other_class" name="other_test">'
+                '<failure message="unrelated"/></testcase>'
+                '</testsuite>')
+        with open(os.path.join(self.tmpdir, 'pipelines_and_associated_'
+                               'build_numbers.yml'), 'w') as paabn_file:
+            paabn_file.write(yaml.safe_dump({pipeline: {job: '00001'}}))
+        database = os.path.join(self.tmpdir, 'database.yml')
+        with open(database, 'w') as database_file:
+            database_file.write(yaml.safe_dump({'bugs': {'needle_bug': {
+                'category': 'None', 'description': 'needle',
+                job: [{'tempest_xunit.xml': {'regexp': ['needle']}}]}}}))
+        cli = self.populate_cli_var("blank_database.yml",
+                                    reportdir=self.tmpdir)
+        cli.database = database
+        cli.job_names = [job]
+        analysis = CrudeAnalysis(cli)
+        bugs = self.get_output_data('triage_{}.yml'.format(job), self.tmpdir)[
+            'pipeline'][pipeline]['bugs']
+        self.assertIn('needle_bug', bugs)
+        unfiled = [bug['additional info']['xunit class'] for bug_id, bug in
+                   bugs.items() if bug_id.startswith('unfiled-')]
+        self.assertEqual(['other_class'], unfiled)
+
     def test_find_unfiled_console_bug(self):
         cli = self.populate_cli_var("blank_database.yml")
         analysis = CrudeAnalysis(cli)
@@ -112,6 +301,780 @@ class CrudeAnalysisTests(CommonTestMethods):
                     print(bug_num)
         self.assertEqual([], failed_bugs)
 
+    def test_regex_bank_is_keyed_by_bug_job_file_and_branch(self):
+        bugs = self.get_bugs_from_file("fake_bug_01_database.yml")
+        regex_bank = RegexBank(bugs)
+        banked = regex_bank.get(
+            "fake_bug_01", "pipeline_deploy", "console.txt", 0)
+        self.assertEqual(["check_timeout"], banked.regexps)
+        self.assertIsNone(regex_bank.get(
+            "fake_bug_01", "pipeline_prepare", "console.txt", 0))
+        self.assertEqual(6, len(regex_bank))
+
+    def test_regex_bank_indexes_bugs_by_job_and_target_file(self):
+        bugs = self.get_bugs_from_file("fake_bug_01_database.yml")
+        regex_bank = RegexBank(bugs)
+        targets = regex_bank.targets_for_job("pipeline_deploy")
+        self.assertEqual(["console.txt"], targets.keys())
+        self.assertEqual(sorted([("0000000", 0), ("fake_bug_01", 0)]),
+                         sorted(targets["console.txt"]))
+        self.assertEqual(["0000000"],
+                         regex_bank.bug_ids_for_job("pipeline_prepare"))
+        self.assertEqual([], regex_bank.bug_ids_for_job("not_a_job"))
+
+    def test_found_in_agrees_with_findall(self):
+        regex_bank = RegexBank()
+        texts = ["", "abc", "ERROR: b\nb", "aaa"]
+        for regexp in ["b", "(a)?b", "x*", "a|(c)", "^b$", "ERROR.*b"]:
+            banked = regex_bank.compile_regexps([regexp])
+            for text in texts:
+                self.assertEqual(bool(banked.pattern.findall(text)),
+                                 banked.found_in(text), (regexp, text))
+
+    def test_crude_analysis_shares_one_regex_bank(self):
+        cli = self.populate_cli_var("fake_bug_01_database.yml")
+        analysis = CrudeAnalysis(cli)
+        self.assertIsInstance(analysis.cli.regex_bank, RegexBank)
+        self.assertIs(analysis.cli.regex_bank,
+                      analysis.weebl_tools.regex_bank)
+
+    def test_multi_pattern_reports_every_matching_regexp(self):
+        regexps = {'overlapping': "Deployment failed.*No route",
+                   'shorter_prefix': "Deployment",
+                   'later': "route to host",
+                   'no_prefix': ".*route",
+                   'missing': "Could not query juju status",
+                   'missing_no_prefix': ".*never seen"}
+        multi_pattern = MultiPattern()
+        for pattern_id, regexp in regexps.items():
+            multi_pattern.add(pattern_id, re.compile(regexp, re.DOTALL))
+        text = "ERROR Deployment failed: No route to host\n"
+        expected = set([pattern_id for pattern_id, regexp in regexps.items()
+                        if re.search(regexp, text, re.DOTALL)])
+        self.assertEqual(expected, multi_pattern.scan(text))
+        self.assertEqual(set(['overlapping', 'shorter_prefix', 'later',
+                              'no_prefix']), expected)
+
+    def test_overlapping_literals_found_in_one_screening_pass(self):
+        multi_pattern = MultiPattern()
+        multi_pattern.MAX_SCREENS = 2
+        literals = ["failed to", "failed to deploy", "to deploy juju",
+                    "juju status"]
+        for literal in literals:
+            multi_pattern.add(literal, re.compile(literal, re.DOTALL))
+        entries = multi_pattern.patterns.values()
+        text = "xfailed to deploy juju status failed"
+        self.assertEqual(dict([(literal, text.find(literal))
+                               for literal in literals]),
+                         multi_pattern.find_literals(text, entries))
+        with patch('doberman.analysis.multi_pattern.re.compile',
+                   side_effect=re.compile) as compiled:
+            for repeat in range(3):
+                multi_pattern.find_literals(text, entries[:1])
+                multi_pattern.find_literals(text, entries)
+            self.assertEqual(1, compiled.call_count)
+            # Only the least recently used screen is dropped when full:
+            multi_pattern.find_literals(text, entries[:2])
+            multi_pattern.find_literals(text, entries)
+            self.assertEqual(2, compiled.call_count)
+
+    def test_required_literals_are_extracted_longest_first(self):
+        regexp = re.compile("ERROR.*Deployment failed..*No route to host",
+                            re.DOTALL)
+        self.assertEqual(['Deployment failed', 'No route to host', 'ERROR'],
+                         required_literals(regexp))
+        optional = re.compile("failed (to build|in ERROR)?", re.DOTALL)
+        self.assertEqual(['failed '], required_literals(optional))
+        self.assertEqual([], required_literals(re.compile("(?i)hook failed")))
+
+    def test_literal_prefilter_counts_avoided_regexp_evaluations(self):
+        bugs = self.get_bugs_from_file("fake_bug_01_database.yml")
+        regex_bank = RegexBank(bugs)
+        banked = regex_bank.get(
+            "fake_bug_01", "pipeline_deploy", "console.txt", 0)
+        self.assertFalse(regex_bank.prefilter(banked, "nothing to see"))
+        self.assertTrue(regex_bank.prefilter(banked, "in check_timeout"))
+        self.assertEqual((1, 1), regex_bank.prefilter_counts())
+
+    def test_build_files_reads_each_artifact_once(self):
+        path = os.path.join(self.mock_output_data, 'pipeline_deploy', '00000')
+        console = os.path.join(path, 'pipeline_deploy_console.txt')
+        build_files = BuildFiles(path)
+        first_read = build_files.read(console)
+        second_read = build_files.read(console)
+        self.assertIs(first_read, second_read)
+        self.assertEqual(1, build_files.files_read)
+        self.assertEqual(os.path.getsize(console), build_files.bytes_read)
+
+    def test_build_files_expands_each_glob_once(self):
+        path = os.path.join(self.mock_output_data, 'pipeline_deploy', '00000')
+        build_files = BuildFiles(path)
+        globs = build_files.glob('*_console.txt')
+        self.assertEqual(
+            [os.path.join(path, 'pipeline_deploy_console.txt')], globs)
+        self.assertIs(globs, build_files.glob('*_console.txt'))
+
+    def test_build_files_maps_empty_and_non_empty_files(self):
+        path = os.path.join(self.mock_output_data, 'pipeline_deploy', '00000')
+        console = os.path.join(path, 'pipeline_deploy_console.txt')
+        build_files = BuildFiles(path, use_mmap=True)
+        with open(console, 'r') as f:
+            self.assertEqual(f.read(), build_files.text(console))
+        self.assertEqual(os.path.getsize(console), build_files.bytes_read)
+        self.tmpdir = tempfile.mkdtemp()
+        empty = os.path.join(self.tmpdir, 'empty_console.txt')
+        open(empty, 'w').close()
+        self.assertEqual('', build_files.read(empty))
+        build_files.close()
+
+    def test_build_files_parses_each_xunit_file_once(self):
+        self.tmpdir = tempfile.mkdtemp()
+        xunit = os.path.join(self.tmpdir, 'tempest_xunit.xml')
+        self.create_mock_xml_files({xunit: [('1', 'first'), ('2', 'second')]})
+        doc = etree.parse(xunit).getroot()
+        expected = [(fail.getparent().get('classname'),
+                     fail.getparent().get('name'), fail.tag,
+                     fail.get('message')) for fail in
+                    doc.xpath('.//failure') + doc.xpath('.//error')]
+        build_files = BuildFiles(self.tmpdir)
+        failures = build_files.xunit_failures(xunit)
+        self.assertEqual(expected, [tuple(fail) for fail in failures])
+        self.assertEqual('fake_class_2', failures[1].classname)
+        self.assertIs(failures, build_files.xunit_failures(xunit))
+
+    def test_xunit_failures_after_a_leading_comment(self):
+        self.tmpdir = tempfile.mkdtemp()
+        xunit = os.path.join(self.tmpdir, 'tempest_xunit.xml')
+        with open(xunit, 'w') as xunit_file:
+            xunit_file.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<!-- generated -->\n'
+                '<testsuite><testcase classname="a" name="b">'
+                '<failure message="oops"/></testcase></testsuite>\n')
+        failures = BuildFiles(self.tmpdir).xunit_failures(xunit)
+        self.assertEqual([('a', 'b', 'failure', 'oops')],
+                         [tuple(fail) for fail in failures])
+
+    def test_scanning_windows_finds_the_same_regexps_as_whole_file(self):
+        path = os.path.join(self.mock_output_data, 'pipeline_deploy', '00000')
+        console = os.path.join(path, 'pipeline_deploy_console.txt')
+        with open(console, 'r') as f:
+            text = f.read()
+        multi_pattern = MultiPattern()
+        for pattern_id, regexp in enumerate(
+                ["Started by.{0,200}workspace", "ERROR.*Finished",
+                 "^Started", "Finished: SUCCESS", "Finished: FAILURE"]):
+            multi_pattern.add(pattern_id, re.compile(regexp, re.DOTALL))
+        build_files = BuildFiles(path, 0, chunk_size=256, overlap_lines=3)
+        self.assertEqual(multi_pattern.scan(text), multi_pattern.scan_windows(
+            build_files.windows(console), build_files.overlap_lines,
+            lambda: build_files.read(console)))
+
+    def test_jenkins_fetches_each_job_build_listing_once(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        jenkins = Jenkins(cli)
+        jenkins.jenkins_api = MagicMock()
+        jenkins_job = jenkins.jenkins_api.__getitem__.return_value
+        jenkins_job.get_data.return_value = {'builds': [
+            {'number': 2, 'result': None, 'duration': 0, 'timestamp': 2},
+            {'number': 1, 'result': 'SUCCESS', 'duration': 9,
+             'timestamp': 1}]}
+        self.assertEqual('SUCCESS', jenkins.build_details(
+            'pipeline_deploy', '00001')['result'])
+        self.assertEqual(0, jenkins.build_details(
+            'pipeline_deploy', 2)['duration'])
+        self.assertIsNone(jenkins.build_details('pipeline_deploy', 3))
+        # A build listed as running is checked again when it is fetched:
+        build = MagicMock(buildno=2, _data={'result': None, 'duration': 0,
+                                            'timestamp': 2})
+        self.assertTrue(jenkins.still_running('pipeline_deploy', build))
+        build._data = {'result': 'FAILURE', 'duration': 5, 'timestamp': 2}
+        self.assertFalse(jenkins.still_running('pipeline_deploy', build))
+        self.assertEqual('FAILURE', jenkins.build_details(
+            'pipeline_deploy', 2)['result'])
+        self.assertEqual(1, jenkins_job.get_data.call_count)
+        self.assertEqual({'tree': Jenkins.BUILD_TREE},
+                         jenkins_job.get_data.call_args[1]['params'])
+
+    def test_download_pool_retries_and_limits_each_host(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        pool = DownloadPool(cli.LOG, workers=8, per_host=2, retries=1,
+                            backoff=0)
+        attempts = []
+        active = {'now': 0, 'most': 0}
+
+        def download(name):
+            with pool.lock:
+                active['now'] += 1
+                active['most'] = max(active['most'], active['now'])
+                attempts.append(name)
+            time.sleep(0.01)
+            with pool.lock:
+                active['now'] -= 1
+            if name == 'flaky' and attempts.count(name) == 1:
+                raise IOError("Connection reset")
+            if name == 'broken':
+                raise IOError("Not found")
+            return 10
+
+        names = ['flaky', 'broken'] + ['file{}'.format(n) for n in range(6)]
+        results = pool.map(lambda name: pool.fetch(
+            'http://jenkins/' + name, lambda: download(name), name), names)
+        self.assertEqual([True, False] + [True] * 6, results)
+        self.assertEqual((7, 70, 2, 1), (pool.files, pool.bytes,
+                                         pool.retried, pool.failed))
+        self.assertEqual(2, active['most'])
+        self.assertIn("7 files", pool.report())
+
+    def test_console_is_streamed_and_resumed(self):
+        url = self.serve(ProgressiveTextHandler)
+        cli = self.populate_cli_var("blank_database.yml")
+        jenkins = Jenkins(cli)
+        jenkins.requester = SessionRequester(baseurl=url)
+        build = MagicMock(baseurl=url + '/job/pipeline_deploy/1/')
+        self.tmpdir = tempfile.mkdtemp()
+        console = os.path.join(self.tmpdir, 'pipeline_deploy_console.txt')
+        # As if a previous attempt got the first 10 bytes, then failed:
+        with open(console + '.part', 'w') as partial:
+            partial.write(ProgressiveTextHandler.log[:10] + 'garbage')
+        with open(console + '.offset', 'w') as offset:
+            offset.write('10 10')
+        try:
+            size = jenkins.write_console_to_file(
+                build, self.tmpdir, 'pipeline_deploy')
+        finally:
+            jenkins.requester.close()
+        with open(console, 'r') as f:
+            self.assertEqual(ProgressiveTextHandler.log + '\n', f.read())
+        self.assertEqual(os.path.getsize(console), size)
+        self.assertEqual(['pipeline_deploy_console.txt'],
+                         os.listdir(self.tmpdir))
+        self.assertEqual(['start=10'], ProgressiveTextHandler.queries)
+
+    def test_failed_console_stream_is_closed(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        jenkins = Jenkins(cli)
+        response = MagicMock(status_code=500)
+        jenkins.requester = MagicMock()
+        jenkins.requester.get_url.return_value = response
+        self.tmpdir = tempfile.mkdtemp()
+        build = MagicMock(baseurl='http://jenkins/job/pipeline_deploy/1/')
+        self.assertRaises(Exception, jenkins.stream_console_to_file, build,
+                          os.path.join(self.tmpdir, 'console.txt'))
+        response.close.assert_called_once_with()
+
+    def test_archive_extracts_only_targeted_files(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        cli.regex_bank = RegexBank({'bug1': {'pipeline_deploy': [
+            {'*_unit-*.log': {'regexp': ['hook failed']}}]}})
+        self.tmpdir = tempfile.mkdtemp()
+        contents = {'var/log/juju/unit-mysql-0.log': 'hook failed\n' * 1000,
+                    'var/log/syslog': 'noise\n' * 1000,
+                    'juju_status.yaml': 'machines: {}\n'}
+        artifact = MagicMock(filename='juju-logs.tar.gz')
+        extracted = {}
+        for extract_targeted_only in [True, False]:
+            cli.extract_targeted_only = extract_targeted_only
+            outdir = os.path.join(self.tmpdir, str(extract_targeted_only))
+            os.mkdir(outdir)
+            with tarfile.open(os.path.join(outdir, artifact.filename),
+                              'w:gz') as tar:
+                for name, content in contents.items():
+                    info = tarfile.TarInfo(name)
+                    info.size = len(content)
+                    tar.addfile(info, StringIO(content))
+            Jenkins(cli).extract_and_delete_archive(outdir, artifact.filename)
+            extracted[extract_targeted_only] = sorted(os.listdir(outdir))
+        self.assertEqual(['juju_status.yaml', 'var_log_juju_unit-mysql-0.log'],
+                         extracted[True])
+        self.assertEqual(['juju_status.yaml', 'var_log_juju_unit-mysql-0.log',
+                          'var_log_syslog'], extracted[False])
+        with open(os.path.join(self.tmpdir, 'True',
+                               'var_log_juju_unit-mysql-0.log'), 'r') as f:
+            self.assertEqual(contents['var/log/juju/unit-mysql-0.log'],
+                             f.read())
+
+    def test_artifact_cache_shared_across_runs(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        self.tmpdir = tempfile.mkdtemp()
+        cli.artifact_cache_dir = os.path.join(self.tmpdir, 'cache')
+        cli.artifact_cache_size = 25
+        downloads = []
+
+        def save_to_dir(outdir, name, content):
+            downloads.append(name)
+            with open(os.path.join(outdir, name), 'w') as f:
+                f.write(content)
+
+        build = MagicMock(buildno=1)
+        build.job.name = 'pipeline_deploy'
+        # Two identical artifacts are only stored once:
+        artifacts = []
+        for name, content in [('a.txt', 'x' * 10), ('b.txt', 'x' * 10),
+                              ('c.txt', 'y' * 10), ('d.txt', 'z' * 10)]:
+            artifact = MagicMock(filename=name, relative_path='logs/' + name,
+                                 build=build)
+            artifact.save_to_dir.side_effect = \
+                lambda outdir, name=name, content=content: save_to_dir(
+                    outdir, name, content)
+            artifacts.append(artifact)
+        for run in ['first', 'second']:
+            outdir = os.path.join(self.tmpdir, run)
+            os.mkdir(outdir)
+            jenkins = Jenkins(cli)
+            for artifact in artifacts[:3]:
+                self.assertEqual(10, jenkins.save_artifact(artifact, outdir))
+            with open(os.path.join(outdir, 'c.txt'), 'r') as f:
+                self.assertEqual('y' * 10, f.read())
+        self.assertEqual(['a.txt', 'b.txt', 'c.txt'], downloads)
+        self.assertEqual((3, 0, 20), (jenkins.cache.hits,
+                                      jenkins.cache.misses,
+                                      jenkins.cache.size))
+        # The least recently used content ('x' * 10) is evicted first:
+        for path, size, used in jenkins.cache.objects():
+            os.utime(path, (0, 0) if 'x' * 10 in open(path).read() else None)
+        jenkins.save_artifact(artifacts[3], outdir)
+        self.assertEqual(20, jenkins.cache.size)
+        self.assertEqual(1, jenkins.cache.evicted)
+        self.assertEqual(2, len(os.listdir(jenkins.cache.keys_dir)))
+        self.assertIn("3 of 4 files cached", jenkins.cache.report())
+
+    def test_cached_build_restored_without_asking_jenkins(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        self.tmpdir = tempfile.mkdtemp()
+        cli.reportdir = os.path.join(self.tmpdir, 'first')
+        cli.artifact_cache_dir = os.path.join(self.tmpdir, 'cache')
+        build = MagicMock(buildno=1, _data={'duration': 10})
+        build.job.name = 'pipeline_deploy'
+        build.get_console.return_value = 'the console'
+        artifact = MagicMock(filename='oil_nodes', relative_path=None,
+                             build=build)
+        artifact.save_to_dir.side_effect = lambda outdir: open(
+            os.path.join(outdir, 'oil_nodes'), 'w').write('nodes')
+        build.get_artifacts.return_value = [artifact]
+        for run in ['first', 'second']:
+            cli.reportdir = os.path.join(self.tmpdir, run)
+            jenkins = Jenkins(cli)
+            jenkins.jenkins_api = MagicMock()
+            jenkins.jenkins_api['pipeline_deploy'].get_build.return_value = \
+                build
+            jenkins.job_build_lists['pipeline_deploy'] = []
+            jenkins.job_build_index['pipeline_deploy'] = {}
+            self.assertFalse(jenkins.get_triage_data(
+                '1', 'pipeline_deploy', cli.reportdir))
+            outdir = os.path.join(cli.reportdir, 'pipeline_deploy', '1')
+            self.assertEqual(['oil_nodes', 'pipeline_deploy_console.txt'],
+                             sorted(os.listdir(outdir)))
+        self.assertFalse(jenkins.jenkins_api['pipeline_deploy'].get_build
+                         .called)
+        self.assertEqual(1, build.get_artifacts.call_count)
+        self.assertEqual(2, jenkins.cache.hits)
+
+    def test_partly_prefetched_build_removed(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        self.tmpdir = tempfile.mkdtemp()
+        cli.reportdir = self.tmpdir
+        cli.download_retries = 0
+        builds = {}
+        for build_num in [1, 2]:
+            build = MagicMock(buildno=build_num, _data={'duration': 10})
+            build.job.name = 'pipeline_deploy'
+            build.get_console.return_value = 'the console'
+            artifacts = []
+            for name in ['oil_nodes', 'juju_status.yaml']:
+                artifact = MagicMock(filename=name, relative_path=None,
+                                     build=build)
+                if (build_num, name) == (2, 'juju_status.yaml'):
+                    artifact.save_to_dir.side_effect = IOError("Jenkins down")
+                else:
+                    artifact.save_to_dir.side_effect = \
+                        lambda outdir, name=name: open(
+                            os.path.join(outdir, name), 'w').write(name)
+                artifacts.append(artifact)
+            build.get_artifacts.return_value = artifacts
+            builds[build_num] = build
+        jenkins = Jenkins(cli)
+        jenkins.jenkins_api = MagicMock()
+        jenkins.jenkins_api['pipeline_deploy'].get_build.side_effect = \
+            lambda build_num: builds[build_num]
+        jenkins.job_build_lists['pipeline_deploy'] = []
+        jenkins.job_build_index['pipeline_deploy'] = {}
+        jenkins.prefetch_triage_data([('pl1', 'pipeline_deploy', '1'),
+                                      ('pl2', 'pipeline_deploy', '2')])
+        # The build missing an artifact is left to be downloaded again:
+        self.assertEqual(['1'], os.listdir(
+            os.path.join(self.tmpdir, 'pipeline_deploy')))
+        self.assertEqual(['juju_status.yaml', 'oil_nodes',
+                          'pipeline_deploy_console.txt'], sorted(os.listdir(
+                              os.path.join(self.tmpdir, 'pipeline_deploy',
+                                           '1'))))
+
+    def test_triage_yaml_written_a_pipeline_at_a_time(self):
+        self.tmpdir = tempfile.mkdtemp()
+        pipelines = {}
+        for num in range(3):
+            pipeline = "aaaaaaaa-bbbb-cccc-dddd-{0:012d}".format(num)
+            pipelines[pipeline] = {
+                'build': str(num), 'status': 'FAILURE',
+                'bugs': {'bug{}'.format(num): {
+                    'additional info': {
+                        'text': "  indented\n\nTraceback: 'x': \"y\"\n" * 9,
+                        'unicode': u'caf\xe9'},
+                    'machines': [], 'link to jenkins': 'http://a/b'}}}
+        triage_writer = TriageWriter(self.tmpdir, ['pipeline_deploy',
+                                                   'pipeline_prepare'])
+        for pipeline, entry in reversed(sorted(pipelines.items())):
+            triage_writer.write('pipeline_deploy', {pipeline: entry})
+        # A pipeline written again is merged, as join_dicts would:
+        triage_writer.write('pipeline_deploy', {pipeline: {'build': 'dup'}})
+        pipelines[pipeline] = dict(pipelines[pipeline], build='dup')
+        self.assertEqual(['triage_pipeline_deploy.yml',
+                          'triage_pipeline_prepare.yml'],
+                         sorted(triage_writer.close()))
+        with open(triage_writer.path('pipeline_deploy'), 'r') as f:
+            text = f.read()
+        self.assertEqual({'pipeline': pipelines}, yaml.safe_load(text))
+        # ...in order, whatever order they were written in:
+        positions = [text.index(pipeline) for pipeline in sorted(pipelines)]
+        self.assertEqual(sorted(positions), positions)
+        with open(triage_writer.path('pipeline_prepare'), 'r') as f:
+            self.assertEqual({'pipeline': {}}, yaml.safe_load(f))
+
+    def test_one_weebl_client_and_build_uuids_looked_up_up_front(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        cli.download_retries = 1
+        with patch('doberman.analysis.crude_weebl.Weebl',
+                   side_effect=lambda **kwargs: MagicMock()) as weebl_class:
+            weebl = shared_weebl_client(cli)
+            weebl_tools = WeeblClass(cli)
+            weebl_tools.weebl = weebl_tools.get_weebl_client()
+            self.assertIs(weebl, shared_weebl_client(cli))
+            self.assertIs(weebl_tools.weebl, weebl_tools.get_weebl_client())
+            # One client per API version, each as it was created before:
+            self.assertIsNot(weebl, weebl_tools.weebl)
+            self.assertEqual([None, 'v1'], [
+                kwargs.get('weebl_api_ver') for (args, kwargs) in
+                weebl_class.call_args_list])
+
+        def get_uuid(build_num, job, pipeline):
+            if build_num == '3':
+                raise UnrecognisedInstance()
+            if build_num == '4':
+                raise ValueError("Weebl is down")
+            return "uuid-{}-{}".format(job, build_num)
+
+        weebl.get_build_uuid_from_build_id_job_and_pipeline.side_effect = \
+            get_uuid
+        builds = [('pl1', 'pipeline_deploy', '1'),
+                  ('pl1', 'pipeline_prepare', '2'),
+                  ('pl2', 'pipeline_deploy', '3'),
+                  ('pl2', 'pipeline_prepare', '4')]
+        with patch('doberman.analysis.download_pool.time.sleep'):
+            cli.build_uuids = weebl_tools.get_build_uuids(builds)
+        # Not found is remembered, but a failed lookup is left out:
+        self.assertEqual({('1', 'pipeline_deploy', 'pl1'):
+                          'uuid-pipeline_deploy-1',
+                          ('2', 'pipeline_prepare', 'pl1'):
+                          'uuid-pipeline_prepare-2',
+                          ('3', 'pipeline_deploy', 'pl2'): None},
+                         cli.build_uuids)
+        # (Only the failed lookup was retried)
+        self.assertEqual(5, weebl.get_build_uuid_from_build_id_job_and_pipeline
+                         .call_count)
+        cli.use_weebl = True
+        oil_spill = OilSpill('2', 'pipeline_prepare', {}, cli, 'pl1')
+        self.assertIs(weebl, oil_spill.weebl)
+        self.assertEqual('uuid-pipeline_prepare-2', oil_spill.build_uuid)
+        oil_spill = OilSpill('3', 'pipeline_deploy', {}, cli, 'pl2')
+        self.assertIsNone(oil_spill.build_uuid)
+        self.assertEqual(5, weebl.get_build_uuid_from_build_id_job_and_pipeline
+                         .call_count)
+
+    def test_pipelines_resolved_to_build_numbers_in_bulk(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        cli.job_names = ['pipeline_deploy', 'pipeline_prepare']
+        cli.download_retries = 0
+        pipelines = ['pl{}'.format(num) for num in range(5)]
+        builds = [{'pipeline': '/api/v1/pipeline/{}/'.format(pipeline),
+                   'jobtype': job, 'build_id': '{}-{}'.format(job, pipeline)}
+                  for pipeline in pipelines[:4]
+                  for job in cli.job_names if (pipeline, job) != (
+                      'pl1', 'pipeline_prepare')]
+        requests = []
+
+        def objects(rows, limit, offset, **filters):
+            requests.append(filters)
+            if 'uuid__in' in filters:
+                uuids = filters['uuid__in'].split(',')
+                rows = [{'uuid': uuid} for uuid in uuids if uuid != 'pl4']
+            else:
+                uuids = filters['pipeline__uuid__in'].split(',')
+                rows = [row for row in rows
+                        if row['pipeline'].split('/')[-2] in uuids and
+                        row['jobtype'] == filters['jobtype__name']]
+            return iter(rows[offset:offset + limit])
+
+        weebl = MagicMock()
+        weebl.resources.pipeline.objects.side_effect = \
+            lambda **kwargs: objects([], **kwargs)
+        weebl.resources.build.objects.side_effect = \
+            lambda **kwargs: objects(builds, **kwargs)
+        with patch('doberman.analysis.crude_weebl.Weebl',
+                   return_value=weebl):
+            weebl_tools = WeeblClass(cli)
+        weebl_tools.weebl = weebl
+        weebl_tools.BULK_SIZE = 2
+        build_numbers = weebl_tools.get_pipelines_in_bulk(pipelines)
+        self.assertEqual({'pipeline_deploy': 'pipeline_deploy-pl1',
+                          'pipeline_prepare': None}, build_numbers['pl1'])
+        self.assertEqual(['pl0', 'pl1', 'pl2', 'pl3'], sorted(build_numbers))
+        self.assertEqual('pipeline_prepare-pl3',
+                         build_numbers['pl3']['pipeline_prepare'])
+        # 3 chunks x (pipelines + 2 jobs), plus a request for the next page
+        # after each of the 5 full pages:
+        self.assertEqual(14, len(requests))
+        self.assertEqual(['uuid'], list(set([request['order_by']
+                                             for request in requests])))
+
+    def test_date_range_pipelines_streamed_a_page_at_a_time(self):
+        self.tmpdir = tempfile.mkdtemp()
+        cli = self.populate_cli_var("blank_database.yml",
+                                    reportdir=self.tmpdir)
+        cli.download_workers = 3
+        cli.download_retries = 0
+        cli.date_range_page_size = 5
+        pipelines = ["aaaaaaaa-bbbb-cccc-dddd-{0:012d}".format(num)
+                     for num in range(23)]
+        offsets = []
+
+        def objects(limit, offset, **filters):
+            self.assertEqual('uuid', filters['order_by'])
+            offsets.append(offset)
+            return iter([{'uuid': pipeline} for pipeline in
+                         pipelines[offset:offset + limit]])
+
+        weebl = MagicMock()
+        weebl.resources.pipeline.objects.side_effect = objects
+        with patch('doberman.analysis.crude_weebl.Weebl',
+                   return_value=weebl):
+            weebl_tools = WeeblClass(cli)
+        weebl_tools.weebl = weebl
+        weebl_tools.BULK_SIZE = 10
+        start = datetime(2016, 1, 1, tzinfo=pytz.utc)
+        end = datetime(2016, 2, 1, tzinfo=pytz.utc)
+        self.assertEqual(pipelines, weebl_tools.get_pipelines_from_date_range(
+            start, end))
+        # The first page, then 3 at a time until one is short:
+        self.assertEqual([0, 5, 10, 15, 20, 25, 30], sorted(offsets))
+        # Build numbers are looked up as each BULK_SIZE pipelines arrive:
+        looked_up = []
+        weebl_tools.get_pipelines_in_bulk = lambda chunk: looked_up.append(
+            chunk) or dict([(pipeline, {}) for pipeline in chunk])
+        resolved = []
+        build_numbers = weebl_tools.get_all_pipelines(
+            weebl_tools.iter_pipelines_from_date_range(start, end),
+            resolved.append)
+        self.assertEqual(sorted(pipelines), sorted(build_numbers))
+        self.assertEqual([10, 10, 3], [len(chunk) for chunk in looked_up])
+        # And passed on as they are resolved:
+        self.assertEqual(looked_up, [sorted(chunk) for chunk in resolved])
+        # Missing pages are an error, not fewer pipelines:
+        weebl.resources.pipeline.objects.side_effect = \
+            lambda offset, **kwargs: objects(offset=offset, **kwargs) \
+            if offset != 10 else 1 / 0
+        self.assertRaises(Exception, list,
+                          weebl_tools.iter_pipelines_from_date_range(
+                              start, end))
+
+    def test_builds_prefetched_as_their_pipelines_are_resolved(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        cli.offline_mode = False
+        cli.checkpoints = None
+        analysis = CrudeAnalysis.__new__(CrudeAnalysis)
+        analysis.cli = cli
+        analysis.jenkins = MagicMock()
+        analysis.start_prefetching()
+        resolvers = [threading.Thread(
+            target=analysis.prefetch_resolved,
+            args=({'pl1': {'pipeline_deploy': '1'}},)) for _ in range(4)]
+        for resolver in resolvers:
+            resolver.start()
+        for resolver in resolvers:
+            resolver.join()
+        analysis.pipeline_ids = ['pl1', 'pl2']
+        analysis.build_numbers = {'pl1': {'pipeline_deploy': '1'},
+                                  'pl2': {'pipeline_deploy': '2'}}
+        analysis.prefetch_builds(['pipeline_deploy'])
+        # Each build is only prefetched once:
+        self.assertEqual([('pl1', 'pipeline_deploy', '1'),
+                          ('pl2', 'pipeline_deploy', '2')],
+                         [build for (args, kwargs) in analysis.jenkins
+                          .prefetch_triage_data.call_args_list
+                          for build in args[0]])
+
+    def test_bug_occurrences_submitted_in_background(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        cli.download_retries = 1
+        cli.build_uuids = {('1', 'pipeline_deploy', 'pl1'): 'build-uuid'}
+        weebl = MagicMock()
+        submitter = BugOccurrenceSubmitter(cli, weebl)
+        submitter.pool.backoff = 0
+        weebl_responds = threading.Event()
+        attempts = []
+
+        def get_testcaseinstance_uri(build_num, testcase, *args):
+            if testcase == 'new_testcase':
+                raise UnrecognisedInstance()
+            return 'tci-' + testcase
+
+        def create_bugoccurrence(testcaseinstance_uri, knownbugregex_uri):
+            weebl_responds.wait()
+            attempts.append((testcaseinstance_uri, knownbugregex_uri))
+            if knownbugregex_uri == 'kbr-regex2':
+                raise InstanceAlreadyExists()
+            if len(attempts) == 1:
+                raise IOError("Weebl is down")
+
+        weebl.get_testcaseinstance_resource_uri.side_effect = \
+            get_testcaseinstance_uri
+        weebl.get_testcaseinstance_uri_from_uuid.return_value = 'tci-created'
+        weebl.get_knownbugregex_resource_uri_from_regex_uuid.side_effect = \
+            lambda regex_uuid: 'kbr-' + regex_uuid
+        weebl.create_bugoccurrence.side_effect = create_bugoccurrence
+        occurrences = [BugOccurrence('1', 'pipeline_deploy', 'pl1', testcase,
+                                     'class', 'framework', '1', 'FAILURE',
+                                     regex_uuid)
+                       for (testcase, regex_uuid) in [
+                           ('testcase', 'regex1'), ('new_testcase', 'regex1'),
+                           ('testcase', 'regex1'), ('testcase', 'regex2')]]
+        # Adding never waits for Weebl:
+        for occurrence in occurrences:
+            submitter.add(occurrence)
+        self.assertEqual([], attempts)
+        weebl_responds.set()
+        submitter.close()
+        self.assertEqual(
+            "3 bug occurrences queued (1 duplicates skipped): 2 submitted to "
+            "Weebl, 1 already there, 0 failed",
+            submitter.report())
+        self.assertEqual(4, len(attempts))  # Including the one retried
+        self.assertIn(('tci-created', 'kbr-regex1'), attempts)
+        weebl.create_testcaseinstance.assert_called_once_with(
+            'build-uuid', weebl.set_up_test_framework_caseclass_and_case(),
+            'pl1', 'FAILURE')
+        # One look up per regex and test case instance:
+        self.assertEqual(2, weebl.get_knownbugregex_resource_uri_from_regex_uuid
+                         .call_count)
+        self.assertEqual(2, weebl.get_testcaseinstance_resource_uri
+                         .call_count)
+
+    def test_failed_testcaseinstance_lookup_retried_in_later_batch(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        cli.download_retries = 0
+        weebl = MagicMock()
+        submitter = BugOccurrenceSubmitter(cli, weebl)
+        weebl.get_testcaseinstance_resource_uri.side_effect = [
+            IOError("Weebl is down"), 'tci']
+        weebl.get_knownbugregex_resource_uri_from_regex_uuid.side_effect = \
+            lambda regex_uuid: 'kbr-' + regex_uuid
+        with patch('doberman.analysis.download_pool.ThreadPool',
+                   wraps=ThreadPool) as thread_pool:
+            for regex_uuid in ['regex1', 'regex2']:
+                submitter.add(BugOccurrence('1', 'pipeline_deploy', 'pl1',
+                                            'testcase', 'class', 'framework',
+                                            '1', 'FAILURE', regex_uuid))
+                submitter.flush()
+            submitter.close()
+        # Both batches were submitted on the one pool of threads:
+        self.assertEqual(1, thread_pool.call_count)
+        self.assertIsNone(submitter.pool.threads)
+        self.assertEqual((1, 1), (submitter.submitted, submitter.failed))
+        weebl.create_bugoccurrence.assert_called_once_with('tci',
+                                                           'kbr-regex2')
+
+    def test_batch_failure_only_counts_unsettled_occurrences(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        cli.download_retries = 0
+        cli.LOG = MagicMock()
+        cli.LOG.warn.side_effect = ValueError("Cannot log")
+        weebl = MagicMock()
+        submitter = BugOccurrenceSubmitter(cli, weebl, batch_size=2,
+                                           batch_wait=5)
+        weebl.get_testcaseinstance_resource_uri.return_value = 'tci'
+        weebl.get_knownbugregex_resource_uri_from_regex_uuid.side_effect = \
+            lambda regex_uuid: 'kbr-' + regex_uuid
+
+        def create_bugoccurrence(testcaseinstance_uri, knownbugregex_uri):
+            if knownbugregex_uri == 'kbr-regex2':
+                raise InstanceAlreadyExists()
+
+        weebl.create_bugoccurrence.side_effect = create_bugoccurrence
+        for regex_uuid in ['regex1', 'regex2']:
+            submitter.add(BugOccurrence('1', 'pipeline_deploy', 'pl1',
+                                        'testcase', 'class', 'framework', '1',
+                                        'FAILURE', regex_uuid))
+        submitter.close()
+        self.assertTrue(cli.LOG.error.called)
+        self.assertEqual((1, 1, 0), (submitter.submitted,
+                                     submitter.already_there,
+                                     submitter.failed))
+
+    def test_weebl_uris_cached_between_runs(self):
+        self.tmpdir = tempfile.mkdtemp()
+        cli = self.populate_cli_var("blank_database.yml")
+        cli.weebl_uri_cache_size = 2
+        cli.weebl_uri_cache_file = os.path.join(self.tmpdir, 'uris.yml')
+        uris = shared_weebl_uri_cache(cli)
+        lookups = []
+
+        def lookup(regex_uuid):
+            lookups.append(regex_uuid)
+            return 'kbr-' + regex_uuid
+
+        for regex_uuid in ['regex1', 'regex2', 'regex1', 'regex3', 'regex2']:
+            uris.get('knownbugregex', regex_uuid,
+                     lambda: lookup(regex_uuid))
+        # regex2 was the least recently used when regex3 was added:
+        self.assertEqual(['regex1', 'regex2', 'regex3', 'regex2'], lookups)
+        self.assertEqual("Weebl uri cache: 1 of 5 lookups cached (20.0% hit "
+                         "rate), 2 entries", uris.report())
+        testcase = ['framework', '1', 'class', 'testcase']
+        uris.get('testcase', testcase, lambda: 'testcase-uuid')
+        uris.save()
+        cli = self.populate_cli_var("blank_database.yml")
+        cli.weebl_uri_cache_file = os.path.join(self.tmpdir, 'uris.yml')
+        uris = shared_weebl_uri_cache(cli)
+        self.assertEqual('testcase-uuid', uris.get('testcase', testcase, None))
+        self.assertEqual('kbr-regex2',
+                         uris.get('knownbugregex', 'regex2', None))
+        # Not used against another Weebl:
+        cli = self.populate_cli_var("blank_database.yml")
+        cli.weebl_uri_cache_file = os.path.join(self.tmpdir, 'uris.yml')
+        cli.weebl_url = "http://elsewhere:8000"
+        self.assertEqual("Weebl uri cache: 0 of 0 lookups cached (0.0% hit "
+                         "rate), 0 entries",
+                         shared_weebl_uri_cache(cli).report())
+
+    def test_weebl_uris_learned_by_workers_merged_into_parent(self):
+        cli = self.populate_cli_var("blank_database.yml")
+        parent = shared_weebl_uri_cache(cli)
+        parent.get('knownbugregex', 'regex1', lambda: 'kbr-regex1')
+        self.assertEqual([], parent.take_learned())  # Not in a worker
+        # (As forked:)
+        worker = WeeblUriCache(cli.LOG, cli.weebl_url)
+        worker.entries.update(parent.entries)
+        worker.learned = []
+        testcase = ['framework', '1', 'class', 'testcase']
+        worker.get('knownbugregex', 'regex1', None)
+        worker.get('knownbugregex', 'regex2', lambda: 'kbr-regex2')
+        worker.get('testcase', testcase, lambda: 'testcase-uuid')
+        parent.merge(worker.take_learned())
+        self.assertEqual([], worker.take_learned())
+        self.assertEqual('kbr-regex2',
+                         parent.get('knownbugregex', 'regex2', None))
+        self.assertEqual('testcase-uuid', parent.get('testcase', testcase,
+                                                     None))
+
     def test_date_passing(self):
         options_parser = OptionsParser()
         input_str1 = "1 Dec 80"
@@ -120,3 +1083,4 @@ class CrudeAnalysisTests(CommonTestMethods):
         response2 = options_parser.date_parse(input_str2)
         correct_response = datetime(1980, 12, 1, 0, 0, tzinfo=pytz.utc)
         self.assertEqual(response1, response2, correct_response)
+
@@ -0,0 +1,69 @@
+#! /usr/bin/env python2
+"""
+Compare the old way crude-analysis accumulated each pipeline's results into
+the per-job yaml dict (join_dicts, which deep copies everything merged so
+far on every call) with the current way (merge_dicts, which merges in place),
+for increasing numbers of pipelines.
+
+Run from the top of the source tree:
+
+    python2 tools/benchmark_join_dicts.py -n "100 1000 10000"
+"""
+import os
+import sys
+import time
+import optparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                os.pardir)))
+from doberman.common.base import DobermanBase  # noqa
+
+
+def make_pipeline_result(num):
+    """ Roughly what a Build adds to yamldict[job]['pipeline'] for one
+        pipeline.
+    """
+    pipeline = "aaaaaaaa-bbbb-cccc-dddd-{0:012d}".format(num)
+    bug = {'regexps': {'console.txt': {'regexp': ['Deployment failed']}},
+           'vendors': ['vendor{}'.format(n) for n in range(3)],
+           'machines': ['machine{}'.format(n) for n in range(3)],
+           'units': ['unit{}'.format(n) for n in range(3)],
+           'charms': ['charm{}'.format(n) for n in range(3)],
+           'ports': [], 'states': [], 'slaves': ['slave0'],
+           'link to jenkins': 'http://jenkins/job/pipeline_deploy/1/console',
+           'additional info': {'target file': 'pipeline_deploy_console.txt',
+                               'text': 'x' * 200}}
+    return {pipeline: {'status': 'FAILURE', 'build': str(num),
+                       'bugs': {'bug{}'.format(num % 7): bug}}}
+
+
+def accumulate(merge, results):
+    combined = {}
+    start = time.time()
+    for result in results:
+        combined = merge(combined, result)
+    return (time.time() - start, combined)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--pipelines', action='store', dest='pipelines',
+                      default='100 1000 10000',
+                      help='numbers of pipelines (in quotes, space seperated)')
+    (opts, args) = parser.parse_args()
+
+    base = DobermanBase()
+    print("{0:>10} {1:>16} {2:>17} {3:>8} {4}".format(
+        'pipelines', 'join_dicts (s)', 'merge_dicts (s)', 'speedup', 'same'))
+    for num_pipelines in [int(num) for num in opts.pipelines.split()]:
+        results = [make_pipeline_result(num) for num in range(num_pipelines)]
+        (old_time, old_combined) = accumulate(base.join_dicts, results)
+        (new_time, new_combined) = accumulate(base.merge_dicts, results)
+        print("{0:>10} {1:>16.3f} {2:>17.4f} {3:>7.0f}x {4}".format(
+            num_pipelines, old_time, new_time,
+            old_time / new_time if new_time else 0,
+            old_combined == new_combined))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
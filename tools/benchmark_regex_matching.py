@@ -0,0 +1,119 @@
+#! /usr/bin/env python2
+"""
+Compare the old way crude-analysis checked a console against the bugs
+database (re.compile + findall for every regexp) with the current way (the
+shared RegexBank, scanned once per file by MultiPattern with literal
+prefilters and search), on synthetic consoles of increasing size.
+
+Run from the top of the source tree:
+
+    python2 tools/benchmark_regex_matching.py -d samples/mock_database.yml
+
+or, to try a large database in which every regexp has its own literal (half
+of which appear in the console), instead of a real one:
+
+    python2 tools/benchmark_regex_matching.py -n 2000
+"""
+import os
+import re
+import sys
+import time
+import yaml
+import optparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                os.pardir)))
+from doberman.analysis.regex_bank import RegexBank  # noqa
+
+MOCK_CONSOLE = os.path.join('doberman', 'tests', 'mock_data', 'output',
+                            'pipeline_deploy', '00000',
+                            'pipeline_deploy_console.txt')
+INJECTED = ("\n2016-01-01 00:00:00 ERROR oil_ci.deploy.oil_deployer: "
+            "Deployment failed: [Errno 113] No route to host\n")
+
+
+def findall_matches(bugs, job, target_file, text):
+    """ What OilSpill.rematch used to do for every bug. """
+    hits = set()
+    for bug_id, bug_info in bugs.items():
+        for branch, and_dict in enumerate(bug_info.get(job, [])):
+            regexps = and_dict.get(target_file, {}).get('regexp')
+            if not regexps:
+                continue
+            if type(regexps) == list:
+                regexp = '|'.join(regexps)
+            else:
+                regexp = regexps
+            if re.compile(regexp, re.DOTALL).findall(text):
+                hits.add((bug_id, branch))
+    return hits
+
+
+def search_matches(regex_bank, job, target_file, text):
+    return regex_bank.scanner(job, target_file).scan(text)
+
+
+def many_literal_bugs(job, count):
+    """ A bugs database of count bugs, each with its own literal, and the
+        console lines that hit every other one of them.
+    """
+    bugs = {}
+    hits = []
+    for num in range(count):
+        literal = "oil_ci.check_{0:05d} failed".format(num)
+        bugs["bug_{0:05d}".format(num)] = {job: [{'console.txt': {
+            'regexp': [re.escape(literal) + r": .*error \d+"]}}]}
+        if num % 2 == 0:
+            hits.append("\n{0}: unexpected error {1}\n".format(literal, num))
+    return (bugs, "".join(hits))
+
+
+def make_console(size_mb, injected=INJECTED):
+    with open(MOCK_CONSOLE, 'r') as console:
+        chunk = console.read()
+    repeats = max(1, int(size_mb * 1024 * 1024 / len(chunk)))
+    return chunk * (repeats / 2) + injected + chunk * (repeats - repeats / 2)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-d', '--dburi', action='store', dest='database',
+                      default='samples/mock_database.yml',
+                      help='bugs database yaml')
+    parser.add_option('-j', '--job', action='store', dest='job',
+                      default='pipeline_deploy', help='jenkins job name')
+    parser.add_option('-s', '--sizes', action='store', dest='sizes',
+                      default='1 5 10',
+                      help='console sizes in MB (in quotes, space seperated)')
+    parser.add_option('-n', '--many-literals', action='store', type='int',
+                      dest='many_literals', default=0,
+                      help='use a generated database of this many bugs, '
+                      'each with its own literal, instead of --dburi')
+    (opts, args) = parser.parse_args()
+
+    injected = INJECTED
+    if opts.many_literals:
+        (bugs, injected) = many_literal_bugs(opts.job, opts.many_literals)
+    else:
+        with open(opts.database, 'r') as db_file:
+            bugs = yaml.safe_load(db_file).get('bugs')
+    regex_bank = RegexBank(bugs)
+
+    print("{0:>8} {1:>12} {2:>12} {3:>8} {4}".format(
+        'MB', 'findall (s)', 'search (s)', 'speedup', 'same hits'))
+    for size_mb in [float(size) for size in opts.sizes.split()]:
+        text = make_console(size_mb, injected)
+        start = time.time()
+        old_hits = findall_matches(bugs, opts.job, 'console.txt', text)
+        old_time = time.time() - start
+        start = time.time()
+        new_hits = search_matches(regex_bank, opts.job, 'console.txt', text)
+        new_time = time.time() - start
+        print("{0:>8.1f} {1:>12.2f} {2:>12.2f} {3:>7.1f}x {4}".format(
+            len(text) / 1024.0 / 1024.0, old_time, new_time,
+            old_time / new_time if new_time else 0, old_hits == new_hits))
+    print(regex_bank.prefilter_report())
+
+
+if __name__ == "__main__":
+    sys.exit(main())